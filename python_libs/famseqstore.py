@@ -0,0 +1 @@
+../scripts/famseqstore.py
\ No newline at end of file
@@ -4,6 +4,9 @@ import sys, getopt
 import os
 import gzip
 import re
+import multiprocessing as mp
+import shutil
+from collections import OrderedDict
 #~ from ptg_utils import extractCDSFastaFromGFFandGenomicFasta, extractCDSFastaFromGBFF
 
 daliasrepli = {'ANONYMOUS':'chromosome'}
@@ -25,7 +28,7 @@ def parseCDSFasta(nfcds):
 	if nfcds.endswith('.gz'):
 		fcds = gzip.open(nfcds, 'rb')
 	else:
-		fcds = open(nfcds, 'b')
+		fcds = open(nfcds, 'r')
 	# register unambiguously the exact naming of the CDS sequence in the corresponding extracted CDS sequence file
 	for line in fcds:
 		if line.startswith('>'):
@@ -35,30 +38,75 @@ def parseCDSFasta(nfcds):
 	fcds.close()
 	return dgenbankcdsids
 
-def parseGFFline(line):
-	#~ print line
-	lsp = line.rstrip('\n').split('\t')
-	seqreg = lsp[0].split('|')[-1]	# to account for Prokka-style annotation that prepends 'gnl|Sequencing_Centre' to the region_id
-	annottype = lsp[2]
-	beg = lsp[3]
-	end = lsp[4]
-	strand = lsp[6]
-	desc = dict(d.split('=', 1) for d in lsp[8].split(';'))
-	return (seqreg, annottype, beg, end, strand, desc)
-
-def indexRegionsAndGenes(fgff, dfout, assacc, assname, dtaxid2sciname={}, dmergedtaxid={}):
+# GFF feature types relevant to the output tables; the attribute column of other lines is not parsed
+gfffeaturetypes = set(['region', 'gene', 'pseudogene'] + annottype2fouttag.keys())
+
+def parseGFFattributes(attrs):
+	return dict(d.split('=', 1) for d in attrs.split(';'))
+
+def writeGeneFeatures(dfout, locustag, segments):
+	"""write out the features of a gene once all its lines have been read
+
+	segments are (annottype, seqreg, beg, end, strand, productid, product, lineoutend) tuples, one per GFF line;
+	segments pointing at the same product (CDS/RNA in several segments due to introns, framshifts, ...) are synthesised in one output line;
+	segments pointing at different products are written on separate lines, with new locus_tags to disembiguate the loci.
+	"""
+	lproducts = []
+	dprodsegs = {}
+	for segment in segments:
+		productid = segment[5]
+		if productid not in dprodsegs:
+			lproducts.append(productid)
+			dprodsegs[productid] = []
+		dprodsegs[productid].append(segment)
+	if len(segments) > 1:
+		print "multiline feature:", ' '.join([segment[5] for segment in segments])
+	for k, productid in enumerate(lproducts):
+		prodsegs = dprodsegs[productid]
+		annottype, seqreg, beg, end, strand, productid, product, lineoutend = prodsegs[-1]
+		prodlocustag = locustag
+		if k > 0:
+			print "Warning: multiline feature not pointing at the same product: %s and %s"%(lproducts[0], productid)
+			prodlocustag = "%s_%d"%(locustag, k)
+			print "Create new locus_tag to disembiguate loci:", prodlocustag, "->", productid
+		begs = [segment[2] for segment in prodsegs]
+		ends = [segment[3] for segment in prodsegs]
+		lineout = [productid, seqreg, prodlocustag, min(begs, key=int), max(ends, key=int), strand, product] + lineoutend
+		dfout[annottype2fouttag.get(annottype, 'misc_features')].write('\t'.join(lineout)+'\n')
+
+def parseGFF(fgff, dfout, assacc, assname, dgenbankcdsids, dtaxid2sciname={}, dmergedtaxid={}, didentseq={}):
+	"""single-pass parser of a GFF file, writing out replicons as their region is read and genes' features as genes are closed
+
+	GFF files are expected to be sorted by region and start position, with feature lines following their parent gene line:
+	a gene is closed when a gene, pseudogene or region line is read that starts beyond its end or is located on another region.
+	"""
 	currseqreg = ''
-	dgeneloctag = {}
-	dgenenchild = {}
+	# gene id -> (locus_tag, gene end)
+	dgenes = {}
+	# genes with features not written out yet, in order of appearance: gene id -> (seqreg, gene end, locus_tag, list of feature segments)
+	dopengenes = OrderedDict()
+	def closeGenes(seqreg=None, beg=None):
+		for geneid in dopengenes.keys():
+			gseqreg, gend, locustag, segments = dopengenes[geneid]
+			if (seqreg is None) or (gseqreg!=seqreg) or (gend < beg):
+				writeGeneFeatures(dfout, locustag, segments)
+				del dopengenes[geneid]
 	for line in fgff:
 		if line.startswith('#'): continue
 		elif line.startswith('>'): break
-		#~ print line
-		seqreg, annottype, beg, end, strand, desc = parseGFFline(line)
+		lsp = line.rstrip('\n').split('\t')
+		annottype = lsp[2]
+		if annottype not in gfffeaturetypes: continue
+		seqreg = lsp[0].split('|')[-1]	# to account for Prokka-style annotation that prepends 'gnl|Sequencing_Centre' to the region_id
+		beg = lsp[3]
+		end = lsp[4]
+		strand = lsp[6]
 		if annottype=='region':
+			if dopengenes: closeGenes(seqreg, int(beg))
 			if seqreg!=currseqreg and beg=='1':
 				# new replicon
 				currseqreg = seqreg
+				desc = parseGFFattributes(lsp[8])
 				dbxref = dict(d.split(':') for d in desc['Dbxref'].split(','))
 				taxid = dbxref['taxon']
 				strain = desc.get('strain', '')
@@ -77,29 +125,14 @@ def indexRegionsAndGenes(fgff, dfout, assacc, assname, dtaxid2sciname={}, dmerge
 				if dtaxid2sciname: replineout.append(dtaxid2sciname[dmergedtaxid.get(tid, tid)])
 				dfout['replicons'].write('\t'.join(replineout)+'\n')
 		elif annottype in ['gene', 'pseudogene']:
-			dgeneloctag[desc['ID']] = desc['locus_tag']
-		elif annottype in annottype2fouttag:
-			parentgene = desc.get('Parent')
-			if parentgene:
-				dgenenchild[parentgene] = dgenenchild.setdefault(parentgene, 0) + 1
-	return (dgeneloctag, dgenenchild)
-
-def compileFeatures(fgff, dfout, dgenbankcdsids, dgeneloctag, dgenenchild, didentseq={}):
-	dgenerangeprods = {}
-	#~ annottype = None
-	nprintmullicds = 0
-	bufflineouts = []
-	bufflocustags = []
-	for line in fgff:
-		if line.startswith('#'): continue
-		elif line.startswith('>'): break
-		#~ print line
-		seqreg, annottype, beg, end, strand, desc = parseGFFline(line)
-		if annottype in annottype2fouttag:
-			lineoutend = []
+			if dopengenes: closeGenes(seqreg, int(beg))
+			desc = parseGFFattributes(lsp[8])
+			dgenes[desc['ID']] = (desc['locus_tag'], int(end))
+		else:
+			desc = parseGFFattributes(lsp[8])
 			parentgene = desc['Parent']
-			locustag = dgeneloctag[parentgene]
-			# need to buffer extraction of entries as several lines can relate to the same gene in case of CDS/RNA in several segments (due  to introns, framshifts, ...)
+			locustag, gend = dgenes[parentgene]
+			lineoutend = []
 			if annottype=="CDS":
 				productid = desc.get('protein_id', '').split('|')[-1]	# to account for Prokka-style annotation that prepends 'gnl|Sequencing_Centre' to the protein_id
 				genbankcdsid = dgenbankcdsids[(locustag, productid)]	# get unique CDS id
@@ -107,45 +140,10 @@ def compileFeatures(fgff, dfout, dgenbankcdsids, dgeneloctag, dgenenchild, diden
 				if didentseq: lineoutend.append(didentseq.get(productid, productid))
 			else:
 				productid = desc.get('ID', '')
-			dgenerangeprods.setdefault(parentgene, []).append((beg, end, productid))
-			begs, ends, products = zip(*dgenerangeprods[parentgene])
-			if len(dgenerangeprods[parentgene]) > 1:
-				if nprintmullicds==0: print "multiline feature:",
-				print productid,
-				nprintmullicds += 1
-				#~ if products[0]!=productid: raise IndexError, "multiline feature not pointing at the same product: %s and %s"%(products[0], productid)
-				if products[0]!=productid:
-					print "Warning: multiline feature not pointing at the same product: %s and %s"%(products[0], productid)
-					bufflocustags.append(locustag)
-					locustag = "%s_%d"%(locustag, len(dgenerangeprods[parentgene])-1)
-					print "Create new locus_tag to disembiguate loci:", locustag, "->", productid
-			elif nprintmullicds>0:
-				nprintmullicds = 0 ; print ''
-			lineout = [productid, seqreg, locustag, min(begs), max(ends), strand, desc.get('product', '')] + lineoutend
-			if len(dgenerangeprods[parentgene]) < dgenenchild[parentgene]:
-				bufflineouts.append((annottype, lineout))
-			elif len(dgenerangeprods[parentgene]) == dgenenchild[parentgene]:
-				if bufflocustags:
-					# must first write out the previous line of the gene that actually pointed at something different
-					for prelocustag in bufflocustags:
-						for preannottype, prelineout in bufflineouts:
-							if prelineout[2]==prelocustag:
-								break
-						else:
-							raise IndexError, "could not find locus_tag '%s' in buffer of output lines\n%s:"%(prelocustag, '\n'.join(repr(bufflineouts)))
-						dfout[annottype2fouttag.get(preannottype, 'misc_features')].write('\t'.join(prelineout)+'\n')
-				# write out previous CDS/RNA gene info (potential synthesis of several lines)
-				dfout[annottype2fouttag.get(annottype, 'misc_features')].write('\t'.join(lineout)+'\n')
-				del dgenenchild[parentgene]
-				bufflocustags = []
-				bufflineouts = []
-	
-	if dgenenchild:
-		raise IndexError, "some genes not written:\n%s"%(repr(dgenenchild))
-	#~ if lineout:
-		#~ raise IndexError, "extra unwritten line:\n%s"%lineout
-
-
+			if parentgene not in dopengenes:
+				dopengenes[parentgene] = (seqreg, gend, locustag, [])
+			dopengenes[parentgene][3].append((annottype, seqreg, beg, end, strand, productid, desc.get('product', ''), lineoutend))
+	closeGenes()
 
 def parseAssemb(dirassemb, dfout, dtaxid2sciname={}, dmergedtaxid={}, didentseq={}):
 	# parse CDS fasta file
@@ -154,26 +152,42 @@ def parseAssemb(dirassemb, dfout, dtaxid2sciname={}, dmergedtaxid={}, didentseq=
 	# extract assembly acc and name
 	assembsearch = assembpat.search(os.path.basename(dirassemb))
 	assacc, assname = assembsearch.groups()
-	# parse GFF file
+	# parse GFF file, streaming its content
 	fgff = gzip.open("%s/%s_genomic.gff.gz"%(dirassemb, os.path.basename(dirassemb)), 'rb')
-	# first scans the file for region and (pseudo)gene features
-	dgeneloctag, dgenenchild = indexRegionsAndGenes(fgff, dfout, assacc, assname, dtaxid2sciname=dtaxid2sciname, dmergedtaxid=dmergedtaxid)
-	# resume reading the file from start
-	fgff.seek(0)
-	compileFeatures(fgff, dfout, dgenbankcdsids, dgeneloctag, dgenenchild, didentseq=didentseq)
+	parseGFF(fgff, dfout, assacc, assname, dgenbankcdsids, dtaxid2sciname=dtaxid2sciname, dmergedtaxid=dmergedtaxid, didentseq=didentseq)
 	fgff.close()
 
+# parsing options shared with the worker processes (inherited when they are forked, rather than pickled for each task)
+dshardparseargs = {}
+
+def parseAssembToShards(dirassemb):
+	"""parse an assembly into its own shard of each output table, to be merged by the main process"""
+	dirshards = dshardparseargs['dirshards']
+	dfout = {}
+	dnfshards = {}
+	for fouttag in fouttags:
+		dnfshards[fouttag] = os.path.join(dirshards, "%s.%s.tab"%(os.path.basename(dirassemb), fouttag))
+		dfout[fouttag] = open(dnfshards[fouttag], 'w')
+	print "parse assembly '%s'"%dirassemb
+	parseAssemb(dirassemb, dfout, dtaxid2sciname=dshardparseargs['dtaxid2sciname'], \
+	            dmergedtaxid=dshardparseargs['dmergedtaxid'], didentseq=dshardparseargs['didentseq'])
+	for fouttag in fouttags:
+		dfout[fouttag].close()
+	return dnfshards
+
 def usage():
 	s =  'Usage:\n'
 	s += 'python all_genome_gff2db.py '
 	s += '--assemb_list /path/to/list_of_assembly_folders '
 	s += '--dirout /path/to/output_folder '
 	s += '[--ncbi_taxonomy /path/to/NCBI_Taxonomy_db_dump_folder] '
-	s += '[--identical_seqs /path/to/table_of_identical_proteins]'
+	s += '[--identical_seqs /path/to/table_of_identical_proteins] '
+	s += '[--threads N]\n'
+	s += '  --threads\tnumber of assemblies parsed in parallel, each into its own shard of the output tables, merged in the end (default: 1).'
 	return s
 
 def main():
-	opts, args = getopt.getopt(sys.argv[1:], 'hv', ['dirout=', 'assemb_list=', 'ncbi_taxonomy=', 'identical_prots=', 'help'])
+	opts, args = getopt.getopt(sys.argv[1:], 'hv', ['dirout=', 'assemb_list=', 'ncbi_taxonomy=', 'identical_prots=', 'threads=', 'help'])
 	dopt = dict(opts)
 	if ('-h' in dopt) or ('--help' in dopt):
 		print usage()
@@ -183,6 +197,7 @@ def main():
 	dirout = dopt['--dirout']
 	dirncbitax = dopt.get('--ncbi_taxonomy')
 	nfidentseq = dopt.get('--identical_prots')
+	nbthreads = int(dopt.get('--threads', 1))
 
 	if os.path.exists(dirout):
 		if os.path.isfile(dirout):
@@ -241,9 +256,24 @@ def main():
 		dfout[fouttag].write('\t'.join(dfoutheaders[fouttag])+'\n')
 
 	# parse all assemblies
-	for dirassemb in ldirassemb:
-		print "parse assembly '%s'"%dirassemb
-		parseAssemb(dirassemb, dfout, dtaxid2sciname=dtaxid2sciname, dmergedtaxid=dmergedtaxid, didentseq=didentseq)
+	if nbthreads > 1:
+		dirshards = os.path.join(dirout, 'shards')
+		if not os.path.exists(dirshards): os.mkdir(dirshards)
+		dshardparseargs.update(dirshards=dirshards, dtaxid2sciname=dtaxid2sciname, dmergedtaxid=dmergedtaxid, didentseq=didentseq)
+		pool = mp.Pool(processes=nbthreads)
+		# shards are merged in the order of the assembly list, as soon as they are available
+		for dnfshards in pool.imap(parseAssembToShards, ldirassemb):
+			for fouttag in fouttags:
+				with open(dnfshards[fouttag], 'r') as fshard:
+					shutil.copyfileobj(fshard, dfout[fouttag])
+				os.remove(dnfshards[fouttag])
+		pool.close()
+		pool.join()
+		os.rmdir(dirshards)
+	else:
+		for dirassemb in ldirassemb:
+			print "parse assembly '%s'"%dirassemb
+			parseAssemb(dirassemb, dfout, dtaxid2sciname=dtaxid2sciname, dmergedtaxid=dmergedtaxid, didentseq=didentseq)
 
 	for fouttag in fouttags:
 		dfout[fouttag].close()
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+"""benchmark of the back-translation of protein alignments into CDS alignments, on synthetic gene families
+
+compares:
+- string building: each aligned CDS is built by repeated string concatenation, as formerly done by tranposeAlignmentProt2CDS.py;
+- codon list: each aligned CDS is built by joining a list of codons;
+- NumPy: the whole alignment is back-translated at once with codon_backtranslation.backTranslateAlignment().
+"""
+
+import sys, time, random, getopt
+from codon_backtranslation import backTranslateAlignment
+
+gap = '-'
+aminoacids = 'ACDEFGHIKLMNPQRSTVWY'
+
+def synthetic_family(nseq, protlen, gapfreq, seed=0):
+	"""aligned protein sequences and corresponding CDS sequences (with a stop codon) of a family"""
+	random.seed(seed)
+	lprotali = []
+	lcdsseq = []
+	for k in range(nseq):
+		protali = ''.join([(gap if random.random() < gapfreq else random.choice(aminoacids)) for i in range(protlen)])
+		nres = protlen - protali.count(gap)
+		lprotali.append(protali)
+		lcdsseq.append(''.join([random.choice('ACGT') for i in range(3*nres)])+'TAA')
+	return (lprotali, lcdsseq)
+
+def string_building(protali, cdsseq):
+	# former algorithm of tranposeAlignmentProt2CDS.py (which also omitted the codon of the last aligned position)
+	i = 0
+	j = 0
+	strout = ''
+	C = len(cdsseq)
+	P = len(protali)
+	while ((i+1)*3 <= C) and (j < P):
+		codon = cdsseq[(i*3):((i+1)*3)]
+		aa = protali[j]
+		i += 1 ; j += 1
+		while aa==gap and (j < P):
+			strout += gap*3
+			aa = protali[j]
+			j += 1
+		if j < P:
+			strout += codon
+	while j < P-1:
+		strout += gap*3 ; j += 1
+	return strout
+
+def codon_list(protali, cdsseq):
+	lcodons = []
+	i = 0
+	for aa in protali:
+		if aa==gap:
+			lcodons.append(gap*3)
+		else:
+			codon = cdsseq[i:i+3]
+			lcodons.append(codon if len(codon)==3 else gap*3)
+			i += 3
+	return ''.join(lcodons)
+
+def main():
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['sequences=', 'length=', 'gaps=', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt):
+		print "Usage: python %s [--sequences 10000] [--length 500] [--gaps 0.2]"%sys.argv[0]
+		sys.exit(0)
+	nseq = int(dopt.get('--sequences', 10000))
+	protlen = int(dopt.get('--length', 500))
+	gapfreq = float(dopt.get('--gaps', 0.2))
+	lprotali, lcdsseq = synthetic_family(nseq, protlen, gapfreq)
+	print "family of %d sequences, alignment of %d positions"%(nseq, protlen)
+	dtimes = {}
+	dres = {}
+	for mode, fun in [('string_building', string_building), ('codon_list', codon_list)]:
+		t0 = time.time()
+		dres[mode] = [fun(protali, cdsseq) for protali, cdsseq in zip(lprotali, lcdsseq)]
+		dtimes[mode] = time.time() - t0
+	t0 = time.time()
+	dres['numpy'] = backTranslateAlignment(lprotali, lcdsseq)
+	dtimes['numpy'] = time.time() - t0
+	assert dres['numpy']==dres['codon_list'], "NumPy back-translation differs from codon list back-translation"
+	for mode in ['string_building', 'codon_list', 'numpy']:
+		print "%s:\t%.3f s\t(%.0f sequences/s)"%(mode, dtimes[mode], nseq/dtimes[mode])
+
+if __name__=='__main__':
+
+	main()
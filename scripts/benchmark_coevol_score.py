@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+"""micro-benchmark of the co-evolution score kernels on synthetic lineage event profiles
+
+compares:
+- coevol_score.coevol_lineages_tuples: former Cython implementation, iterating over fetched Python tuples;
+- coevol_score.coevol_lineages: Cython kernel reducing int32 array batches filled from the cursor;
+- compare_collapsedALE_scenarios_purepy.coevol_score: pure Python scoring, one call per matched lineage.
+"""
+
+import sys, time, random, getopt
+import numpy as np
+import pyximport
+pyximport.install()
+from coevol_score import coevol_lineages, coevol_lineages_tuples
+from compare_collapsedALE_scenarios_purepy import coevol_score as coevol_score_purepy
+
+class ListCursor(object):
+	"""mimics a DB cursor serving pre-computed rows"""
+	def __init__(self, rows):
+		self.rows = rows
+		self.rowcount = len(rows)
+		self.pos = 0
+	def fetchmany(self, size):
+		chunk = self.rows[self.pos:self.pos+size]
+		self.pos += size
+		return chunk
+
+def synthetic_rows(nlineages, maxevents, nsample, seed=0):
+	"""rows (rlocds_id, f0, f1) ordered by rlocds_id, as returned by the matching lineage query"""
+	random.seed(seed)
+	rows = []
+	for lid in range(1, nlineages+1):
+		for k in range(random.randint(1, maxevents)):
+			rows.append((lid, random.randint(1, nsample), random.randint(1, nsample)))
+	return rows
+
+def run_purepy(rows, nsample, minevjointfreq):
+	# re-shape rows into the data structures expected by the pure Python function
+	coevollineages = []
+	dlineage_eventfreqs = {}
+	dmatches = {}
+	for eid, (lid, f0, f1) in enumerate(rows):
+		dlineage_eventfreqs[eid] = f0
+		dmatches.setdefault(lid, []).append((eid, f1))
+	for lid in sorted(dmatches):
+		coev = coevol_score_purepy(dmatches[lid], dlineage_eventfreqs, nsample)
+		if coev >= minevjointfreq: coevollineages.append((0, lid, coev))
+	return coevollineages
+
+def timeit(f, nrep):
+	t0 = time.time()
+	for i in range(nrep):
+		res = f()
+	return (time.time() - t0)/nrep, res
+
+def main():
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['lineages=', 'max_events=', 'nsample=', 'repeats=', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt):
+		print "Usage: python %s [--lineages 20000] [--max_events 50] [--nsample 1000] [--repeats 3]"%sys.argv[0]
+		sys.exit(0)
+	nlineages = int(dopt.get('--lineages', 20000))
+	maxevents = int(dopt.get('--max_events', 50))
+	nsample = int(dopt.get('--nsample', 1000))
+	nrep = int(dopt.get('--repeats', 3))
+	minevjointfreq = 0.5
+	rows = synthetic_rows(nlineages, maxevents, nsample)
+	print "%d lineages, %d rows"%(nlineages, len(rows))
+	nsamplesq = nsample**2
+	ttup, rtup = timeit(lambda: coevol_lineages_tuples(ListCursor(rows), 0, nsamplesq, minevjointfreq), nrep)
+	tarr, rarr = timeit(lambda: coevol_lineages(ListCursor(rows), 0, nsamplesq, minevjointfreq), nrep)
+	tpy, rpy = timeit(lambda: run_purepy(rows, nsample, minevjointfreq), nrep)
+	for name, t, res in [('coevol_lineages_tuples', ttup, rtup), ('coevol_lineages', tarr, rarr), ('purepy.coevol_score', tpy, rpy)]:
+		print "%s:\t%.4f s\t(%d lineage pairs reported)"%(name, t, len(res))
+	# same lineage pairs and scores from all implementations
+	for name, res in [('coevol_lineages', rarr), ('purepy.coevol_score', rpy)]:
+		assert [r[:2] for r in res]==[r[:2] for r in rtup], "%s reports different lineage pairs"%name
+		assert np.allclose([r[2] for r in res], [r[2] for r in rtup], rtol=1e-9, atol=0), "%s reports different co-evolution scores"%name
+
+if __name__=='__main__':
+
+	main()
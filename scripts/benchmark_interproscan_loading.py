@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+"""benchmark of the loading of InterProScan annotations into a SQLite database, on synthetic InterProScan output
+
+compares:
+- serial loading: each file is parsed then inserted into the target tables, filtering rows against Python sets of recorded proteins and InterPro terms;
+- staged loading: files are parsed by a pool of processes, rows are bulk-inserted into staging tables and deduplicated with INSERT ... SELECT statements.
+"""
+
+import os, sys, time, random, getopt, shutil, tempfile, sqlite3
+import pantagruel_load_interproscan_annotations as ipload
+
+# tables created by pantagruel_sqlitedb_genome_initiate.sql
+tablescript = """
+CREATE TABLE protein_infos (nr_protein_id VARCHAR(20) NOT NULL, sequence_md5_digest TEXT NOT NULL, sequence_length SMALLINT NOT NULL);
+CREATE TABLE functional_annotations (nr_protein_id VARCHAR(20) NOT NULL, analysis_method TEXT NOT NULL, signature_accession TEXT NOT NULL,
+  signature_description TEXT NOT NULL, start_location SMALLINT NOT NULL, stop_location SMALLINT NOT NULL, score_or_evalue REAL NOT NULL,
+  analysis_status CHAR(1) NOT null, analysis_date CHAR(10) NOT NULL, interpro_id VARCHAR(10), interproscan_version VARCHAR(10));
+CREATE TABLE interpro_terms (interpro_id CHAR(9) NOT NULL, interpro_description TEXT NOT NULL, go_terms TEXT, pathways TEXT);
+CREATE TABLE interpro2GO (interpro_id CHAR(9) NOT NULL, go_id CHAR(10) NOT NULL);
+CREATE TABLE interpro2pathways (interpro_id CHAR(9) NOT NULL, pathway_db VARCHAR(8) NOT NULL, pathway_id VARCHAR(60) NOT NULL);
+"""
+
+methods = ['Pfam', 'TIGRFAM', 'Gene3D', 'SUPERFAMILY', 'ProSiteProfiles', 'CDD']
+
+def synthetic_interproscan_files(outdir, nfiles, nprot, nshared, ninterpro, maxhits, seed=0):
+	"""write nfiles TSV files of InterProScan output, each annotating nprot proteins, of which nshared are drawn from a pool common to all files
+
+	the pipeline splits the non-redundant proteome into batches of 10000 proteins, so that by default no protein is shared between files.
+	"""
+	random.seed(seed)
+	dipterms = {}
+	for i in range(ninterpro):
+		ipid = 'IPR%06d'%i
+		goterms = '|'.join(['GO:%07d'%k for k in random.sample(xrange(1, 50000), random.randint(0, 3))])
+		pathways = '|'.join(['%s: %d'%(random.choice(['KEGG', 'MetaCyc', 'Reactome']), k) for k in random.sample(xrange(1, 9999), random.randint(0, 2))])
+		dipterms[ipid] = (ipid, 'InterPro entry %d'%i, goterms, pathways)
+	def protlines(protid):
+		# the hits of a protein only depend on its identifier, as expected for non-redundant protein sequences
+		rnd = random.Random(protid)
+		protlen = rnd.randint(50, 1000)
+		lines = []
+		for h in range(rnd.randint(1, maxhits)):
+			start = rnd.randint(1, protlen-10)
+			fields = [protid, '%032x'%hash(protid), str(protlen), rnd.choice(methods), 'SIG%05d'%rnd.randint(1, 20000), 'signature description', \
+			          str(start), str(rnd.randint(start, protlen)), '%.1E'%rnd.random(), 'T', '01-01-2019']
+			if rnd.random() < 0.7:
+				fields += dipterms['IPR%06d'%rnd.randint(0, ninterpro-1)]
+			lines.append('\t'.join(fields)+'\n')
+		return lines
+	lnf = []
+	for f in range(nfiles):
+		nf = os.path.join(outdir, 'proteome_%05d.tsv'%f)
+		protids = ['SHARED%07d'%random.randint(1, nshared*4) for k in range(nshared)] + ['PROT%05d_%06d'%(f, k) for k in range(nprot-nshared)]
+		with open(nf, 'w') as fout:
+			for protid in sorted(set(protids)):
+				fout.writelines(protlines(protid))
+		lnf.append(nf)
+	return lnf
+
+def dump_tables(nfdb):
+	dbcon = sqlite3.connect(nfdb)
+	dtables = dict((table, sorted(set(dbcon.execute("SELECT * FROM %s;"%table).fetchall()))) for table in ['protein_infos', 'functional_annotations', 'interpro_terms', 'interpro2GO', 'interpro2pathways'])
+	dbcon.close()
+	return dtables
+
+def main():
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['files=', 'proteins=', 'shared=', 'interpro=', 'max_hits=', 'processes=', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt):
+		print "Usage: python %s [--files 40] [--proteins 10000] [--shared 0] [--interpro 5000] [--max_hits 8] [--processes 4]"%sys.argv[0]
+		sys.exit(0)
+	nfiles = int(dopt.get('--files', 40))
+	nprot = int(dopt.get('--proteins', 10000))
+	nshared = int(dopt.get('--shared', 0))
+	ninterpro = int(dopt.get('--interpro', 5000))
+	maxhits = int(dopt.get('--max_hits', 8))
+	nbprocesses = int(dopt.get('--processes', 4))
+	tmpdir = tempfile.mkdtemp()
+	try:
+		lnf = synthetic_interproscan_files(tmpdir, nfiles, nprot, nshared, ninterpro, maxhits)
+		nlines = sum(1 for nf in lnf for line in open(nf))
+		print "%d files, %d lines"%(nfiles, nlines)
+		dtimes = {}
+		for mode, staged, nproc in [('serial', False, 1), ('staged', True, 1), ('staged_parallel', True, nbprocesses)]:
+			nfdb = os.path.join(tmpdir, '%s.db'%mode)
+			dbcon = sqlite3.connect(nfdb)
+			dbcon.executescript(tablescript)
+			dbcon.close()
+			t0 = time.time()
+			ipload.main(nfdb, 'sqlite', os.path.join(tmpdir, '*.tsv'), '5.30-69.0', staged=staged, nbprocesses=nproc)
+			dtimes[mode] = time.time() - t0
+		dref = dump_tables(os.path.join(tmpdir, 'serial.db'))
+		for mode in ['serial', 'staged', 'staged_parallel']:
+			print "%s:\t%.2f s\t(%.0f lines/s)"%(mode, dtimes[mode], nlines/dtimes[mode])
+			if mode != 'serial':
+				assert dump_tables(os.path.join(tmpdir, '%s.db'%mode))==dref, "content of tables loaded in '%s' mode differs from that of 'serial' mode"%mode
+	finally:
+		shutil.rmtree(tmpdir)
+
+if __name__=='__main__':
+
+	main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+
+"""benchmark of the counting of orthologous edge frequencies over a sample of reconciled gene trees, on a synthetic gene family
+
+the orthologous groups (OGs) of each sampled tree are drawn as a perturbation of a reference partition of the family leaves:
+a fraction of the leaves is moved to another OG, and a fraction of the OGs is split in two.
+
+compares:
+- dict: all pairs of labels of every OG of every sample are counted in a dict keyed by label pairs, as formerly done in orthoFromSampleRecs();
+- sparse: orthologousEdgeFrequencies(), which counts distinct OGs once and label co-memberships through a sparse membership matrix.
+"""
+
+import sys, time, random, getopt
+from itertools import combinations
+from get_orthologues_from_ALE_recs import orthologousEdgeFrequencies
+
+def synthetic_og_samples(nleaves, nsamples, ogsize, moverate, splitrate, seed=0):
+	random.seed(seed)
+	llabs = ['SPE%04d_%05d'%(random.randint(0, 999), i) for i in range(nleaves)]
+	shuffled = llabs[:]
+	random.shuffle(shuffled)
+	refogs = [shuffled[i:i+ogsize] for i in range(0, nleaves, ogsize)]
+	logs = []
+	for s in range(nsamples):
+		dlabog = dict((lab, k) for k, og in enumerate(refogs) for lab in og)
+		for lab in random.sample(llabs, int(moverate*nleaves)):
+			dlabog[lab] = random.randint(0, len(refogs)-1)
+		ogs = [[] for og in refogs]
+		for lab in shuffled:
+			ogs[dlabog[lab]].append(lab)
+		ogs = [og for og in ogs if og]
+		for k in random.sample(range(len(ogs)), int(splitrate*len(ogs))):
+			og = ogs[k]
+			if len(og) > 1:
+				ogs[k] = og[:len(og)/2]
+				ogs.append(og[len(og)/2:])
+		logs.append(ogs)
+	llabs.sort()
+	return (logs, llabs)
+
+def dict_edge_frequencies(logs):
+	dedgefreq = {}
+	for ogs in logs:
+		for og in ogs:
+			if len(og)==1:
+				orfan = og[0] ; combo = (orfan, orfan)
+				dedgefreq[combo] = dedgefreq.get(combo, 0) + 1
+			else:
+				for combo in combinations(sorted(og), 2):
+					dedgefreq[combo] = dedgefreq.get(combo, 0) + 1
+	return dedgefreq
+
+def main():
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['leaves=', 'samples=', 'og_size=', 'move_rate=', 'split_rate=', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt):
+		print "Usage: python %s [--leaves 5000] [--samples 100] [--og_size 100] [--move_rate 0.01] [--split_rate 0.05]"%sys.argv[0]
+		sys.exit(0)
+	nleaves = int(dopt.get('--leaves', 5000))
+	nsamples = int(dopt.get('--samples', 100))
+	ogsize = int(dopt.get('--og_size', 100))
+	moverate = float(dopt.get('--move_rate', 0.01))
+	splitrate = float(dopt.get('--split_rate', 0.05))
+	logs, llabs = synthetic_og_samples(nleaves, nsamples, ogsize, moverate, splitrate)
+	print "family of %d leaves, %d sampled OG sets (%d label pairs per sample on average)"%(nleaves, nsamples, \
+	       sum([len(og)*(len(og)-1)/2 for ogs in logs for og in ogs])/nsamples)
+	t0 = time.time()
+	dedgefreq = dict_edge_frequencies(logs)
+	tdict = time.time() - t0
+	t0 = time.time()
+	edges, freqs = orthologousEdgeFrequencies(logs, llabs)
+	tsparse = time.time() - t0
+	dsparse = dict(((llabs[i], llabs[j]), f) for (i, j), f in zip(edges, freqs))
+	assert dedgefreq==dsparse, "edge frequencies differ"
+	# frequencies are plain ints, as with the dict counting
+	assert all([type(f) is int for f in freqs]), "edge frequencies are not integers"
+	assert all([type(i) is int and type(j) is int for i, j in edges]), "edge vertex indexes are not integers"
+	print "%d edges"%len(edges)
+	print "dict:\t%.3f s"%tdict
+	print "sparse:\t%.3f s"%tsparse
+
+if __name__=='__main__':
+
+	main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+"""benchmark of the summary of score distributions by quantiles, on synthetic best hit scores
+
+compares:
+- exact: ptg_utils.quantile() and mean() over the full list of values, as done per OG pair in condense_coevolution_network_by_orthologous_groups.py;
+- sketch: ptg_utils.QuantileSketch, fed by chunks of values in separate shards that are then merged, exact up to exactsize values.
+"""
+
+import sys, time, random, getopt, bisect
+from ptg_utils import QuantileSketch, quantile, mean
+
+quantbreaks = [0, 0.1, 0.25, 0.5, 0.75, 0.9, 1]
+
+def rank(sortedvalues, q):
+	return bisect.bisect_left(sortedvalues, q)/float(len(sortedvalues))
+
+def sketch_shards(values, nshards, exactsize, k, chunksize=10000):
+	n = len(values)
+	sketch = QuantileSketch(k=k, exactsize=exactsize)
+	for j in range(nshards):
+		shard = QuantileSketch(k=k, exactsize=exactsize, seed=j)
+		for i in range(j*n/nshards, (j+1)*n/nshards, chunksize):
+			shard.update(values[i:min(i+chunksize, (j+1)*n/nshards)])
+		sketch.merge(shard)
+	return sketch
+
+def main():
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['values=', 'shards=', 'exact_size=', 'k=', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt):
+		print "Usage: python %s [--values 1000000] [--shards 4] [--exact_size 10000] [--k 200]"%sys.argv[0]
+		sys.exit(0)
+	n = int(dopt.get('--values', 1000000))
+	nshards = int(dopt.get('--shards', 4))
+	exactsize = int(dopt.get('--exact_size', 10000))
+	k = int(dopt.get('--k', 200))
+	random.seed(0)
+	values = [random.gauss(0, 1) for i in range(n)]
+	print "%d values, %d shards"%(n, nshards)
+	t0 = time.time()
+	exact = quantile(values, quantbreaks)
+	exactmean = mean(values)
+	texact = time.time() - t0
+	t0 = time.time()
+	sketch = sketch_shards(values, nshards, exactsize, k)
+	approx = sketch.quantile(quantbreaks)
+	tsketch = time.time() - t0
+	# count, mean and extremes are exact; other quantiles are within the rank error of the sketch (~1/k)
+	assert len(sketch)==n, "sketch counts differ"
+	assert abs(sketch.mean() - exactmean) < 1e-9, "sketch mean differs"
+	assert approx[0]==exact[0] and approx[-1]==exact[-1], "sketch extremes differ"
+	svalues = sorted(values)
+	maxrankerr = max([abs(rank(svalues, qa) - rank(svalues, qe)) for qa, qe in zip(approx, exact)])
+	if n > exactsize:
+		assert maxrankerr < 5.0/k, "sketch rank error above %g"%(5.0/k)
+		print "retained values:\t%d"%sum([len(c) for c in sketch.compactors])
+	else:
+		assert approx==exact, "sketch quantiles differ below exactsize"
+	print "max. rank error:\t%.4f"%maxrankerr
+	print "exact:\t%.3f s"%texact
+	print "sketch:\t%.3f s"%tsketch
+
+if __name__=='__main__':
+
+	main()
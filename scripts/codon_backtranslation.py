@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""back-translation of protein alignments into codon (CDS) alignments
+
+the codons of each CDS are placed at the non-gap positions of the corresponding aligned protein sequence;
+codons missing at the end of a shorter CDS are replaced by gaps and extra codons (e.g. the stop codon) are ignored.
+assumes no indels between the CDS and the protein, only mismatches and possibly shortenned sequences;
+THIS DOES NOT VERIFY THAT THE CDS TRANSLATES INTO THE PROTEIN (see pal2nal.pl for that).
+
+the whole alignment is processed at once as arrays of bytes: the gap mask of the protein alignment gives
+for each aligned position the index of the codon to be placed there, which are gathered by fancy indexing.
+"""
+import sys, os
+import numpy as np
+
+gap = '-'
+
+def _charMatrix(lseq, width, fill=gap):
+	"""(nseq x width) array of bytes of sequences, padded on the right with the fill character"""
+	lens = np.array([len(seq) for seq in lseq], dtype=np.int64)
+	mat = np.empty((len(lseq), width), dtype=np.uint8)
+	mat.fill(ord(fill))
+	if len(lseq) and width:
+		mat[np.arange(width)[np.newaxis,:] < lens[:,np.newaxis]] = np.frombuffer(''.join(lseq), dtype=np.uint8)
+	return mat
+
+def backTranslateAlignment(lprotali, lcdsseq, gap=gap):
+	"""back-translate a list of aligned protein sequences into a list of aligned CDS sequences (lists of strings, in the same order)"""
+	if len(lprotali)!=len(lcdsseq):
+		raise ValueError, "different numbers of protein (%d) and CDS (%d) sequences"%(len(lprotali), len(lcdsseq))
+	if not lprotali: return []
+	P = max(len(protali) for protali in lprotali)
+	prot = _charMatrix(lprotali, P, gap)
+	ispos = (prot != ord(gap))
+	# index of the codon to place at each position of the protein alignment
+	icodon = np.cumsum(ispos, axis=1) - 1
+	# CDS sequences truncated to whole codons, as (nseq x ncodons x 3) arrays; an extra codon made of gaps stands for missing codons
+	lcdsseq = [cdsseq[:len(cdsseq)-(len(cdsseq)%3)] for cdsseq in lcdsseq]
+	K = max(ispos.sum(axis=1).max(), max(len(cdsseq) for cdsseq in lcdsseq)//3)
+	codons = _charMatrix(lcdsseq, 3*(K+1), gap).reshape((len(lcdsseq), K+1, 3))
+	nbcodons = np.array([len(cdsseq)//3 for cdsseq in lcdsseq], dtype=np.int64)
+	icodon[(~ispos) | (icodon >= nbcodons[:,np.newaxis])] = K
+	cdsali = codons[np.arange(len(lcdsseq))[:,np.newaxis], icodon]
+	return [row.tostring() for row in cdsali.reshape((len(lcdsseq), 3*P))]
+
+def readFastaRecords(lines):
+	"""parse fasta lines into a list of (sequence name, header line, sequence string) tuples"""
+	lrec = []
+	for line in lines:
+		if line.startswith('>'):
+			lrec.append((line[1:].split(None, 1)[0], line, []))
+		elif lrec:
+			lrec[-1][2].append(line.strip())
+	return [(name, header, ''.join(seq)) for name, header, seq in lrec]
+
+def backTranslateFastaFiles(nfcdsseq, nfprtali, nfout, fullheader=True):
+	"""back-translate the protein alignment in file nfprtali into a CDS alignment written in nfout, from the CDS sequences in file nfcdsseq
+
+	CDS sequences are matched to aligned protein sequences by name, or by order if the names differ.
+	"""
+	with open(nfcdsseq, 'r') as fcdsseq:
+		lcdsrec = readFastaRecords(fcdsseq)
+	with open(nfprtali, 'r') as fprtali:
+		lprotrec = readFastaRecords(fprtali)
+	dcdsseq = dict((name, seq) for name, header, seq in lcdsrec)
+	if all((name in dcdsseq) for name, header, seq in lprotrec):
+		lcdsseq = [dcdsseq[name] for name, header, seq in lprotrec]
+	else:
+		lcdsseq = [seq for name, header, seq in lcdsrec]
+	lcdsali = backTranslateAlignment([seq for name, header, seq in lprotrec], lcdsseq)
+	with open(nfout, 'w') as fout:
+		for (name, header, protseq), cdsali in zip(lprotrec, lcdsali):
+			fout.write("%s%s\n"%((header if fullheader else ">%s\n"%name), cdsali))
+
+def usage():
+	s = "Usage: python %s cds_sequences.fasta protein_alignment.aln output_cds_alignment.aln\n"%os.path.basename(sys.argv[0])
+	s += "  transpose the CDS into the positions of the corresponding aligned protein (FASTA files).\n"
+	return s
+
+if __name__=='__main__':
+
+	if len(sys.argv) < 4 or sys.argv[1] in ['-h', '--help']:
+		print usage()
+		sys.exit(1)
+	nfcdsseq = os.path.abspath( sys.argv[1] )
+	nfprtali = os.path.abspath( sys.argv[2] )
+	nfout    = os.path.abspath( sys.argv[3] )
+	backTranslateFastaFiles(nfcdsseq, nfprtali, nfout)
+	print "CDS alignment generated at: '%s'"%(nfout)
+	print "WARNING: --- correctness of the alignment not guaranted, please verify ---"
@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+import numpy as np
+
 cdef double coevol_score(lineage_matches, unsigned long nsamplesq):
 	cdef int f0, f1
 	cdef unsigned long jf = 0
@@ -11,26 +13,104 @@ cdef double coevol_score(lineage_matches, unsigned long nsamplesq):
 	jointfreq = jf
 	return jointfreq/nsamplesq
 
-#~ cdef chop_array(currlineage_matches, keepfields, chunksize=1000):
-#~ 	cdef int tmatch_ff[2]
-#~ 	cdef list lmatch_ffs = []
-#~ 	for currlineage_match in currlineage_matches:
-#~ 		# make an array of C-type int array
-#~ 		tmatch_ff = currlineage_match[2:]
-#~ 		lmatch_ffs.append(tmatch_ff)
-#~ 	return lmatch_ffs
+cpdef Py_ssize_t reduce_lineage_segments(const int[::1] lineage_ids, const int[::1] f0, const int[::1] f1, long long[::1] state, \
+                                         double nsamplesq, double minevjointfreq, long long[::1] outids, double[::1] outscores):
+	"""reduce rows sorted by lineage id into per-lineage co-evolution scores, in a single pass without Python objects
+
+	takes as input:
+	- lineage_ids, f0, f1: aligned contiguous int32 arrays of matched lineage ids, event frequencies in the query lineage and in the matched lineage
+	- state: int64 array of length 3 (started flag, current lineage id, current joint frequency sum) carrying
+	  the segment left open at the end of the previous batch of rows; initiate with zeros
+	- nsamplesq, the square of the number of sampled reconciliation, to scale the product of event frequencies into a probability of the co-event
+	- minevjointfreq, the minimum observed co-evolution score ( = sum of co-event probabilities) to report a lineage pair
+	- outids, outscores: output arrays, at least as long as the input rows
+	returns the number of lineages completed in this batch and recorded in outids, outscores.
+	"""
+	cdef:
+		Py_ssize_t i, k = 0, n = lineage_ids.shape[0]
+		long long started = state[0], currlineage_id = state[1], jf = state[2]
+		long long lid
+		double coev
+	for i in range(n):
+		lid = lineage_ids[i]
+		if started and lid != currlineage_id:
+			# segment boundary: compute the finished lineage's co-evolution score
+			coev = jf / nsamplesq
+			if coev >= minevjointfreq:
+				outids[k] = currlineage_id
+				outscores[k] = coev
+				k += 1
+			jf = 0
+		currlineage_id = lid
+		started = 1
+		jf += (<long long>f0[i]) * f1[i]
+	state[0] = started
+	state[1] = currlineage_id
+	state[2] = jf
+	return k
+
+cpdef Py_ssize_t flush_lineage_segment(long long[::1] state, double nsamplesq, double minevjointfreq, \
+                                       long long[::1] outids, double[::1] outscores):
+	"""complete the last open lineage segment; returns 1 if it is recorded in outids, outscores (at first position), 0 otherwise"""
+	cdef double coev
+	if not state[0]: return 0
+	coev = state[2] / nsamplesq
+	state[0] = 0
+	if coev >= minevjointfreq:
+		outids[0] = state[1]
+		outscores[0] = coev
+		return 1
+	return 0
+
+def iter_row_batches(dbcur, fetchsize=10000, ncols=3):
+	"""buffer-filling adapter: generates contiguous column views (int32) of batches of rows fetched from any DB-API cursor
 
-cpdef coevol_lineages(dbcur, lineage_id, int nsamplesq, double minevjointfreq, fetchsize=10000):
+	rows are copied into a single pre-allocated column-major buffer, reused for every batch; yielded views are only valid until the next batch.
+	"""
+	# column-major storage, so that the first n values of each column are contiguous
+	buf = np.empty((fetchsize, ncols), dtype=np.int32, order='F')
+	rows = dbcur.fetchmany(fetchsize)
+	while rows:
+		n = len(rows)
+		buf[:n] = rows
+		yield tuple(buf[:n, j] for j in range(ncols))
+		rows = dbcur.fetchmany(fetchsize)
+
+def coevol_batches(batches, lineage_id, double nsamplesq, double minevjointfreq):
+	"""generates a list of tuples containing pairs of lineage ids and the corresponding co-evolution score
+
+	from an iterable of (lineage_ids, f0, f1) int32 array batches, with rows ordered by lineage id.
+	"""
+	state = np.zeros(3, dtype=np.int64)
+	coevollineages = []
+	outids = np.empty(1, dtype=np.int64)
+	outscores = np.empty(1, dtype=np.float64)
+	for lineage_ids, f0, f1 in batches:
+		if outids.shape[0] < lineage_ids.shape[0]:
+			outids = np.empty(lineage_ids.shape[0], dtype=np.int64)
+			outscores = np.empty(lineage_ids.shape[0], dtype=np.float64)
+		k = reduce_lineage_segments(np.ascontiguousarray(lineage_ids), np.ascontiguousarray(f0), np.ascontiguousarray(f1), state, nsamplesq, minevjointfreq, outids, outscores)
+		coevollineages += [(lineage_id, matchid, coev) for matchid, coev in zip(outids[:k].tolist(), outscores[:k].tolist())]
+	k = flush_lineage_segment(state, nsamplesq, minevjointfreq, outids, outscores)
+	coevollineages += [(lineage_id, matchid, coev) for matchid, coev in zip(outids[:k].tolist(), outscores[:k].tolist())]
+	return coevollineages
+
+cpdef coevol_lineages(dbcur, lineage_id, double nsamplesq, double minevjointfreq, fetchsize=10000):
 	"""generates a list of tuples containing pairs of lineage ids and the corresponding co-evolution score
-	
+
 	takes as input:
-	- dbcur, a db cursor returning tuples from a querry with all integer values (rclocds_id, event_id, freq0, freq1), ordered by rclocds_id
+	- dbcur, a db cursor returning tuples from a querry with all integer values (rlocds_id, freq0, freq1), ordered by rlocds_id
 	- lineage_id, the query lineage id
 	- nsamplesq, the square of the number of sampled reconciliation, to scale the product of event frequencies into a probability of the co-event
 	- minevjointfreq, the minimum observed co-evolution score ( = sum of co-event probabilities) to report a lineage pair
 	- fetchsize, (optional) the number of rows fetched at once from the database
 	"""
 	if dbcur.rowcount == 0: return []
+	return coevol_batches(iter_row_batches(dbcur, fetchsize), lineage_id, nsamplesq, minevjointfreq)
+
+cpdef coevol_lineages_tuples(dbcur, lineage_id, int nsamplesq, double minevjointfreq, fetchsize=10000):
+	"""former implementation of coevol_lineages(), iterating over fetched Python tuples; kept for benchmarking purposes"""
+	if dbcur.rowcount == 0: return []
 	cdef:
 		unsigned long match_lineage_id, currlineage_id
 		list  match_lineages, currlineage_matches = [], coevollineages = []
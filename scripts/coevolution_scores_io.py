@@ -0,0 +1,204 @@
+#!/usr/bin/python
+
+"""compact columnar binary storage of gene lineage co-evolution scores
+
+Scores are stored as a sequence of blocks, each holding three columns:
+uint32 rlocds_id_1, uint32 rlocds_id_2 and float32 coev_score.
+Within a block, rows can be sorted by (rlocds_id_1, rlocds_id_2), in which case the id columns are delta-encoded
+(rlocds_id_2 relative to the previous row of the same rlocds_id_1); every column is then compressed separately
+with zstd (if the 'zstandard' module is available) or zlib.
+
+File layout:
+- magic string 'PTGCOEV1'
+- for each block: a header of struct format '<IBBIII' (number of rows, compression codec, delta-encoding flag,
+  and byte sizes of the three column payloads), followed by the three column payloads.
+"""
+
+import sys, struct, zlib
+import numpy as np
+
+magic = 'PTGCOEV1'
+blockheader = struct.Struct('<IBBIII')
+coevcolumns = ('rlocds_id_1', 'rlocds_id_2', 'coev_score')
+coevdtypes = (np.dtype('<u4'), np.dtype('<u4'), np.dtype('<f4'))
+# compression codecs
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+dcodecs = {None:CODEC_RAW, 'raw':CODEC_RAW, 'zlib':CODEC_ZLIB, 'zstd':CODEC_ZSTD}
+
+def _get_zstandard():
+	try:
+		return __import__('zstandard')
+	except ImportError:
+		return None
+
+def _compress(buf, codec, level):
+	if codec==CODEC_RAW: return buf
+	elif codec==CODEC_ZLIB: return zlib.compress(buf, level)
+	elif codec==CODEC_ZSTD: return _get_zstandard().ZstdCompressor(level=level).compress(buf)
+	else: raise ValueError, "unknown compression codec: %s"%repr(codec)
+
+def _decompress(buf, codec):
+	if codec==CODEC_RAW: return buf
+	elif codec==CODEC_ZLIB: return zlib.decompress(buf)
+	elif codec==CODEC_ZSTD:
+		zstd = _get_zstandard()
+		if zstd is None: raise ImportError, "module 'zstandard' is required to read zstd-compressed co-evolution score blocks"
+		return zstd.ZstdDecompressor().decompress(buf)
+	else: raise ValueError, "unknown compression codec: %s"%repr(codec)
+
+def _delta_encode(id1, id2):
+	"""delta-encode sorted id columns; rlocds_id_2 deltas restart at every change of rlocds_id_1"""
+	d1 = id1.copy()
+	d1[1:] = id1[1:] - id1[:-1]
+	newgroup = np.ones(len(id1), dtype=bool)
+	newgroup[1:] = (d1[1:] != 0)
+	d2 = id2.copy()
+	d2[1:] = np.where(newgroup[1:], id2[1:], id2[1:] - id2[:-1])
+	return d1.astype(coevdtypes[0]), d2.astype(coevdtypes[1])
+
+def _delta_decode(d1, d2):
+	id1 = np.cumsum(d1, dtype=coevdtypes[0])
+	newgroup = np.ones(len(d1), dtype=bool)
+	newgroup[1:] = (d1[1:] != 0)
+	cs = np.cumsum(d2, dtype=np.uint64)
+	# cumulated sum at the row preceding the start of each group of same rlocds_id_1, propagated along the group
+	groupstarts = np.maximum.accumulate(np.where(newgroup, np.arange(len(d1)), 0))
+	base = cs[groupstarts] - d2[groupstarts]
+	id2 = (cs - base).astype(coevdtypes[1])
+	return id1, id2
+
+class CoevolScoreWriter(object):
+	"""buffered writer of co-evolution score triples (rlocds_id_1, rlocds_id_2, coev_score) to a columnar binary file
+
+	- 'blocksize' is the number of rows per block;
+	- if 'sort' is True, rows of a block are sorted by ids and the id columns are delta-encoded;
+	- 'compress' is one of 'zstd' (default; falls back to 'zlib' if module 'zstandard' is not available), 'zlib' or None.
+	"""
+	def __init__(self, nfout, blocksize=1048576, sort=True, compress='zstd', level=3):
+		if compress not in dcodecs: raise ValueError, "invalid compression codec: %s; valid values are: %s"%(repr(compress), repr(dcodecs.keys()))
+		if compress=='zstd' and (_get_zstandard() is None):
+			compress = 'zlib'
+		self.codec = dcodecs[compress]
+		self.level = level
+		self.sort = sort
+		self.blocksize = blocksize
+		self.nrows = 0
+		self._buffer = []
+		self._nbuffered = 0
+		self.fout = open(nfout, 'wb')
+		self.fout.write(magic)
+
+	def write(self, matches):
+		"""buffer a list of (rlocds_id_1, rlocds_id_2, coev_score) tuples"""
+		if not matches: return
+		self.write_arrays(*[np.array(col, dtype=dt) for col, dt in zip(zip(*matches), coevdtypes)])
+
+	def write_arrays(self, id1, id2, score):
+		"""buffer rows given as three aligned arrays"""
+		self._buffer.append((np.asarray(id1, dtype=coevdtypes[0]), np.asarray(id2, dtype=coevdtypes[1]), np.asarray(score, dtype=coevdtypes[2])))
+		self._nbuffered += len(id1)
+		while self._nbuffered >= self.blocksize:
+			self._flush_block(self.blocksize)
+
+	def _flush_block(self, nrows=None):
+		cols = [np.concatenate([b[k] for b in self._buffer]) for k in range(3)]
+		if nrows is None: nrows = len(cols[0])
+		id1, id2, score = [col[:nrows] for col in cols]
+		rest = [col[nrows:] for col in cols]
+		self._buffer = [tuple(rest)] if len(rest[0]) else []
+		self._nbuffered = len(rest[0])
+		if nrows==0: return
+		delta = 0
+		if self.sort:
+			order = np.lexsort((id2, id1))
+			id1, id2, score = id1[order], id2[order], score[order]
+			id1, id2 = _delta_encode(id1, id2)
+			delta = 1
+		payloads = [_compress(col.tobytes(), self.codec, self.level) for col in (id1, id2, score)]
+		self.fout.write(blockheader.pack(nrows, self.codec, delta, *[len(p) for p in payloads]))
+		for p in payloads:
+			self.fout.write(p)
+		self.nrows += nrows
+
+	def tell(self):
+		return self.fout.tell()
+
+	def close(self):
+		if self._nbuffered: self._flush_block()
+		self.fout.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+def iter_coevol_score_blocks(nfin):
+	"""generates tuples of three numpy arrays (rlocds_id_1, rlocds_id_2, coev_score), one per block of the binary file"""
+	with open(nfin, 'rb') as fin:
+		if fin.read(len(magic))!=magic:
+			raise ValueError, "file '%s' is not a binary co-evolution score file"%nfin
+		while True:
+			header = fin.read(blockheader.size)
+			if not header: break
+			nrows, codec, delta, len1, len2, len3 = blockheader.unpack(header)
+			cols = [np.frombuffer(_decompress(fin.read(l), codec), dtype=dt) for l, dt in zip((len1, len2, len3), coevdtypes)]
+			if delta:
+				cols[0], cols[1] = _delta_decode(cols[0], cols[1])
+			yield tuple(cols)
+
+def iter_coevol_scores(nfin):
+	"""generates (rlocds_id_1, rlocds_id_2, coev_score) tuples of Python numbers from the binary file"""
+	for id1, id2, score in iter_coevol_score_blocks(nfin):
+		for tscore in zip(id1.tolist(), id2.tolist(), score.tolist()):
+			yield tscore
+
+class PGCopyBinaryStream(object):
+	"""file-like object serving co-evolution score blocks in PostgreSQL binary COPY format,
+
+	to be used with psycopg2 cursor.copy_expert("COPY table (rlocds_id_1, rlocds_id_2, coev_score) FROM STDIN WITH BINARY", stream)
+	so that no conversion to and from text is needed.
+	"""
+	pgrowdtype = np.dtype([('nfields', '>i2'), ('len1', '>i4'), ('id1', '>i4'), ('len2', '>i4'), ('id2', '>i4'), ('len3', '>i4'), ('score', '>f4')])
+
+	def __init__(self, iterblocks):
+		self.iterblocks = iter(iterblocks)
+		self.buf = 'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+		self.pos = 0
+		self.finished = False
+
+	def _next_chunk(self):
+		try:
+			id1, id2, score = next(self.iterblocks)
+		except StopIteration:
+			self.finished = True
+			return struct.pack('>h', -1)
+		rows = np.empty(len(id1), dtype=self.pgrowdtype)
+		rows['nfields'] = 3
+		rows['len1'] = rows['len2'] = rows['len3'] = 4
+		rows['id1'] = id1
+		rows['id2'] = id2
+		rows['score'] = score
+		return rows.tobytes()
+
+	def read(self, size=-1):
+		# serve the current chunk from an offset, to avoid copying the remainder of the buffer at every read
+		while (not self.finished) and (size<0 or len(self.buf)-self.pos<size):
+			self.buf = self.buf[self.pos:] + self._next_chunk()
+			self.pos = 0
+		end = len(self.buf) if size<0 else self.pos+size
+		chunk = self.buf[self.pos:end]
+		self.pos = min(end, len(self.buf))
+		return chunk
+
+def main():
+	"""dump a binary co-evolution score file as a tab-delimited table on stdout"""
+	for nfin in sys.argv[1:]:
+		for tscore in iter_coevol_scores(nfin):
+			sys.stdout.write('%d\t%d\t%f\n'%tscore)
+
+if __name__=='__main__':
+
+	main()
@@ -317,9 +317,7 @@ def mulBoundInt2Float(a, b, scale):
 	return f1*f2
 
 def _select_lineage_event_clause_factory(rlocdsidcol, evtypes, valtoken, lineagetable):
-	#~ if rlocdsidcol=='replacement_label_or_cds_code': rlocdsIJ = ""
-	#~ else: rlocdsIJ = "INNER JOIN %s USING (replacement_label_or_cds_code)"%lineagetable
-	rlocdsIJ = "INNER JOIN %s USING (replacement_label_or_cds_code)"%lineagetable
+	rlocdsIJ = "INNER JOIN %s USING (rlocds_id)"%lineagetable
 	if evtypes:
 		evtyperestrictIJ = "INNER JOIN species_tree_events USING (event_id)"
 		evtyperestrictWC = "AND event_type IN %s"%repr(tuple(e for e in evtypes))
@@ -376,8 +374,7 @@ def _query_matching_lineage_event_profiles(args, use_gene_labels=False, timing=F
 	if verbose: print 'lineage_id:', lineage_id, fam
 	dbcon, dbcul, dbtype, valtoken = get_dbconnection(dbname, dbengine)
 	if use_gene_labels: rlocdsidcol = 'replacement_label_or_cds_code'
-	elif dbtype=='postgres': rlocdsidcol = 'rlocds_id'
-	else: rlocdsidcol = 'oid'
+	else: rlocdsidcol = 'rlocds_id'
 	minevfWC = " AND gene_lineage_events.freq >= %d"%int(mineventfreq*nsample) if mineventfreq>0 else ''
 	maxevfWC = " AND gene_lineage_events.freq  < %d"%int(maxeventfreq*nsample) if maxeventfreq<1 else ''
 	# first get the vector of (event_id, freq) tuples in lineage
@@ -449,8 +446,7 @@ def dbquery_matching_lineage_event_profiles(dbname, dbengine='postgres', use_gen
 	dbcon, dbcur, dbtype, valtoken = get_dbconnection(dbname, dbengine)
 	nsamplesq = nsample*nsample
 	if use_gene_labels: rlocdsidcol = 'replacement_label_or_cds_code'
-	elif dbtype=='postgres': rlocdsidcol = 'rlocds_id'
-	else: rlocdsidcol = 'oid'
+	else: rlocdsidcol = 'rlocds_id'
 	if not (matchesOutDirRad or nfpickleMatchesOut or returnList):
 		raise ValueError, "must specify at least one output option among: 'matchesOutDirRad', 'nfpickleMatchesOut', 'returnList'"
 	
@@ -467,10 +463,10 @@ def dbquery_matching_lineage_event_profiles(dbname, dbengine='postgres', use_gen
 		dbcur.execute("create table ingenes (replacement_label_or_cds_code VARCHAR(60));" )
 		dbcur.executemany("insert into ingenes values (%s) ;"%(valtoken), ingenes)
 		dbcur.execute("drop table if exists %s;"%lineagetable)
-		dbcur.execute("""create table %s as select replacement_label_or_cds_code, gene_family_id, %s 
+		dbcur.execute("""create table %s as select replacement_label_or_cds_code, gene_family_id, rlocds_id 
 		                  from replacement_label_or_cds_code2gene_families 
 		                  inner join ingenes using (replacement_label_or_cds_code) ;
-		              """%(lineagetable, rlocdsidcol))
+		              """%(lineagetable))
 		dbcur.execute("drop table ingenes;")
 		dbcon.commit()
 	
@@ -547,8 +543,7 @@ def _query_matching_lineages_by_event(args, returDict=True, use_gene_labels=Fals
 	evtid, dbname, dbengine, nsample, evtypes = args
 	dbcon, dbcul, dbtype, valtoken = get_dbconnection(dbname, dbengine)
 	if use_gene_labels: rlocdsidcol = 'replacement_label_or_cds_code'
-	elif dbtype=='postgres': rlocdsidcol = 'rlocds_id'
-	else: rlocdsidcol = 'oid'
+	else: rlocdsidcol = 'rlocds_id'
 	# allow big fetch operations
 	dbcul.arraysize = arraysize
 	if returDict: genepaircummulfreq = {}
@@ -558,9 +553,9 @@ def _query_matching_lineages_by_event(args, returDict=True, use_gene_labels=Fals
 		# get all the genes which event lineage features this event
 		if timing: t0 = time.time()
 		dbcul.execute("""create temp table genefams as select rlcc2gf.%s as gene, gene_family_id as fam, freq 
-						   from (select %s, replacement_label_or_cds_code, freq from gene_lineage_events where event_id=%s ) s1
-						   inner join replacement_label_or_cds_code2gene_families as rlcc2gf using (replacement_label_or_cds_code) ;
-					  """%(rlocdsidcol, rlocdsidcol, valtoken), (evtid,))
+						   from (select rlocds_id, freq from gene_lineage_events where event_id=%s ) s1
+						   inner join replacement_label_or_cds_code2gene_families as rlcc2gf using (rlocds_id) ;
+					  """%(rlocdsidcol, valtoken), (evtid,))
 
 		if timing: t1 = time.time() ; print t1 - t0
 		# takes 1s
@@ -595,7 +590,7 @@ def _query_matching_lineages_by_event(args, returDict=True, use_gene_labels=Fals
 		if timing: t0 = time.time()
 		dbcul.execute("""select %s, gene_family_id, freq 
 						   from gene_lineage_events
-						   inner join replacement_label_or_cds_code2gene_families using (replacement_label_or_cds_code)
+						   inner join replacement_label_or_cds_code2gene_families using (rlocds_id)
 						 where event_id=%s ;
 					  """%(rlocdsidcol, valtoken), (evtid,)) 
 		matchgenes = dbcul.fetchall()
@@ -685,7 +680,7 @@ def dbquery_matching_lineages_by_event(dbname, nsample=1.0, evtypes=None, genefa
 		dbcur.executemany("insert into ingenefams values (%s), VARCHAR(20);"%valtoken, ingenefams)
 		dbcon.commit()
 		# query modifiers
-		generestrict = "inner join ingenefams using (replacement_label_or_cds_code) "
+		generestrict = "inner join replacement_label_or_cds_code2gene_families using (rlocds_id) inner join ingenefams using (replacement_label_or_cds_code) "
 	else:
 		generestrict = ""
 	
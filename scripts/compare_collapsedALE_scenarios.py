@@ -6,6 +6,7 @@ import cPickle as pickle
 import shelve
 import itertools
 import gc
+import tempfile, shutil
 import numpy as np
 from ptg_utils import *
 # try the power of Cython
@@ -13,15 +14,17 @@ import pyximport
 pyximport.install()
 #~ pyximport.install(pyimport=True) # cythonize all the python modules avalaible
 from coevol_score import coevol_lineages
+import coevolution_scores_io
 
 def _select_lineage_event_clause_factory(evtypes, lineagetable):
-	rlocdsIJ = "INNER JOIN %s USING (replacement_label_or_cds_code)"%lineagetable
+	# gene lineages are keyed by their integer id in the event table
+	rlocdsIJ = "INNER JOIN %s USING (rlocds_id)"%lineagetable
 	if evtypes:
 		evtyperestrictIJ = "INNER JOIN species_tree_events USING (event_id)"
 		if len(evtypes)>1: evtyperestrictWC = "AND event_type IN %s"%repr(tuple(e for e in evtypes))
 		else: evtyperestrictWC = "AND event_type='%s'"%evtypes
 	else:
-		evtyperestrictWC = evtyperestrict = ""
+		evtyperestrictWC = evtyperestrictIJ = ""
 	return (rlocdsIJ, evtyperestrictIJ, evtyperestrictWC)
 
 def _select_lineage_event_query_factory(aBYb, evtypes, valtoken, lineagetable, \
@@ -108,28 +111,170 @@ def _query_matching_lineage_event_profiles(args, timing=False, verbose=False):
 	if verbose: print coevollineages
 	return coevollineages
 
+def _load_lineage_event_matrix(dbcur, evtypes, lineagetable, baseWC, ltlineageidfams, freqdtype=np.int32, fetchsize=100000, verbose=False):
+	"""load the whole gene lineage-by-event frequency table at once into a compressed sparse row (CSR) matrix
+	
+	returns a tuple (lineagefreqs, rlocdsids, famcodes) where:
+	- lineagefreqs is the CSR matrix of event frequencies, with gene lineages as rows and species tree events as columns;
+	- rlocdsids is the array of lineage ids (rlocds_id) matching the matrix rows, in increasing order;
+	- famcodes is the array of integer codes of the gene family of each lineage, matching the matrix rows.
+	"""
+	sparse = __import__('scipy.sparse', fromlist=['csr_matrix'])
+	array = __import__('array')
+	rlocdsIJ, evtyperestrictIJ, evtyperestrictWC = _select_lineage_event_clause_factory(evtypes, lineagetable)
+	wc = ' '.join((evtyperestrictWC, baseWC)).strip()
+	if wc: wc = 'WHERE '+wc.split('AND ', 1)[1]
+	preq = "SELECT rlocds_id, event_id, gene_lineage_events.freq FROM gene_lineage_events %s %s %s ;"%(rlocdsIJ, evtyperestrictIJ, wc)
+	if verbose: print preq
+	dbcur.execute(preq)
+	# accumulate rows in compact C-type arrays rather than lists of Python tuples
+	alid = array.array('l')
+	aeid = array.array('l')
+	afreq = array.array('l')
+	rows = dbcur.fetchmany(fetchsize)
+	while rows:
+		for lid, eid, freq in rows:
+			alid.append(lid)
+			aeid.append(eid)
+			afreq.append(freq)
+		rows = dbcur.fetchmany(fetchsize)
+	rlocdsids, rowidx = np.unique(np.frombuffer(alid, dtype=np.int_), return_inverse=True)
+	eventids, colidx = np.unique(np.frombuffer(aeid, dtype=np.int_), return_inverse=True)
+	freqs = np.frombuffer(afreq, dtype=np.int_).astype(freqdtype)
+	del alid, aeid, afreq
+	lineagefreqs = sparse.csr_matrix((freqs, (rowidx, colidx)), shape=(len(rlocdsids), len(eventids)), dtype=freqdtype)
+	lineagefreqs.sort_indices()
+	# encode gene families as integers
+	dlineagefam = dict(ltlineageidfams)
+	dfamcodes = {}
+	famcodes = np.array([dfamcodes.setdefault(dlineagefam[lid], len(dfamcodes)) for lid in rlocdsids.tolist()], dtype=np.int32)
+	if verbose: print "loaded lineage-by-event matrix of shape %s with %d non-zero frequencies"%(repr(lineagefreqs.shape), lineagefreqs.nnz)
+	return (lineagefreqs, rlocdsids, famcodes)
+
+def _sparse_matching_lineage_event_profiles(lineagefreqs, rlocdsids, famcodes, nsample, matchScope, minevjointfreq, \
+                                            rowrange=None, blocksize=1000, lineagefreqsT=None):
+	"""generates lists of tuples (rlocds_id_1, rlocds_id_2, coev_score) for blocks of query lineages
+	
+	co-evolution scores, i.e. the sums over shared events of the products of event frequencies in both lineages 
+	(scaled by the square of the number of sampled reconciliations), are computed as blocked sparse matrix products
+	of the lineage-by-event frequency matrix with its transpose.
+	Only pairs of lineages with rlocds_id_2 >= rlocds_id_1, matching the 'matchScope' family filter and 
+	with score >= minevjointfreq are reported, i.e. the same as returned by _query_matching_lineage_event_profiles().
+	
+	'rowrange' optionally restricts the query lineages to a (start, end) range of matrix rows.
+	"""
+	nsamplesq = float(nsample)**2
+	if lineagefreqsT is None:
+		# the product of frequencies is computed as 64-bit integers to avoid overflow
+		lineagefreqsT = lineagefreqs.T.astype(np.int64).tocsr()
+	rowstart, rowend = rowrange if rowrange else (0, lineagefreqs.shape[0])
+	for i0 in range(rowstart, rowend, blocksize):
+		i1 = min(i0+blocksize, rowend)
+		jointfreqs = lineagefreqs[i0:i1].astype(np.int64).dot(lineagefreqsT).tocoo()
+		qi = jointfreqs.row + i0
+		mj = jointfreqs.col
+		# the id of compared lineage to be >= reference lineage, to avoid duplicate comparisons
+		keep = mj >= qi
+		if matchScope=='between_fams':
+			keep &= (famcodes[mj] != famcodes[qi])
+		elif matchScope=='within_fams':
+			keep &= (famcodes[mj] == famcodes[qi])
+		coev = jointfreqs.data[keep] / nsamplesq
+		qi = qi[keep]
+		mj = mj[keep]
+		keep = coev >= minevjointfreq
+		coev = coev[keep]
+		qi = qi[keep]
+		mj = mj[keep]
+		# order matches by query lineage, then by matched lineage
+		order = np.lexsort((mj, qi))
+		yield zip(rlocdsids[qi[order]].tolist(), rlocdsids[mj[order]].tolist(), coev[order].tolist())
+
+# arrays of the lineage-by-event matrix (and of its transpose) stored as memory-mapped files, shared by worker processes
+sparsematrixarrays = ('indptr', 'indices', 'data', 'indptrT', 'indicesT', 'dataT', 'rlocdsids', 'famcodes')
+
+def _dump_lineage_event_matrix(lineagefreqs, rlocdsids, famcodes, mmapdir):
+	"""write the arrays of the lineage-by-event CSR matrix and of its transpose to .npy files in folder 'mmapdir'
+	
+	the transpose is stored with 64-bit integer frequencies, ready to be used as the right operand of the products of frequencies.
+	"""
+	lineagefreqsT = lineagefreqs.T.astype(np.int64).tocsr()
+	darrays = {'indptr':lineagefreqs.indptr, 'indices':lineagefreqs.indices, 'data':lineagefreqs.data, \
+	           'indptrT':lineagefreqsT.indptr, 'indicesT':lineagefreqsT.indices, 'dataT':lineagefreqsT.data, \
+	           'rlocdsids':rlocdsids, 'famcodes':famcodes}
+	for arrname in sparsematrixarrays:
+		np.save(os.path.join(mmapdir, arrname+'.npy'), darrays[arrname])
+	return lineagefreqs.shape
+
+def _load_mmap_lineage_event_matrix(mmapdir, shape):
+	"""load lineage-by-event CSR matrix and its transpose from memory-mapped .npy files (no copy in memory)"""
+	sparse = __import__('scipy.sparse', fromlist=['csr_matrix'])
+	d = {arrname:np.load(os.path.join(mmapdir, arrname+'.npy'), mmap_mode='r') for arrname in sparsematrixarrays}
+	lineagefreqs = sparse.csr_matrix((d['data'], d['indices'], d['indptr']), shape=shape, copy=False)
+	lineagefreqsT = sparse.csr_matrix((d['dataT'], d['indicesT'], d['indptrT']), shape=(shape[1], shape[0]), copy=False)
+	return (lineagefreqs, lineagefreqsT, d['rlocdsids'], d['famcodes'])
+
+def _balanced_row_ranges(indptr, nranges):
+	"""split matrix rows into contiguous ranges with about the same number of non-zero values (i.e. of lineage events)"""
+	breaks = np.searchsorted(indptr, np.linspace(0, indptr[-1], nranges+1)[1:-1])
+	bounds = [0] + sorted(set(breaks.tolist()) - set([0, len(indptr)-1])) + [len(indptr)-1]
+	return zip(bounds[:-1], bounds[1:])
+
+# worker-global reference to the shared memory-mapped matrices, set by _init_sparse_worker()
+sharedmatrix = None
+
+def _init_sparse_worker(mmapdir, shape):
+	global sharedmatrix
+	sharedmatrix = _load_mmap_lineage_event_matrix(mmapdir, shape)
+
+def _sparse_score_row_range(args):
+	"""score a contiguous range of query lineages against the shared lineage-by-event matrix; to be called in a worker process"""
+	rowrange, nsample, matchScope, minevjointfreq, blocksize = args
+	lineagefreqs, lineagefreqsT, rlocdsids, famcodes = sharedmatrix
+	lms = []
+	for lm in _sparse_matching_lineage_event_profiles(lineagefreqs, rlocdsids, famcodes, nsample, matchScope, minevjointfreq, \
+	                                                  rowrange=rowrange, blocksize=blocksize, lineagefreqsT=lineagefreqsT):
+		lms.append(lm)
+	return lms
+
 def dbquery_matching_lineage_event_profiles(dbname, dbengine='postgres', \
                                             genefamlist=None, exclRecSpeBranches=[], matchScope='between_fams', \
                                             nsample=1.0, evtypes=None, mineventfreq=0.0, maxeventfreq=1.0, minevjointfreq=0.0, \
                                             matchesOutDirRad=None, nfpickleMatchesOut=None, returnList=False, \
-                                            nbthreads=1, verbose=False, **kw):
+                                            outputFormat='tab', engine='sql', blocksize=1000, mmapdir=None, nbthreads=1, verbose=False, **kw):
+	"""search gene lineages with matching event profiles and report their co-evolution score
+	
+	'engine' determines how scores are computed:
+	- 'sql' (default): one query per lineage on the database, returning lineages with events in common, aggregated by coevol_lineages();
+	- 'sparse': the lineage-by-event table is loaded once from the database into a sparse matrix, and scores are 
+	  derived from blocked sparse matrix products (of 'blocksize' query lineages at a time).
+	  With nbthreads > 1, the matrix is stored as memory-mapped array files in folder 'mmapdir' (by default 
+	  a temporary folder, deleted after use), shared by a pool of worker processes that each score contiguous 
+	  ranges of query lineages, balanced by the number of lineage events.
+	
+	'outputFormat' determines the format of the score table written in folder 'matchesOutDirRad':
+	- 'tab' (default): tab-delimited text, split into ~1GB files 'matching_events.tab.N';
+	- 'bin': compact columnar binary file 'matching_events.bin' (see coevolution_scores_io module).
+	"""
 	
 	def output_match_line(lm, lmatches, fout, nfoutrad, kfout, foutMaxSize=1024**3):
-		# check if output file max size has been reached
-		if fout: 
+		# check if output file max size has been reached (binary output is written to a single file)
+		if fout and (outputFormat=='tab'): 
 			foutsize = fout.tell()
 			if foutsize >= foutMaxSize:
 				fout.close()
 				kfout +=1
 				fout = open(nfoutrad+'.%d'%kfout, 'w')
 		if (nfpickleMatchesOut or returnList): lmatches += lm
-		if matchesOutDirRad or verbose:
+		if fout and (outputFormat=='bin'):
+			fout.write(lm)
+		elif matchesOutDirRad or verbose:
 			for tgpcf in lm:
 				matchline = '%d\t%d\t%f\n'%tgpcf
 				if fout: fout.write(matchline)
-			if verbose:
-				print len(lm), 'matches'
-				sys.stdout.flush()
+		if verbose:
+			print len(lm), 'matches'
+			sys.stdout.flush()
 		return (fout, kfout)
 	
 	timing = kw.get('timing')
@@ -171,6 +316,10 @@ def dbquery_matching_lineage_event_profiles(dbname, dbengine='postgres', \
 		diffamWC = ""
 	else:
 		raise ValueError, "incorrect value '%s' for variable 'matchScope'"%repr(matchScope)
+	if engine not in ('sql', 'sparse'):
+		raise ValueError, "incorrect value '%s' for variable 'engine'"%repr(engine)
+	if outputFormat not in ('tab', 'bin'):
+		raise ValueError, "incorrect value '%s' for variable 'outputFormat'"%repr(outputFormat)
 	def make_arg_tup(lineage_id):
 		#~ return (lineage_id, dbname, dbengine, nsample, evtypes, matchScope, mineventfreq, maxeventfreq, minevjointfreq, lineagetable)
 		return (lineage_id, dbname, dbengine, nsample, evtypes, baseWC, diffamWC, minevjointfreq, lineagetable)
@@ -183,13 +332,49 @@ def dbquery_matching_lineage_event_profiles(dbname, dbengine='postgres', \
 				
 	
 	if matchesOutDirRad:
-		nfoutrad = os.path.join(matchesOutDirRad, 'matching_events.tab')
 		kfout = 0
-		fout = open(nfoutrad+'.%d'%kfout, 'w')
+		if outputFormat=='bin':
+			nfoutrad = os.path.join(matchesOutDirRad, 'matching_events.bin')
+			fout = coevolution_scores_io.CoevolScoreWriter(nfoutrad)
+		else:
+			nfoutrad = os.path.join(matchesOutDirRad, 'matching_events.tab')
+			fout = open(nfoutrad+'.%d'%kfout, 'w')
 	else:
 		kfout = nfoutrad = fout = None
 	lmatches = []
-	if nbthreads==1:
+	if engine=='sparse':
+		lineagefreqs, rlocdsids, famcodes = _load_lineage_event_matrix(dbcur, evtypes, lineagetable, baseWC, ltlineageidfams, verbose=verbose)
+		if nbthreads==1:
+			for lm in _sparse_matching_lineage_event_profiles(lineagefreqs, rlocdsids, famcodes, nsample, matchScope, minevjointfreq, blocksize=blocksize):
+				fout, kfout = output_match_line(lm, lmatches, fout, nfoutrad, kfout)
+		else:
+			tempmmapdir = not mmapdir
+			if tempmmapdir: mmapdir = tempfile.mkdtemp(prefix='lineage_event_matrix.')
+			elif not os.path.isdir(mmapdir): os.mkdir(mmapdir)
+			pool = None
+			try:
+				shape = _dump_lineage_event_matrix(lineagefreqs, rlocdsids, famcodes, mmapdir)
+				if verbose: print "stored lineage-by-event matrix as memory-mapped arrays in '%s'"%mmapdir
+				# ranges of query lineages are several times more numerous than workers, to smooth the load across the pool
+				rowranges = _balanced_row_ranges(lineagefreqs.indptr, 4*nbthreads)
+				del lineagefreqs, rlocdsids, famcodes
+				gc.collect()
+				pool = mp.Pool(processes=nbthreads, initializer=_init_sparse_worker, initargs=(mmapdir, shape))
+				iterargs = ((rowrange, nsample, matchScope, minevjointfreq, blocksize) for rowrange in rowranges)
+				for lms in pool.imap_unordered(_sparse_score_row_range, iterargs, chunksize=1):
+					for lm in lms:
+						fout, kfout = output_match_line(lm, lmatches, fout, nfoutrad, kfout)
+				pool.close()
+				pool.join()
+			except:
+				# stop the workers before their memory-mapped arrays are removed
+				if pool is not None:
+					pool.terminate()
+					pool.join()
+				raise
+			finally:
+				if tempmmapdir: shutil.rmtree(mmapdir, ignore_errors=True)
+	elif nbthreads==1:
 		for i, tlineageidfam in enumerate(ltlineageidfams):
 			lm = _query_matching_lineage_event_profiles(make_arg_tup(tlineageidfam), verbose=max(verbose-1, 0))
 			fout, kfout = output_match_line(lm, lmatches, fout, nfoutrad, kfout)
@@ -225,8 +410,8 @@ def main():
 	                                                'exclude_species_tree_branches=', 'event_type=', 'min_freq=', 'max_freq=', 'min_joint_freq=', 'match_scope=', \
 	                                                'genefams=', 'dir_constraints=', 'dir_replaced=', \
 	                                                'events_from_pickle=', 'events_from_shelve=', 'events_from_postgresql_db=', 'events_from_sqlite_db=', \
-	                                                'matches_to_shelve=', 'dir_table_out=', \
-	                                                'threads=', 'help', 'verbose=']) #, 'reuse=', 'max.recursion.limit=', 'logfile='
+	                                                'matches_to_shelve=', 'dir_table_out=', 'table_format=', \
+	                                                'engine=', 'block_size=', 'mmap_dir=', 'threads=', 'help', 'verbose=']) #, 'reuse=', 'max.recursion.limit=', 'logfile='
 	dopt = dict(opts)
 	
 	if ('-h' in dopt) or ('--help' in dopt):
@@ -255,6 +440,9 @@ def main():
 	
 	# parsed events / matched events output options
 	dirTableOut = dopt.get('--dir_table_out')
+	outputFormat = dopt.get('--table_format', 'tab')
+	if outputFormat not in ['tab', 'bin']:
+		raise ValueError, "valid values for --table_format argument are: 'tab', 'bin'"
 	nfpickleMatchesOut = dopt.get('--matches_to_pickle')
 	nfshelveMatchesOut = dopt.get('--matches_to_shelve')
 	
@@ -274,6 +462,11 @@ def main():
 	minJointFreqReport = float(dopt.get('--min_joint_freq', 0.0))
 	exclRecSpeBranches = str(dopt.get('--exclude_species_tree_branches', '')).split(',')
 	# runtime params
+	engine = dopt.get('--engine', 'sql')
+	if engine not in ['sql', 'sparse']:
+		raise ValueError, "valid values for --engine argument are: 'sql', 'sparse'"
+	blocksize = int(dopt.get('--block_size', 1000))
+	mmapdir = dopt.get('--mmap_dir')
 	nbthreads = int(dopt.get('--threads', dopt.get('-T', -1)))
 	if nbthreads < 1: nbthreads = mp.cpu_count()
 	verbose = int(dopt.get('--verbose', dopt.get('-v', 0)))
@@ -299,7 +492,7 @@ def main():
                          evtypes=recordEvTypes, exclRecSpeBranches=exclRecSpeBranches, matchScope=matchScope, \
                          mineventfreq=minFreqReport, maxeventfreq=maxFreqReport, minevjointfreq=minJointFreqReport, \
                          nfpickleMatchesOut=nfpickleMatchesOut, nfshelveMatchesOut=nfshelveMatchesOut, matchesOutDirRad=matchesOutDirRad, \
-                         nbthreads=nbthreads, verbose=verbose)
+                         outputFormat=outputFormat, engine=engine, blocksize=blocksize, mmapdir=mmapdir, nbthreads=nbthreads, verbose=verbose)
 
 def usage():
 	s = "Usage: [HELP MESSAGE INCOMPLETE]\n"
@@ -314,6 +507,16 @@ def usage():
 	s += "\t\t\t\t- within or between gene families only, or both. Between families is the default behaviour;\n"
 	s += "\t\t\t\t- within_families can be chosen to allow to cluster closely related lineages with significantly shared ancestry within families\n"
 	s += "\t\t\t\t  and to restrict accordingly the search for matches between families\n."
+	s += "\t\t--table_format={'tab'|'bin'} format of the score table written in --dir_table_out:\n"
+	s += "\t\t\t\t- 'tab' (default): tab-delimited text files 'matching_events.tab.N', split every ~1GB;\n"
+	s += "\t\t\t\t- 'bin': single compact columnar binary file 'matching_events.bin' (see coevolution_scores_io.py).\n"
+	s += "\t\t--engine={'sql'|'sparse'} define how co-evolution scores are computed:\n"
+	s += "\t\t\t\t- 'sql' (default): by querying the database once per gene lineage;\n"
+	s += "\t\t\t\t- 'sparse': by loading the whole lineage-by-event table once into a sparse matrix (requires scipy)\n"
+	s += "\t\t\t\t  and computing all scores through blocked sparse matrix products.\n"
+	s += "\t\t--block_size\tnumber of query lineages scored at once with the 'sparse' engine (default: 1000).\n"
+	s += "\t\t--mmap_dir\tfolder where to store the memory-mapped lineage-by-event matrix shared by parallel workers of the 'sparse' engine\n"
+	s += "\t\t\t\t(default: a temporary folder, deleted after use).\n"
 	return s
 
 ################## Main execution
@@ -54,7 +54,8 @@ def coevol_score(mg_lineage_eventfreqs, dlineage_eventfreqs, nsample):
 ####
 
 def _select_lineage_event_clause_factory(evtypes, valtoken, lineagetable):
-	rlocdsIJ = "INNER JOIN %s USING (replacement_label_or_cds_code)"%lineagetable
+	# gene lineages are keyed by their integer id in the event table
+	rlocdsIJ = "INNER JOIN %s USING (rlocds_id)"%lineagetable
 	if evtypes:
 		evtyperestrictIJ = "INNER JOIN species_tree_events USING (event_id)"
 		evtyperestrictWC = "AND event_type IN %s"%repr(tuple(e for e in evtypes))
@@ -1,99 +1,182 @@
 #!/usr/bin/python2.7
 import sys, getopt
 import multiprocessing as mp
-from ptg_utils import get_dbconnection, mean, quantile
+import numpy as np
+from ptg_utils import get_dbconnection, QuantileSketch
+import coevolution_scores_io
 
-def retrieveIG2OGscores(args):
-	qogogsc, ltfamog, i, dbname, dbengine, withinfam, verbose = args
-	dbco, dbcuf, dbtype, valtoken = get_dbconnection(dbname, dbengine)
-	tvt = (valtoken,)*8
-	q = qogogsc%tvt
-	ltretval = []
-	tfamog1 = ltfamog[i]
-	for tfamog2 in ltfamog[i+1:]:
-		if verbose: print tfamog1+tfamog2
-		if tfamog1[0]==tfamog2[0]:
-			if withinfam: 
-				if tfamog1[1]==tfamog2[1]:
-					continue
+# statistics reported for each pair of orthologous groups: number of score records, number of lineage best hits, mean and quantiles of best hit scores
+quantbreaks = [0, 0.25, 0.5, 0.75, 1]
+# mapping of gene lineages to (fam, OG) indexes, inherited by worker processes
+dfamogargs = {}
+
+def reduceLineageBestHits(paircodes, rlocdsids, scores):
+	"""keep the maximum score for each (OG pair, gene lineage) key; input and output are aligned numpy arrays"""
+	if len(paircodes)==0: return (paircodes, rlocdsids, scores)
+	order = np.lexsort((scores, rlocdsids, paircodes))
+	paircodes = paircodes[order] ; rlocdsids = rlocdsids[order] ; scores = scores[order]
+	# the last record of each key group holds the maximum
+	islast = np.ones(len(paircodes), dtype=bool)
+	islast[:-1] = (paircodes[1:]!=paircodes[:-1]) | (rlocdsids[1:]!=rlocdsids[:-1])
+	return (paircodes[islast], rlocdsids[islast], scores[islast])
+
+def reducePairCounts(paircodes, counts):
+	"""sum the counts of records for each OG pair"""
+	upaircodes, inv = np.unique(paircodes, return_inverse=True)
+	return (upaircodes, np.bincount(inv, weights=counts).astype(np.int64))
+
+class OGPairScoreAggregator(object):
+	"""aggregates gene lineage co-evolution scores by pairs of orthologous groups, in a single pass over score records
+	
+	scores are fed by blocks of (rlocds_id_1, rlocds_id_2, coev_score) numpy arrays;
+	each gene lineage is mapped to the index of its (fam, OG) through the integer array famogidx (-1 for unmapped lineages).
+	for each pair of (fam, OG) indexes, the number of score records and the best score of each lineage (its 'best hit') are kept.
+	
+	the aggregator can be restricted to a shard of lineages, given as a [start, end) range of rlocds_id: records are then only counted
+	if their rlocds_id_1 is in range, and best hits are only kept for lineages in range. once all records involving these lineages
+	(as rlocds_id_1 or rlocds_id_2) have been fed, their best hits are final and summarize() reduces them into a QuantileSketch per pair
+	(exact up to exactsize best hits, approximate quantiles beyond); summaries of the shards are then merged.
+	"""
+	def __init__(self, famogidx, famogfam, isquery, withinfam=False, idrange=None, compactsize=10000000, exactsize=100000):
+		self.famogidx = famogidx
+		self.famogfam = famogfam
+		self.isquery = isquery
+		self.nfamog = len(famogfam)
+		self.withinfam = withinfam
+		self.idrange = idrange
+		self.compactsize = compactsize
+		self.exactsize = exactsize
+		self.lcounts = []
+		self.lbesthits = []
+		self.nbesthits = 0
+		# summarized statistics {pair code: [number of records, QuantileSketch of best hit scores]}
+		self.dpairstats = {}
+	
+	def add(self, id1, id2, scores):
+		maxid = len(self.famogidx) - 1
+		inrange = (id1 <= maxid) & (id2 <= maxid)
+		id1 = id1[inrange].astype(np.int64) ; id2 = id2[inrange].astype(np.int64) ; scores = scores[inrange].astype(np.float64)
+		g1 = self.famogidx[id1] ; g2 = self.famogidx[id2]
+		keep = (g1 >= 0) & (g2 >= 0) & (g1!=g2)
+		if not self.withinfam:
+			keep &= (self.famogfam[np.maximum(g1, 0)]!=self.famogfam[np.maximum(g2, 0)])
+		ga = np.minimum(g1, g2) ; gb = np.maximum(g1, g2)
+		# pairs are queried from the OG with the lowest index
+		keep &= self.isquery[np.maximum(ga, 0)]
+		paircodes = ga*self.nfamog + gb
+		if self.idrange:
+			start, end = self.idrange
+			keep1 = keep & (id1 >= start) & (id1 < end)
+			keep2 = keep & (id2 >= start) & (id2 < end)
+		else:
+			keep1 = keep2 = keep
+		# records are counted in the shard of their rlocds_id_1
+		if keep1.any():
+			self.lcounts.append(reducePairCounts(paircodes[keep1], np.ones(keep1.sum())))
+		# only positive scores can be best hits
+		pos = scores > 0.0
+		bh1 = keep1 & pos ; bh2 = keep2 & pos
+		if bh1.any() or bh2.any():
+			self.addBestHits(np.concatenate((paircodes[bh1], paircodes[bh2])), \
+			                 np.concatenate((id1[bh1], id2[bh2])), \
+			                 np.concatenate((scores[bh1], scores[bh2])))
+	
+	def addBestHits(self, paircodes, rlocdsids, scores):
+		self.lbesthits.append(reduceLineageBestHits(paircodes, rlocdsids, scores))
+		self.nbesthits += len(self.lbesthits[-1][0])
+		if self.nbesthits > self.compactsize:
+			self.compact()
+	
+	def compact(self):
+		if len(self.lcounts) > 1:
+			self.lcounts = [reducePairCounts(*[np.concatenate(cols) for cols in zip(*self.lcounts)])]
+		if len(self.lbesthits) > 1:
+			self.lbesthits = [reduceLineageBestHits(*[np.concatenate(cols) for cols in zip(*self.lbesthits)])]
+			self.nbesthits = len(self.lbesthits[0][0])
+	
+	def pairStats(self, paircode):
+		stats = self.dpairstats.get(paircode)
+		if stats is None:
+			stats = self.dpairstats[paircode] = [0, QuantileSketch(exactsize=self.exactsize)]
+		return stats
+	
+	def summarize(self):
+		"""reduce record counts and best hits into per-pair statistics; best hits must be final, i.e. all records involving the lineages of the shard must have been fed"""
+		self.compact()
+		if self.lcounts:
+			paircodes, counts = self.lcounts[0]
+			for paircode, count in zip(paircodes.tolist(), counts.tolist()):
+				self.pairStats(paircode)[0] += count
+		if self.lbesthits:
+			bhpaircodes, bhrlocdsids, bhscores = self.lbesthits[0]
+			# bounds of the best hit records of each pair (sorted by pair code)
+			upaircodes, lbeg = np.unique(bhpaircodes, return_index=True)
+			lend = lbeg[1:].tolist() + [len(bhpaircodes)]
+			for paircode, beg, end in zip(upaircodes.tolist(), lbeg.tolist(), lend):
+				sketch = self.pairStats(paircode)[1]
+				for i in range(beg, end, self.exactsize):
+					sketch.update(bhscores[i:min(i+self.exactsize, end)].tolist())
+		self.lcounts = []
+		self.lbesthits = []
+		self.nbesthits = 0
+	
+	def merge(self, other):
+		"""merge the summarized statistics of another aggregator, e.g. from a worker processing another shard of lineages"""
+		for paircode, (count, sketch) in other.dpairstats.iteritems():
+			stats = self.pairStats(paircode)
+			stats[0] += count
+			stats[1].merge(sketch)
+	
+	def __getstate__(self):
+		# only summarized statistics are sent back from worker processes, not the lineage mapping
+		return {'dpairstats':self.dpairstats, 'exactsize':self.exactsize}
+	
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+	
+	def iterPairStats(self):
+		"""generates (index of OG 1, index of OG 2, number of records, number of best hits, mean best hit score, quantiles of best hit scores...) tuples, ordered by OG indexes"""
+		for paircode in sorted(self.dpairstats):
+			count, sketch = self.dpairstats[paircode]
+			if len(sketch):
+				tstats = (sketch.mean(),)+sketch.quantile(quantbreaks)
 			else:
-				continue
-		## fetch the coevolution scores between two fam_OG groups
-		dbcuf.execute(qogogsc, (tfamog1+tfamog2)*2)
-		ltscores = dbcuf.fetchall()
-		llt = len(ltscores)
-		if llt==0:
-			continue
-		## filter lineage-wise bidirectional best hits
-		
-		# implementation 1: for each OG separately, register all lineages' best hit links
-		# and then take instersection of links to ensure link is a best hit in both collection
-		#~ # get best hit set for each OG as query
-		#~ for k in (0,1):
-			#~ if verbose: print "query OG:", [tfamog1, tfamog2][k]
-			#~ stlbh = set([])
-			#~ # order the results by rlocdsid of the query OG
-			#~ ltscores.sort(key=lambda x: x[k])
-			#~ rlocdsid = None; lbh = 0; ltlbh = []
-			#~ for tscore in ltscores:
-				#~ if tscore[k]!=rlocdsid:
-					#~ if verbose: print "rlocdsid, ltlbh:", rlocdsid, ltlbh
-					#~ # store best value for previous lineage
-					#~ stlbh |= set(ltlbh)
-					#~ # initiate search for next lineage
-					#~ rlocdsid = tscore[k]; lbh = 0; ltlbh = []
-				#~ coev = float(tscore[2])
-				#~ if coev > lbh:
-					#~ lbh = coev; ltlbh = [tscore]
-				#~ elif coev == lbh:
-					#~ # record ties for comparison with set with other OG as query
-					#~ ltlbh.append(tscore)
-			#~ stlbh |= set(ltlbh)
-			#~ if verbose: print "stlbh (%d):"%k, stlbh
-			#~ lstlbh.append(stlbh)
-		#~ # merge each best-hit set
-		#~ listlbh = list(lstlbh[0] & lstlbh[1])
-		#~ llbh = [float(t[2]) for t in listlbh]
-		#~ # this is biased by excess of many-to-many links with identical low scores
-		
-		# implementation 2: keep each lineage's best hit
-		# unbiased but do not ensure bidirectionality; however bidirectional hits are given double weight
-		dlbh = {}
-		#~ dtlbh = {}
-		for tscore in ltscores:
-			coev = float(tscore[2])
-			for k in (0,1):
-				rlocdsid = tscore[k]
-				prevscore = dlbh.get(rlocdsid, 0.0)
-				if coev > prevscore:
-					dlbh[rlocdsid] = coev
-					#~ dtlbh[rlocdsid] = tscore
-		# could exploit the information of who is best linked with whom
-		#~ listlbh = dtlbh.values()
-		#~ if verbose: print "listlbh:", listlbh
-		#~ llbh = [float(t[2]) for t in listlbh]
-		# but for the moment only collect scores
-		llbh = dlbh.values()
-		if verbose: print "llbh:", llbh
-		# collect statistics
-		ltretval.append(tfamog1+tfamog2+(llt, len(llbh), mean(llbh))+quantile(llbh, [0, 0.25, 0.5, 0.75, 1]))
-	dbco.close()
-	return ltretval
+				tstats = (None,)*(len(quantbreaks)+1)
+			yield (paircode // self.nfamog, paircode % self.nfamog, count, len(sketch))+tstats
 
-def main(orthocolid, reccolid, nfout, dbname, dbengine='postgres', withinfam=False, restrictfamogq='', nffamogqlist=None, nbthreads=1, verbose=False):
+def aggregateScoreShard(args):
+	"""stream the co-evolution scores involving a range of rlocds_id values from the database and summarize them by OG pairs"""
+	dbname, dbengine, reccolid, idrange, blocksize, verbose = args
+	aggregator = OGPairScoreAggregator(idrange=idrange, **dfamogargs)
+	dbcon, dbcur, dbtype, valtoken = get_dbconnection(dbname, dbengine)
+	# records where either lineage is in range, so that the best hits of lineages in range are complete
+	q = "select rlocds_id_1, rlocds_id_2, coev_score from coevolution_scores "
+	q += "where ((rlocds_id_1 >= %s and rlocds_id_1 < %s) or (rlocds_id_2 >= %s and rlocds_id_2 < %s)) "%((valtoken,)*4)
+	targs = idrange+idrange
+	if reccolid:
+		q += "and reconciliation_id=%s "%valtoken
+		targs += (reccolid,)
+	if dbtype=='postgres':
+		# server-side cursor, so that records are streamed rather than loaded at once
+		dbcur = dbcon.cursor(name='coevscores_%d_%d'%idrange)
+		dbcur.itersize = blocksize
+	dbcur.execute(q, targs)
+	nrec = 0
+	while True:
+		ltscores = dbcur.fetchmany(blocksize)
+		if not ltscores: break
+		id1, id2, scores = zip(*ltscores)
+		aggregator.add(np.array(id1, dtype=np.int64), np.array(id2, dtype=np.int64), np.array(scores, dtype=np.float64))
+		nrec += len(ltscores)
+	dbcon.close()
+	aggregator.summarize()
+	if verbose: print "aggregated %d score records involving rlocds_id in [%d, %d)"%((nrec,)+idrange)
+	return aggregator
+
+def main(orthocolid, reccolid, nfout, dbname, dbengine='postgres', withinfam=False, restrictfamogq='', nffamogqlist=None, nbthreads=1, nshards=None, nfscores=None, blocksize=1000000, exactsize=100000, verbose=False):
 	
 	# open DB connection
 	dbcon, dbcur, dbtype, valtoken = get_dbconnection(dbname, dbengine)
-	# create view
-	dbcur.execute("drop view if exists rlocsd2og;")
-	dbcur.execute("""
-	create view rlocsd2og as select rlocds_id, gene_family_id, og_id
-	from orthologous_groups
-	inner join replacement_label_or_cds_code2gene_families using (gene_family_id, replacement_label_or_cds_code)
-	where ortholog_col_id=1;
-	""")
-	# commit for visibility by other connections
-	dbcon.commit()
 	
 	# fetch list of subject (fam, og) tuples
 	qfamogtup = "select distinct gene_family_id, og_id from orthologous_groups "
@@ -101,6 +184,7 @@ def main(orthocolid, reccolid, nfout, dbname, dbengine='postgres', withinfam=Fal
 	qfamogtup += "order by gene_family_id, og_id ;"
 	dbcur.execute(qfamogtup)
 	ltfamog = dbcur.fetchall()
+	dfamogi = dict((tfamog, i) for i, tfamog in enumerate(ltfamog))
 	if nffamogqlist:
 		# subset of query (fam, og) tuples
 		with open(nffamogqlist, 'r') as ffamogqlist:
@@ -108,52 +192,81 @@ def main(orthocolid, reccolid, nfout, dbname, dbengine='postgres', withinfam=Fal
 			for line in ffamogqlist:
 				lsp = line.rstrip('\n').split('\t')
 				ltfamogq.append( (lsp[0], int(lsp[1])) )
-			ltfamogqi = [ltfamog.index(t) for t in ltfamogq]
+			ltfamogqi = [dfamogi[t] for t in ltfamogq]
 	else:
 		# query set same as subject set
 		ltfamogqi = range(len(ltfamog)-1)
-	# close connection
-	dbcon.close()
-
-	if reccolid==0:
-		# skip check multiplicity of reconciliation collection
-		wrc = ";"
-	else:
+	
+	# map gene lineages to the index of their (fam, og) tuple
+	dbcur.execute("""
+	select rlocds_id, gene_family_id, og_id
+	from orthologous_groups
+	inner join replacement_label_or_cds_code2gene_families using (gene_family_id, replacement_label_or_cds_code)
+	where ortholog_col_id=%s;
+	"""%valtoken, (orthocolid,))
+	lrlocdsfamog = dbcur.fetchall()
+	famogidx = np.empty(max([0]+[t[0] for t in lrlocdsfamog])+1, dtype=np.int64)
+	famogidx.fill(-1)
+	for rlocdsid, fam, og in lrlocdsfamog:
+		famogidx[rlocdsid] = dfamogi.get((fam, og), -1)
+	del lrlocdsfamog
+	dfamidx = {}
+	famogfam = np.array([dfamidx.setdefault(fam, len(dfamidx)) for fam, og in ltfamog], dtype=np.int64)
+	isquery = np.zeros(len(ltfamog), dtype=bool)
+	isquery[ltfamogqi] = True
+	dfamogargs.update(famogidx=famogidx, famogfam=famogfam, isquery=isquery, withinfam=withinfam, exactsize=exactsize)
+	
+	if reccolid!=0 and not nfscores:
 		# check multiplicity of reconciliation collection
-		dbcur.execute("select distinct reconciliation_id from phylogeny.coevolution_scores;")
+		dbcur.execute("select distinct reconciliation_id from coevolution_scores;")
 		lreccol = dbcur.fetchall()
 		if len(lreccol)==1:
 			# will not avoid further overhead of query constraint on reconciliation_id
-			wrc = ";"
+			reccolid = 0
+	# close connection
+	dbcon.close()
+	
+	# single pass over the co-evolution scores, aggregated by OG pairs
+	if nfscores:
+		# compact binary score file (see coevolution_scores_io module)
+		aggregator = OGPairScoreAggregator(**dfamogargs)
+		for id1, id2, scores in coevolution_scores_io.iter_coevol_score_blocks(nfscores):
+			aggregator.add(id1, id2, scores)
+		aggregator.summarize()
+	else:
+		# the score table is split in shards of rlocds_id ranges, streamed in parallel, summarized and merged;
+		# records linking lineages of two shards are read by both
+		if not nshards: nshards = nbthreads
+		step = len(famogidx)//nshards + 1
+		lidranges = [(k*step, (k+1)*step) for k in range(nshards)]
+		iterargs = ((dbname, dbengine, reccolid, idrange, blocksize, verbose) for idrange in lidranges)
+		if nbthreads > 1:
+			pool = mp.Pool(processes=nbthreads)
+			iteragg = pool.imap_unordered(aggregateScoreShard, iterargs, chunksize=1)
 		else:
-			# will filter queries based on reconciliation collection
-			wrc = "and reconciliation_id=%d ;"%reccolid
-
-	qogogsc = """
-	select least(rlocds_id_1, rlocds_id_2), greatest(rlocds_id_1, rlocds_id_2), coev_score 
-	from coevolution_scores 
-	inner join rlocsd2og as og1 on rlocds_id_1=og1.rlocds_id 
-	inner join rlocsd2og as og2 on rlocds_id_2=og2.rlocds_id 
-	where (og1.gene_family_id=%s and og1.og_id=%s and og2.gene_family_id=%s and og2.og_id=%s) 
-	or (og2.gene_family_id=%s and og2.og_id=%s and og1.gene_family_id=%s and og1.og_id=%s) 
-	"""+wrc
-
-	# run the queries in parallel
-	pool = mp.Pool(processes=nbthreads)
-	iterargs = ((qogogsc, ltfamog, i, dbname, dbengine, withinfam, verbose) for i in ltfamogqi)
-	iterlt = pool.imap_unordered(retrieveIG2OGscores, iterargs, chunksize=1)
-	# an iterator is returned by imap_unordered()
-	# one needs to actually iterate over it to have the pool of parrallel workers to compute
+			iteragg = (aggregateScoreShard(args) for args in iterargs)
+		aggregator = None
+		for shardagg in iteragg:
+			if aggregator is None:
+				aggregator = OGPairScoreAggregator(**dfamogargs)
+			aggregator.merge(shardagg)
+		if nbthreads > 1:
+			pool.close()
+			pool.join()
+	
 	fout = open(nfout, 'w')
-	for lt in iterlt:
-		for t in lt:
-			fout.write('\t'.join([str(f) for f in t])+'\n')
-
+	for t in aggregator.iterPairStats():
+		fout.write('\t'.join([str(f) for f in ltfamog[t[0]]+ltfamog[t[1]]+t[2:]])+'\n')
 	fout.close()
 	
 def usage():
 	s = "Usage: [HELP MESSAGE INCOMPLETE]\n"
 	s += "python %s {--postgresql_db dbname | --sqlite_db dbfile} --out tablefiledest [OTHER OPTIONS]\n"%sys.argv[0]
+	s += "  co-evolution scores are streamed once from the 'coevolution_scores' table (in parallel shards with --threads)\n"
+	s += "  or from a compact binary score file given with --coev_scores_bin (see coevolution_scores_io module).\n"
+	s += "  the table is split in --shards ranges of lineage ids (default: number of threads); more shards lower the memory used by each.\n"
+	s += "  quantiles of best hit scores are exact for OG pairs with up to --exact_quantile_max_size best hits (default: 100000)\n"
+	s += "  and approximated by a streaming quantile sketch beyond.\n"
 	return s
 
 if __name__=='__main__':
@@ -161,7 +274,7 @@ if __name__=='__main__':
 	opts, args = getopt.getopt(sys.argv[1:], 'T:hv', ['ortho_col_id=', 'reconciliation_id=', 'out=', \
 	                                                'postgresql_db=', 'sqlite_db=', 'whitinfam', \
 	                                                'restrict_famog_query=', 'input_famog_query_list=', \
-	                                                'threads=', 'help', 'verbose'])
+	                                                'coev_scores_bin=', 'shards=', 'exact_quantile_max_size=', 'threads=', 'help', 'verbose'])
 	dopt = dict(opts)
 	
 	if ('-h' in dopt) or ('--help' in dopt):
@@ -174,7 +287,6 @@ if __name__=='__main__':
 		dbengine = 'postgres'
 	elif '--sqlite_db' in dopt:
 		dbengine = 'sqlite'
-		raise NotImplementedError, "condensation of coevolution network from gene-lineage to orthologous groups not implement with SQLite database - and unlikely to be so given the huge size of tables to be loaded in memory"
 	else:
 		raise ValueError, "must provide database name (postgreSQL) / file location (SQLite) through '--sqlite_db' or '--postgresql_db' options"
 
@@ -183,9 +295,12 @@ if __name__=='__main__':
 	withinfam = bool(int(dopt.get('--whitinfam', 0)))
 	restrictfamogq = dopt.get('--restrict_famog_query', '')
 	nffamogqlist = dopt.get('--input_famog_query_list')
+	nfscores = dopt.get('--coev_scores_bin')
+	nshards = int(dopt.get('--shards', 0))
+	exactsize = int(dopt.get('--exact_quantile_max_size', 100000))
 	nbthreads = int(dopt.get('--threads', dopt.get('-T', -1)))
 	if nbthreads < 1: nbthreads = mp.cpu_count()
 	verbose = (('-v' in dopt) or ('--verbose' in dopt))
 	if verbose: print "dopt:", dopt
 	
-	main(orthocolid, reccolid, nfout, dbname, dbengine, withinfam, restrictfamogq, nffamogqlist, nbthreads, verbose)
+	main(orthocolid, reccolid, nfout, dbname, dbengine, withinfam, restrictfamogq, nffamogqlist, nbthreads, nshards, nfscores, exactsize=exactsize, verbose=verbose)
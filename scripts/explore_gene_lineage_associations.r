@@ -552,7 +552,7 @@ for (coma in comm.algos){
 					lineageeventsquery = sprintf("
 					select gene_family_id, rlocds_id, event_id, freq, event_type, rec.branch_name as rec_branch, don.branch_name as don_branch
 					from phylogeny.gene_lineage_events 
-					inner join replacement_label_or_cds_code2gene_families using (replacement_label_or_cds_code) 
+					inner join replacement_label_or_cds_code2gene_families using (rlocds_id) 
 					inner join phylogeny.species_tree_events using (event_id) inner join phylogeny.species_tree as rec on rec_branch_id=rec.branch_id 
 					left join phylogeny.species_tree as don on don_branch_id=don.branch_id 
 					where rlocds_id=%s;
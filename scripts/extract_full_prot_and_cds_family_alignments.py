@@ -8,6 +8,9 @@ import gzip
 import re
 import time
 import traceback
+import itertools
+import famseqstore
+from codon_backtranslation import backTranslateAlignment, readFastaRecords
 #~ from numpy import ndarray, zeros
 
 #~ dryrun = True
@@ -60,52 +63,80 @@ def sorttasksbysource(dprotfiletasks):
 def joinlistasline(l):
 	return '\t'.join([str(e) for e in l])+'\n'
 	
-def castPal2Nal(cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog, verbose=False):
-	"""sequential call to pal2nal.pl alignment reverse-translation script
-	
-	given gene family name, folders of protein alignements and aligned gene sequence, respectively,
-	and a file handle to redirect pal2nal.pl verbose log; no return value"""
-	nfprotali = "%s/%s.aln"%(dirfullprotout, cdsfam)
-	nfcdsseq = "%s/%s.fasta"%(dirfullcdsseqout, cdsfam)
+def castPal2Nal(nfprotali, nfcdsseq, verbose=False):
+	"""call to pal2nal.pl alignment reverse-translation script
+
+	given paths to the protein alignment and the unaligned CDS sequences of a family;
+	returns the CDS alignment and pal2nal.pl verbose log (text strings)"""
 	p2ncmd = ["pal2nal.pl", "-output", "fasta", "-codontable", "11", nfprotali, nfcdsseq]
 	if verbose: print ' '.join(p2ncmd)
-	nfoutalnc = "%s/%s.aln"%(dirfullcdsaliout, cdsfam)
-	with open(nfoutalnc, 'w') as foutalnc:
-		subprocess.check_call(p2ncmd, stdout=foutalnc, stderr=fpal2nallog)
-		
-	
-def castMultiPal2Nal(argtup):
-	"""multi-threaded call to pal2nal.pl alignment reverse-translation script
-	
-	given a tuple containg the gene family name, folders of protein alignements and aligned gene sequence, respectively;
-	returns pal2nal.pl verbose log (text string)"""
+	p2npipe = subprocess.Popen(p2ncmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+	return p2npipe.communicate()
+
+def indexCDSFile(argtup):
+	"""extract the fasta records of selected CDSs from a gzipped genomic dump file; returns a list of (cds_id, fasta record) tuples in file order"""
+	nfcdsfasta, scdsids = argtup
+	lcdsrec = []
+	with gzip.open(nfcdsfasta, 'rb') as fcdsfasta:
+		cdsid = None
+		for line in fcdsfasta:
+			if line.startswith('>'):
+				cdsid = line.strip('>\n').split()[0]
+				if cdsid in scdsids: lcdsrec.append((cdsid, [line]))
+			elif lcdsrec and lcdsrec[-1][0]==cdsid:
+				lcdsrec[-1][1].append(line)
+	return [(cdsid, ''.join(lines)) for cdsid, lines in lcdsrec]
+
+def indexCDSSequences(dcdsfiletasks, lnfcdsfasta, nfcdsstore, pool=None):
+	"""gather the CDS sequences required by extraction tasks in a store indexed by cds_id (see famseqstore.py), decompressing each genomic dump file once"""
+	for nf in [nfcdsstore, nfcdsstore+famseqstore.idxext, nfcdsstore+famseqstore.sidxext]:
+		if os.path.exists(nf): os.remove(nf)
+	largs = ((nfcdsfasta, set(cdsid for cdsid, cdsfam in dcdsfiletasks.get(nfcdsfasta, []))) for nfcdsfasta in lnfcdsfasta)
+	itcdsrec = pool.imap(indexCDSFile, largs) if pool else itertools.imap(indexCDSFile, largs)
+	with famseqstore.FamilySeqStore(nfcdsstore, mode='w') as cdsstore:
+		for ncdssrc, lcdsrec in enumerate(itcdsrec):
+			cdsstore.appendmany(lcdsrec)
+			sys.stdout.write("\r%d\tsource files parsed"%(ncdssrc+1))
+	sys.stdout.write("\n")
+
+# arguments shared with backTranslateFamily() worker processes, inherited from the parent process
+dbacktransargs = {}
+
+def backTranslateFamily(cdsfam):
+	"""write the CDS sequences of a family, in the order of its full protein alignment, and the CDS alignment obtained by codon back-translation
+
+	if the family full protein sequences are not aligned (ORFans), only write the CDS sequences.
+	with pal2nal validation, the back-translated alignment is compared to the output of pal2nal.pl;
+	returns a log message (empty string if no validation)"""
 	try:
-		# with multiprocessing
-		if len(argtup)==7:
-			cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog, verbose, queue = argtup
-		elif len(argtup)==6:
-			cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog, verbose = argtup
-			queue = None
-		else:
-			raise ValueError,  "incorrect number of arguments: the argument tuple should contain (cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog [, queue])"
-		nfprotali = "%s/%s.aln"%(dirfullprotout, cdsfam)
-		nfcdsseq = "%s/%s.fasta"%(dirfullcdsseqout, cdsfam)
-		p2ncmd = ["pal2nal.pl", "-output", "fasta", "-codontable", "11", nfprotali, nfcdsseq]
-		if verbose: print ' '.join(p2ncmd)
-		nfoutalnc = "%s/%s.aln"%(dirfullcdsaliout, cdsfam)
-		foutalnc = open(nfoutalnc, 'w')
-		p2npipe = subprocess.Popen(p2ncmd, stdout=foutalnc, stderr=subprocess.PIPE)
-		foutalnc.close()
-		if queue: queue.put(cdsfam)
-		return p2npipe.stderr.read()
+		cdsstore = dbacktransargs['cdsstore']
+		nfprotali = "%s/%s.%s"%(dbacktransargs['dirfullprotout'], cdsfam, ('fasta' if cdsfam==dbacktransargs['orfanfam'] else 'aln'))
+		with open(nfprotali, 'r') as fprotali:
+			lprotrec = readFastaRecords(fprotali)
+		lcdsrec = [cdsstore.fetch(protname) for protname, protheader, protseq in lprotrec]
+		nfcdsseq = "%s/%s.fasta"%(dbacktransargs['dirfullcdsseqout'], cdsfam)
+		with open(nfcdsseq, 'w') as fcdsseq:
+			fcdsseq.writelines(lcdsrec)
+		if cdsfam==dbacktransargs['orfanfam']: return ''
+		lprotseq = [protseq for protname, protheader, protseq in lprotrec]
+		lcdsseq = [''.join(cdsrec.split('\n', 1)[1].split()) for cdsrec in lcdsrec]
+		lcdsali = [">%s\n%s\n"%(protname, cdsali) for (protname, protheader, protseq), cdsali in zip(lprotrec, backTranslateAlignment(lprotseq, lcdsseq))]
+		nfcdsali = "%s/%s.aln"%(dbacktransargs['dirfullcdsaliout'], cdsfam)
+		with open(nfcdsali, 'w') as fcdsali:
+			fcdsali.writelines(lcdsali)
+		if not dbacktransargs['pal2nalvalidation']: return ''
+		p2nout, p2nlog = castPal2Nal(nfprotali, nfcdsseq, verbose=dbacktransargs['verbose'])
+		p2nseqs = [seq.upper() for name, header, seq in readFastaRecords(p2nout.splitlines(True))]
+		outseqs = [seq.upper() for name, header, seq in readFastaRecords(lcdsali)]
+		if p2nseqs==outseqs: return "%s: back-translated alignment matches pal2nal.pl output\n%s"%(cdsfam, p2nlog)
+		else: return "%s: WARNING: back-translated alignment differs from pal2nal.pl output\n%s"%(cdsfam, p2nlog)
 	except Exception, e:
-			print "caught exception:"
-			traceback.print_exc()
-			sys.stdout.flush()
-			raise e
-	#~ fpal2nallog.write(p2npipe.stderr.read())
+		print "caught exception:"
+		traceback.print_exc()
+		sys.stdout.flush()
+		raise e
 
-def main(dirnrprotaln, nfsingletonfasta, nfprotinfotab, nfreplinfotab, dirassemb, dirout, fam_prefix, dirlogs, nfidentseq=None, nbcores=1, verbose=False):
+def main(dirnrprotaln, nfsingletonfasta, nfprotinfotab, nfreplinfotab, dirassemb, dirout, fam_prefix, dirlogs, nfidentseq=None, nbcores=1, pal2nalvalidation=False, verbose=False):
 
 	# define output folders
 	suffdirout = os.path.basename(dirout)
@@ -123,10 +154,6 @@ def main(dirnrprotaln, nfsingletonfasta, nfprotinfotab, nfreplinfotab, dirassemb
 	#~ prefixsinglefam = 'ENTCGS'
 	padlen = 6
 
-	# extracted CDS sequences will be buffered in memory to avoid file open/close operations at every sequence
-	# not to put too high as multiplied by the number of concurrently parsed gene families, i.e. potential the number of gene families
-	nbseq2flushfam = 50
-
 	# optional parsing of table of identical proteins
 	didentseq = {}
 	if nfidentseq:
@@ -337,85 +364,33 @@ def main(dirnrprotaln, nfsingletonfasta, nfprotinfotab, nfreplinfotab, dirassemb
 				# core family
 				foutcore.write(cdsfam+'\n')
 
-	# tasks are sorted by source file, must then order them by cds_id entry
-	for nfcdsfasta in dcdsfiletasks:
-		dcdsfiletasks[nfcdsfasta].sort(key=lambda x: x[0])
-	# to avoid file open/close operations at every sequence, without having to maintain many open connections, buffer content in memory
-	dfambuffer = {}
-	# keep track of how many sequences already extracted for a family so can flush buffer when reaching threshold or done
-	dnextractcds = {}
-	ncdssrc = 0
-
 	if not dryrun:
-		print "# extract CDSs from genomic dump files"
-		## proceed by source file to extract CDSs
-		# the files are ordered by their path, as should be the CDS entries in each family
-		for nfcdsfasta in lnfcdsfasta:
-			with gzip.open(nfcdsfasta, 'rb') as fcdsfasta:
-				cdsid = None
-				dcdsseq = {}
-				for line in fcdsfasta:
-					if line.startswith('>'):
-						cdsid = line.strip('>\n').split()[0]
-					dcdsseq.setdefault(cdsid, []).append(line)
-			ncdssrc += 1
-			#~ print nfcdsfasta
-			for task in dcdsfiletasks[nfcdsfasta]:
-				cdsid, cdsfam = task
-				#~ print '', cdsid, cdsfam
-				dfambuffer.setdefault(cdsfam, []).append(''.join(dcdsseq[cdsid]))
-				#~ dfambuffer.setdefault(cdsfam, {}).update({cdsid:''.join(dcdsseq[cdsid])})
-				nprevextractcds = dnextractcds.get(cdsfam, 0)
-				nextrbuffcds = nprevextractcds + len(dfambuffer[cdsfam])
-				if len(dfambuffer[cdsfam])>=nbseq2flushfam or nextrbuffcds==dcdsfamsize[cdsfam]:
-					# all CDS extracted, flush buffer
-					if nprevextractcds>0: wa = 'a'
-					else: wa = 'w'
-					with open("%s/%s.fasta"%(dirfullcdsseqout, cdsfam), wa) as fdest:
-						fdest.writelines(dfambuffer[cdsfam])
-					# increment extracted CDS count in family
-					dnextractcds[cdsfam] = nextrbuffcds
-					del dfambuffer[cdsfam]
-			sys.stdout.write("\r%d\tsource files parsed ; %d\tfamilies in buffer"%(ncdssrc, len(dfambuffer)))
+		pool = multiprocessing.Pool(processes=nbcores) if nbcores > 1 else None
+		print "# index CDSs from genomic dump files"
+		# each file is decompressed once, and the required CDS sequences are stored in a single file with an index, to be memory-mapped
+		nfcdsstore = "%s/full_cds_sequences.fasta"%(dirout)
+		indexCDSSequences(dcdsfiletasks, lnfcdsfasta, nfcdsstore, pool)
 
-		sys.stdout.write("\n")
-		if dfambuffer:
-			# all connections should be shut at the end of the loop
-			raise ValueError, "not all destination CDS family fasta file connections are closed ; some some family must expect more sequences"
-		
-		## cast pal2nal on (full protein alignment, unaligned CDS fasta) file pairs
-		# detect the number of processors
+		## write CDS sequences and back-translate full protein alignments into CDS alignments
 		print "# reverse translate alignments"
 		dirpal2nallogs = "%s/pal2nal"%dirlogs
 		if not os.path.exists(dirpal2nallogs):
 			os.mkdir(dirpal2nallogs)
-		fpal2nallog = open("%s/extract_full_prot+cds_family_alignments.pal2nal_log"%dirpal2nallogs, 'w')
-		# sequentially
-		#~ np2p = 0
-		#~ for cdsfam in allcdsfam:
-			#~ castPal2Nal(cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog)
-			#~ np2p += 1
-			#~ sys.stdout.write("\r%d\t/%d"%(np2p, len(allcdsfam)))
-		
-		# with multithreading ; using map_assync and a queue, untested
-		pool = multiprocessing.Pool(processes=nbcores)
-		#~ manag = multiprocessing.Manager()
-		#~ queue = manag.Queue()
-		#~ p2nlog = pool.map(castMultiPal2Nal, ((cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog, verbose, queue) for cdsfam in allcdsfam))
-		p2nlog = pool.map(castMultiPal2Nal, ((cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog, verbose) for cdsfam in allcdsfam))
-		#~ result = pool.map_async(castMultiPal2Nal, ((cdsfam, dirfullprotout, dirfullcdsseqout, dirfullcdsaliout, fpal2nallog, verbose, queue) for cdsfam in allcdsfam))
-		#~ # monitor loop
-		#~ while True:
-			#~ if result.ready():
-				#~ break
-			#~ else:
-				#~ sys.stdout.write("\r%d\t/%d"%(queue.qsize(), len(allcdsfam)))
-				#~ time.sleep(0.5)
-
-		#~ p2nlog = result.get()
-		fpal2nallog.write('\n'.join(p2nlog)+'\n')
-
-		fpal2nallog.close()
+		# the CDS index is loaded before forking worker processes, so it is shared with them
+		dbacktransargs.update(cdsstore=famseqstore.FamilySeqStore(nfcdsstore), orfanfam=orfanfam, dirfullprotout=dirfullprotout, \
+		                      dirfullcdsseqout=dirfullcdsseqout, dirfullcdsaliout=dirfullcdsaliout, pal2nalvalidation=pal2nalvalidation, verbose=verbose)
+		if pool:
+			pool.close()
+			pool = multiprocessing.Pool(processes=nbcores)
+			itp2nlog = pool.imap(backTranslateFamily, [orfanfam]+allcdsfam, chunksize=16)
+		else:
+			itp2nlog = itertools.imap(backTranslateFamily, [orfanfam]+allcdsfam)
+		with open("%s/extract_full_prot+cds_family_alignments.pal2nal_log"%dirpal2nallogs, 'w') as fpal2nallog:
+			for np2p, p2nlog in enumerate(itp2nlog):
+				fpal2nallog.write(p2nlog)
+				if np2p%1000==0: sys.stdout.write("\r%d\t/%d"%(np2p, len(allcdsfam)))
+		if pool: pool.close()
+		dbacktransargs['cdsstore'].close()
 		sys.stdout.write("\n")
 
 def usage():
@@ -437,7 +412,8 @@ def usage():
 	s += 'Other options:\n'
 	s += '--logs\t\tpath to log folder (default to \'dirout/logs\')\n'
 	s += '--identical_seqs\t\tpath to table of identical protein sequences\n'
-	s += '--threads\t\tnumber of threads for running Pal2Nal in parallel (defaut to full CPU core capacity)\n'
+	s += '--threads\t\tnumber of processes for extracting and back-translating CDS sequences in parallel (defaut to full CPU core capacity)\n'
+	s += '--pal2nal_validation\tvalidate the back-translated CDS alignments against the output of pal2nal.pl; results are reported in the pal2nal log\n'
 	s += '--verbose|-v\tverbose output'
 	s += '--help|-h\tprint this help message'
 	return s
@@ -448,7 +424,7 @@ if __name__ == '__main__':
 	opts, args = getopt.getopt(sys.argv[1:], 'h', ['nrprot_fam_alns=', 'assemblies=', 'singletons=', \
 	                                               'prot_info=', 'repli_info=', 'identical_prots=', \
 	                                               'famprefix=', \
-	                                               'dirout=', 'logs=', 'threads=', 'help', 'verbose'])
+	                                               'dirout=', 'logs=', 'threads=', 'pal2nal_validation', 'help', 'verbose'])
 	dopt = dict(opts)
 	if ('-h' in dopt) or ('--help' in dopt):
 		print usage()
@@ -464,9 +440,10 @@ if __name__ == '__main__':
 	dirlogs = dopt.get('--logs', "%s/logs"%(dirout))
 	nfidentseq = dopt.get('--identical_prots')
 	nbcores = int(dopt.get('--threads', multiprocessing.cpu_count()))
+	pal2nalvalidation = ('--pal2nal_validation' in dopt)
 	verbose = ('-v' in dopt) or ('--verbose' in dopt)
 	
-	main(dirnrprotaln, nfsingletonfasta, nfprotinfotab, nfreplinfotab, dirassemb, dirout, fam_prefix, dirlogs, nfidentseq, nbcores, verbose)
+	main(dirnrprotaln, nfsingletonfasta, nfprotinfotab, nfreplinfotab, dirassemb, dirout, fam_prefix, dirlogs, nfidentseq, nbcores, pal2nalvalidation, verbose)
 	
         
        
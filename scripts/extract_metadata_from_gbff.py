@@ -1,5 +1,7 @@
 #!/usr/bin/python
 import sys, os, getopt
+import itertools
+import multiprocessing as mp
 import gzip
 import re
 
@@ -61,28 +63,7 @@ def parse_assembly_name(assembname, reass=reass, group=0):
 	if group=='all': return geass
 	else: return geass[group]
 	
-## script
-
-opts, args = getopt.getopt(sys.argv[1:], '', ['assembly_folder_list=', 'add_raw_metadata=', 'add_curated_metadata=', 'add_dbxref=', 'add_assembly_info_dir=', 'default_species_name=', 'output='])
-dopt = dict(opts)
-nfldirassemb = dopt['--assembly_folder_list']
-nfdhandmetaraw = dopt.get('--add_raw_metadata')
-nfdhandmetacur = dopt.get('--add_curated_metadata')
-nfdhanddbxref = dopt.get('--add_dbxref')
-dirassemblyinfo = dopt.get('--add_assembly_info_dir')
-defspename = dopt.get('--default_species_name')
-output = dopt.get('--output')
-
-## metadata extraction from compressed GenBank flat files
-with open(nfldirassemb, 'r') as fldirassemb:
-	ldirassemb = [line.rstrip('\n') for line in fldirassemb]
-
-
-dmetadata = {}
-lassembname = [os.path.basename(dirassemb) for dirassemb in ldirassemb]
-lassemb = [parse_assembly_name(assembname, reass=reass) for assembname in lassembname]
-lqualif = []
-
+# GenBank flat file line starts
 headerdbstart = "DBLINK      "
 headerftstart = "FEATURES    "
 headerpmstart = "   PUBMED   "
@@ -91,25 +72,31 @@ ftregionstart = "     region "
 smlemptystart = "            "
 lrgemptystart = "                     "
 
-print "parsing genome annotation from genBank flat files..."
-for i, assembname in enumerate(lassembname):
+def parse_gbff_metadata(dirassemb):
+	"""extract metadata from the header and first source feature of the first record of an assembly's GenBank flat file
+
+	the reading of the file stops at the end of the first source block, i.e. the rest of the file is not decompressed.
+	returns the assembly id, a dict of metadata values (including 'pubmed_id' and 'dbxref' from the header)
+	and the list of source qualifiers in order of appearance.
+	"""
+	assembname = os.path.basename(dirassemb)
 	assemb = parse_assembly_name(assembname, reass=reass)
-	print assemb,
+	dassembmeta = {}
+	lassembqualif = []
 	qualif = None
 	val = None
-	with gzip.open("%s/%s_genomic.gbff.gz"%(ldirassemb[i], assembname), 'rb') as gbff:
+	with gzip.open("%s/%s_genomic.gbff.gz"%(dirassemb, assembname), 'rb') as gbff:
 		gbheader = True
 		dbxrefblock = False
 		sourceblock = 0
 		lpmid = []
 		ldbxref = []
-		openpar = 0
 		for line in gbff:
 			if gbheader:   
 				if line.startswith(headerftstart): 
 					gbheader = False
-					if lpmid: dmetadata.setdefault("pubmed_id", {})[assemb] = ','.join(lpmid)
-					if ldbxref: dmetadata.setdefault("dbxref", {})[assemb] = ';'.join(ldbxref)
+					if lpmid: dassembmeta["pubmed_id"] = ','.join(lpmid)
+					if ldbxref: dassembmeta["dbxref"] = ';'.join(ldbxref)
 				if line.startswith(headerdbstart):
 					dbxrefblock = True
 				if line.startswith(headerpmstart):
@@ -127,23 +114,62 @@ for i, assembname in enumerate(lassembname):
 				if line.startswith(lrgemptystart):
 					li = line.strip()
 					if li.startswith('/'):
-						#~ print li
 						qualval = li.strip('/\n').split('=', 1)
 						if len(qualval)>1:
 							# ignore qualifiers without value (e.g. '/focus' in accessions with multiple source blocks)
 							qualif, val = qualval
 							qualif = qualif.lower()
 							if qualif=="dbxref": qualif = "db_xref"
-							if not qualif in lqualif: lqualif.append(qualif) # Calife a la place du Calife!
-							dmetadata.setdefault(qualif, {})[assemb] = val
+							if not qualif in lassembqualif: lassembqualif.append(qualif)
+							dassembmeta[qualif] = val
 					else:
 						if qualif is None: continue # for line loop
-						dmetadata[qualif][assemb] += ' '+li.strip('\n')
+						dassembmeta[qualif] += ' '+li.strip('\n')
 				else:
 					break # for line loop
 			if line.startswith(ftsourcestart) or line.startswith(ftregionstart):
 				sourceblock += 1
-	#~ print assemb, dmetadata['organism'][assemb]
+	return (assemb, dassembmeta, lassembqualif)
+	
+## script
+
+opts, args = getopt.getopt(sys.argv[1:], '', ['assembly_folder_list=', 'add_raw_metadata=', 'add_curated_metadata=', 'add_dbxref=', 'add_assembly_info_dir=', 'default_species_name=', 'output=', 'threads='])
+dopt = dict(opts)
+nfldirassemb = dopt['--assembly_folder_list']
+nfdhandmetaraw = dopt.get('--add_raw_metadata')
+nfdhandmetacur = dopt.get('--add_curated_metadata')
+nfdhanddbxref = dopt.get('--add_dbxref')
+dirassemblyinfo = dopt.get('--add_assembly_info_dir')
+defspename = dopt.get('--default_species_name')
+output = dopt.get('--output')
+nbthreads = int(dopt.get('--threads', 1))
+
+## metadata extraction from compressed GenBank flat files
+with open(nfldirassemb, 'r') as fldirassemb:
+	ldirassemb = [line.rstrip('\n') for line in fldirassemb]
+
+
+dmetadata = {}
+lassembname = [os.path.basename(dirassemb) for dirassemb in ldirassemb]
+lassemb = [parse_assembly_name(assembname, reass=reass) for assembname in lassembname]
+lqualif = []
+
+print "parsing genome annotation from genBank flat files..."
+if nbthreads > 1:
+	pool = mp.Pool(processes=nbthreads)
+	iterassembmeta = pool.imap(parse_gbff_metadata, ldirassemb, chunksize=16)
+else:
+	iterassembmeta = itertools.imap(parse_gbff_metadata, ldirassemb)
+# merge per-assembly results in the order of the assembly list, so that qualifiers (columns) are ordered as first encountered
+for assemb, dassembmeta, lassembqualif in iterassembmeta:
+	print assemb,
+	for qualif, val in dassembmeta.iteritems():
+		dmetadata.setdefault(qualif, {})[assemb] = val
+	for qualif in lassembqualif:
+		if not qualif in lqualif: lqualif.append(qualif) # Calife a la place du Calife!
+if nbthreads > 1:
+	pool.close()
+	pool.join()
 
 print ' ...done'
 # read additional data extracted by hand, if provided:
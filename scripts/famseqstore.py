@@ -0,0 +1,276 @@
+#!/usr/bin/python
+
+"""store of gene family sequence files (fasta, alignments, ...) as a single data file with an index, allowing random access by family id
+
+the data file '<store>' is made of concatenated family records; the index file '<store>.idx' lists for each family
+its identifier, and the byte offset and length of its record in the data file (tab-separated).
+the same index lines sorted by family id are written to '<store>.sidx' when a store is closed after writing,
+so that a single family can be looked up by binary search without reading the whole index.
+replaces folders of hundreds of thousands of small per-family files, which are costly on shared cluster file systems.
+"""
+
+import os, sys, getopt, glob, mmap, shutil, tempfile
+from collections import OrderedDict
+from contextlib import contextmanager
+
+idxext = '.idx'
+sidxext = '.sidx'
+
+def isStore(path):
+	return bool(path) and os.path.isfile(path) and os.path.isfile(path+idxext)
+
+class FamilySeqStore(object):
+	"""indexed store of family records, read through a memory map of the data file
+
+	mode is 'r' (read), 'a' (read and append, creating the store if needed) or 'w' (create a new store).
+	if loadindex is False, the index is not loaded into memory and a family is looked up by binary search
+	in the sorted index file, which is faster when fetching only a few families from a large store;
+	the index is loaded on first lookup if the sorted index is missing or out of date.
+	"""
+	def __init__(self, nfstore, mode='r', loadindex=True):
+		if mode not in ['r', 'a', 'w']: raise ValueError, "invalid mode '%s'; must be one of 'r', 'a' or 'w'"%mode
+		self.nfstore = nfstore
+		self.nfindex = nfstore+idxext
+		self.mode = mode
+		if mode=='w':
+			for nf in [self.nfstore, self.nfindex]:
+				if os.path.exists(nf): raise IOError, "ouput file '%s' already exists"%nf
+		if mode in ['a', 'w']:
+			self.fdata = open(self.nfstore, 'ab')
+			self.findex = open(self.nfindex, 'ab')
+			loadindex = True
+		elif not isStore(nfstore):
+			raise IOError, "cannot find store data file '%s' and its index '%s'"%(self.nfstore, self.nfindex)
+		self.nfsortedindex = nfstore+sidxext
+		self.offset = os.path.getsize(self.nfstore)
+		self.dindex = None
+		self.mmsindex = None
+		self.sidxstart = None
+		if loadindex: self.dindex = self.readIndex()
+		self.mmdata = None
+
+	def readIndex(self):
+		dindex = OrderedDict()
+		with open(self.nfindex, 'r') as findex:
+			for line in findex:
+				famid, offset, length = line.rstrip('\n').split('\t')
+				dindex[famid] = (int(offset), int(length))
+		return dindex
+
+	def _mmap(self, nf):
+		with open(nf, 'rb') as f:
+			if os.fstat(f.fileno()).st_size==0: return None
+			return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def writeSortedIndex(self):
+		"""write the index lines sorted by family id, after a header line recording the size of the index file they were sorted from"""
+		if self.mode!='r': self.findex.flush()
+		with open(self.nfindex, 'r') as findex:
+			lines = findex.readlines()
+		lines.sort(key=lambda line: line.split('\t', 1)[0])
+		nftmp = self.nfsortedindex+'.tmp'
+		with open(nftmp, 'w') as fsindex:
+			fsindex.write("#%d\n"%os.path.getsize(self.nfindex))
+			fsindex.writelines(lines)
+		# replaced at once, so that readers never see a partial sorted index
+		os.rename(nftmp, self.nfsortedindex)
+
+	def _openSortedIndex(self):
+		"""map the sorted index if it matches the current index file; returns False otherwise"""
+		if not os.path.isfile(self.nfsortedindex): return False
+		mm = self._mmap(self.nfsortedindex)
+		if mm is None: return False
+		i = mm.find('\n')
+		if i < 0 or mm[:i]!="#%d"%os.path.getsize(self.nfindex):
+			mm.close()
+			return False
+		self.mmsindex = mm
+		self.sidxstart = i+1
+		return True
+
+	def _bisectSortedIndex(self, famid):
+		mm = self.mmsindex
+		lo = self.sidxstart ; hi = len(mm)
+		# lo and hi always point at the start of a line
+		while lo < hi:
+			mid = (lo+hi)//2
+			i = mm.rfind('\n', lo, mid)
+			i = lo if i < 0 else i+1
+			j = mm.find('\n', i)
+			lsp = mm[i:j].split('\t')
+			if lsp[0]==famid: return (int(lsp[1]), int(lsp[2]))
+			elif lsp[0] < famid: lo = j+1
+			else: hi = i
+		return None
+
+	def lookup(self, famid):
+		"""return the (offset, length) of the record of a family, or None if absent from the store"""
+		if self.dindex is None and self.mmsindex is None:
+			if not self._openSortedIndex(): self.dindex = self.readIndex()
+		if self.dindex is not None:
+			return self.dindex.get(famid)
+		return self._bisectSortedIndex(famid)
+
+	def fetch(self, famid):
+		"""return the record of a family as a string"""
+		loc = self.lookup(famid)
+		if loc is None: raise KeyError, "family '%s' is not in store '%s'"%(famid, self.nfstore)
+		offset, length = loc
+		if length==0: return ''
+		if self.mode!='r': self.fdata.flush()
+		if (self.mmdata is None) or (offset+length > len(self.mmdata)):
+			# map the data file (again if it grew since last mapped)
+			self.mmdata = self._mmap(self.nfstore)
+		return self.mmdata[offset:offset+length]
+
+	__getitem__ = fetch
+
+	def __contains__(self, famid):
+		return self.lookup(famid) is not None
+
+	def families(self):
+		if self.dindex is None: self.dindex = self.readIndex()
+		return self.dindex.keys()
+
+	def __iter__(self):
+		return iter(self.families())
+
+	def __len__(self):
+		return len(self.families())
+
+	def iteritems(self):
+		"""iterate over (family id, record) tuples in the order of the index"""
+		for famid in self.families():
+			yield (famid, self.fetch(famid))
+
+	def appendmany(self, items):
+		"""append an iterable of (family id, record) tuples to the store, writing the data and index in one batch"""
+		if self.mode=='r': raise IOError, "store '%s' was opened read-only"%self.nfstore
+		ldata = []
+		dnewindex = OrderedDict()
+		offset = self.offset
+		for famid, record in items:
+			if (famid in self.dindex) or (famid in dnewindex) or ('\t' in famid) or ('\n' in famid):
+				raise ValueError, "invalid or duplicate family id '%s' for store '%s'"%(famid, self.nfstore)
+			ldata.append(record)
+			dnewindex[famid] = (offset, len(record))
+			offset += len(record)
+		# data are written before the index, so that an interrupted write cannot leave index entries pointing at missing data
+		self.fdata.writelines(ldata)
+		self.fdata.flush()
+		self.findex.writelines(["%s\t%d\t%d\n"%(famid, o, l) for famid, (o, l) in dnewindex.iteritems()])
+		self.findex.flush()
+		self.dindex.update(dnewindex)
+		self.offset = offset
+
+	def append(self, famid, record):
+		self.appendmany([(famid, record)])
+
+	def appendfile(self, famid, nffam):
+		"""append the content of a file as the record of a family, without loading it into memory"""
+		if self.mode=='r': raise IOError, "store '%s' was opened read-only"%self.nfstore
+		if (famid in self.dindex) or ('\t' in famid) or ('\n' in famid):
+			raise ValueError, "invalid or duplicate family id '%s' for store '%s'"%(famid, self.nfstore)
+		length = os.path.getsize(nffam)
+		with open(nffam, 'rb') as ffam: shutil.copyfileobj(ffam, self.fdata)
+		self.fdata.flush()
+		self.findex.write("%s\t%d\t%d\n"%(famid, self.offset, length))
+		self.findex.flush()
+		self.dindex[famid] = (self.offset, length)
+		self.offset += length
+
+	def export(self, famid, dirout=None, ext='fasta'):
+		"""write the record of a family to the file '<dirout>/<famid>.<ext>' (dirout is a new temporary folder by default) and return its path, e.g. to be used as input by external programs"""
+		if dirout is None: dirout = tempfile.mkdtemp(prefix='famseqstore_')
+		nfout = os.path.join(dirout, "%s.%s"%(famid, ext) if ext else famid)
+		with open(nfout, 'wb') as fout: fout.write(self.fetch(famid))
+		return nfout
+
+	@contextmanager
+	def exported(self, famid, ext='fasta'):
+		"""context manager providing the path to a temporary file with the record of a family, which is deleted on exit"""
+		dirtmp = tempfile.mkdtemp(prefix='famseqstore_')
+		try:
+			yield self.export(famid, dirout=dirtmp, ext=ext)
+		finally:
+			shutil.rmtree(dirtmp)
+
+	def close(self):
+		for m in [self.mmdata, self.mmsindex]:
+			if m is not None: m.close()
+		self.mmdata = self.mmsindex = None
+		if self.mode!='r':
+			self.fdata.close()
+			self.findex.close()
+			self.mode = 'r'
+			self.writeSortedIndex()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exctype, excval, exctb):
+		self.close()
+
+def famidFromFileName(nf):
+	"""family id from a file name, stripped of everything after the first dot, or from a RAxML output file name ('RAxML_<type>.<famid>...')"""
+	bnspl = os.path.basename(nf).split('.')
+	if bnspl[0].startswith('RAxML_') and len(bnspl)>1: return bnspl[1]
+	else: return bnspl[0]
+
+def packFolder(dirin, nfstore, ext='fasta', batchsize=10000):
+	"""gather the files '<dirin>/*<ext>' into a new store, with one record per file keyed by family id (see famidFromFileName())"""
+	lnf = sorted(glob.glob(os.path.join(dirin, '*'+ext)))
+	with FamilySeqStore(nfstore, mode='w') as store:
+		for i in range(0, len(lnf), batchsize):
+			lfam = []
+			for nf in lnf[i:i+batchsize]:
+				with open(nf, 'rb') as f: lfam.append((famidFromFileName(nf), f.read()))
+			store.appendmany(lfam)
+	return len(lnf)
+
+def unpackStore(nfstore, dirout, ext='fasta', famids=None):
+	"""write the records of (selected) families of a store to separate files '<dirout>/<famid>.<ext>'"""
+	if not os.path.isdir(dirout): os.makedirs(dirout)
+	with FamilySeqStore(nfstore, loadindex=(famids is None)) as store:
+		for famid in (famids if famids is not None else store.families()):
+			store.export(famid, dirout=dirout, ext=ext)
+
+def usage():
+	s = "Usage: python %s --store=path/to/store [OPTIONS]\n"%sys.argv[0]
+	s += "  Options:\n"
+	s += "    --list\t\tprint the ids of families in the store\n"
+	s += "    --fetch=famid\tprint the record of a family to standard output\n"
+	s += "    --export=famid[,famid,...]\twrite the record of the families to separate files in --dirout (one file per family, named famid.ext)\n"
+	s += "    --unpack\t\twrite the records of all families to separate files in --dirout\n"
+	s += "    --pack=folder\tcreate the store from the files 'folder/*ext' (one file per family)\n"
+	s += "    --dirout=folder\toutput folder for --export/--unpack (default: current folder)\n"
+	s += "    --ext=fasta\t\tfile extension of family files for --export/--unpack/--pack\n"
+	s += "    --sort_index\t(re-)write the sorted index used to look up single families (done whenever the store is written)\n"
+	return s
+
+if __name__=='__main__':
+
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['store=', 'list', 'fetch=', 'export=', 'unpack', 'pack=', 'dirout=', 'ext=', 'sort_index', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt) or not ('--store' in dopt):
+		print usage()
+		sys.exit(0 if '--store' in dopt else 1)
+	nfstore = dopt['--store']
+	dirout = dopt.get('--dirout', os.getcwd())
+	ext = dopt.get('--ext', 'fasta')
+
+	if '--pack' in dopt:
+		packFolder(dopt['--pack'], nfstore, ext=ext)
+	if '--sort_index' in dopt:
+		with FamilySeqStore(nfstore, loadindex=False) as store:
+			store.writeSortedIndex()
+	if '--list' in dopt:
+		with FamilySeqStore(nfstore) as store:
+			for famid in store: print famid
+	if '--fetch' in dopt:
+		with FamilySeqStore(nfstore, loadindex=False) as store:
+			sys.stdout.write(store.fetch(dopt['--fetch']))
+	if '--export' in dopt:
+		unpackStore(nfstore, dirout, ext=ext, famids=dopt['--export'].split(','))
+	if '--unpack' in dopt:
+		unpackStore(nfstore, dirout, ext=ext)
@@ -2,6 +2,14 @@
 import sys
 n=int(sys.argv[1])
 N=int(sys.argv[2])
+if len(sys.argv)>4:
+  # ranges of chunks with balanced estimated costs; the task list is reordered in place (see task_scheduler.py)
+  import task_scheduler
+  nftasklist = sys.argv[3]
+  model = sys.argv[4]
+  nfruntimes = sys.argv[5] if len(sys.argv)>5 else None
+  print ' '.join(task_scheduler.scheduleTaskList(nftasklist, model, chunksize=n, nfruntimes=nfruntimes))
+  sys.exit(0)
 k = 0
 while k*n < N:
   print '%d-%d'%((k*n)+1, min((k+1)*n, N)),
@@ -1,14 +1,18 @@
 #!/usr/bin/python
-import os, glob, sys, getopt
+import os, glob, sys, getopt, time, traceback
 import tree2
 import ptg_utils as ptg
-from parseALErec import parseALERecFile, getOrthologues, getOriSpeciesFromEventLab
+from parseALErec import prescanALERecFile, scanALERecHeader, iterALERecGeneTrees, getOrthologues, getOriSpeciesFromEventLab
 import igraph
-from itertools import combinations
+import numpy as np
+from scipy import sparse
 import multiprocessing as mp
 import cPickle as pickle
 
 allmethods = ['strict', 'unicopy', 'mixed']
+# keyword arguments of orthology inference functions for each type of task, set before forking the worker processes
+dtaskargs = {}
+manifestfields = ['task', 'input_file', 'cost', 'status', 'time']
 
 def summaryOGs(ogs, dlabs, N, verbose):
 	n = len(ogs)
@@ -67,6 +71,42 @@ def indexCleanTreeLabels(genetree, dlabs, dnexustrans={}, drevnexustrans={}, lta
 			node.edit_label('')
 	return (genetree, dnexustrans, drevnexustrans, ltaxnexus)
 
+def orthologousEdgeFrequencies(logs, llabs):
+	"""count the co-membership of leaf labels in orthologous groups (OGs) over a sample of OG sets
+	
+	logs is a list of OG sets, each a list of OGs (lists of leaf labels); llabs is the sorted list of leaf labels.
+	returns the list of edges as (i, j) tuples of indexes in llabs, with i < j for labels found in a same OG
+	and i == j for labels found alone in an OG, and the list of their frequencies (number of OG sets supporting them),
+	ordered by (i, j). identical OGs are only expanded once, and pairs are counted through a sparse membership matrix.
+	"""
+	dlabi = dict((lab, i) for i, lab in enumerate(llabs))
+	N = len(llabs)
+	# frequency of each distinct OG in the sample
+	dogfreq = {}
+	for ogs in logs:
+		for og in ogs:
+			tog = tuple(sorted(og))
+			dogfreq[tog] = dogfreq.get(tog, 0) + 1
+	singlefreqs = np.zeros(N, dtype=np.int64)
+	rows = [] ; cols = [] ; ogfreqs = []
+	for tog, freq in dogfreq.iteritems():
+		if len(tog)==1:
+			singlefreqs[dlabi[tog[0]]] += freq
+		else:
+			rows += [len(ogfreqs)]*len(tog)
+			cols += [dlabi[lab] for lab in tog]
+			ogfreqs.append(freq)
+	# (OG x label) membership matrix; co-membership counts are given by M^T.diag(freqs).M
+	M = sparse.csr_matrix((np.ones(len(cols), dtype=np.int64), (rows, cols)), shape=(len(ogfreqs), N))
+	F = sparse.diags(np.array(ogfreqs, dtype=np.int64), 0, format='csr')
+	C = sparse.triu(M.T * F * M, k=1) + sparse.diags(singlefreqs, 0, dtype=np.int64)
+	# counts are kept integral, as plain int frequencies
+	C = sparse.csr_matrix(C, dtype=np.int64)
+	C.eliminate_zeros()
+	C.sort_indices()
+	C = C.tocoo()
+	return (zip(C.row.tolist(), C.col.tolist()), C.data.tolist())
+
 def getVertexClustering(g, communitymethod, w='weight', **kw):
 	"""generic call to igraph.Graph community finding functions to return homogeneous output format"""
 	commfunname = communitymethod if hasattr(igraph.Graph, communitymethod) else "community_"+communitymethod
@@ -141,42 +181,45 @@ def orthoFromSampleRecs(nfrec, outortdir, nsample=[], methods=['mixed'], \
 	verbose = kw.get('verbose')
 	fam = os.path.basename(nfrec).split('-', 1)[0]
 	if verbose: print "\n# # # %s"%fam
-	# collect the desired sample from the reconciliation file
-	dparserec = parseALERecFile(nfrec, skipLines=True, skipEventFreq=True, nsample=nsample, returnDict=True)
-	lrecgt = dparserec['lrecgt']
+	# reconciled gene trees of the desired sample are parsed one at a time from the reconciliation file;
+	# they are only kept in memory when they need to be written out afterwards
 	if kw.get('userefspetree'):
-		refspetree = dparserec['spetree']
+		refspetree = prescanALERecFile(nfrec, skipEventFreq=True, indexSampleEvents=False)['spetree']
 	else:
 		refspetree = None
 	colourCombinedTree = kw.get('colourCombinedTree')
+	lrecgt = []
+	recgt0 = None
+	gs = []
 	
 	ddogs = {}
 	dnexustrans = {}
 	drevnexustrans = {}
 	ltaxnexus = []
 	llabs = []
-	for i, recgenetree in enumerate(lrecgt):
-		if nsample: g = nsample[i]
-		else: g = i
+	for i, (g, recgenetree) in enumerate(iterALERecGeneTrees(nfrec, nsample=nsample)):
+		gs.append(g)
 		if verbose: print recgenetree
 		if verbose: print "\n# # reconciliation sample %d"%g
 		N = recgenetree.nb_leaves()
 		dlabs = {}
+		# node event chains are parsed once for all methods
+		eventchains = {}
 		if set(['strict', 'mixed']) & set(methods):
 			if verbose: print "\n# strict_ogs:\n"
-			strict_ogs, unclassified, dlabs = getOrthologues(recgenetree, method='strict', refspetree=refspetree, dlabs=dlabs, **kw)
+			strict_ogs, unclassified, dlabs = getOrthologues(recgenetree, method='strict', refspetree=refspetree, dlabs=dlabs, eventChainCache=eventchains, **kw)
 			n1 = summaryOGs(strict_ogs, dlabs, N, verbose)
 		else:
 			strict_ogs = unclassified = None; n1 = 'NA'
 		if 'unicopy' in methods:
 			if verbose: print "\n# unicopy_ogs:\n"
-			unicopy_ogs, notrelevant, dlabs = getOrthologues(recgenetree, method='unicopy', refspetree=refspetree, dlabs=dlabs, **kw)
+			unicopy_ogs, notrelevant, dlabs = getOrthologues(recgenetree, method='unicopy', refspetree=refspetree, dlabs=dlabs, eventChainCache=eventchains, **kw)
 			n2 = summaryOGs(unicopy_ogs, dlabs, N, verbose)
 		else:
 			unicopy_ogs = None; n2 = 'NA'
 		if 'mixed' in methods:
 			if verbose: print "\n# mixed_ogs:\n"
-			mixed_ogs, unclassified, dlabs = getOrthologues(recgenetree, method='mixed', strict_ogs=strict_ogs, unclassified=unclassified, refspetree=refspetree, dlabs=dlabs, **kw) #
+			mixed_ogs, unclassified, dlabs = getOrthologues(recgenetree, method='mixed', strict_ogs=strict_ogs, unclassified=unclassified, refspetree=refspetree, dlabs=dlabs, eventChainCache=eventchains, **kw) #
 			n3 = summaryOGs(mixed_ogs, dlabs, N, verbose)
 		else:
 			mixed_ogs = None; n3 = 'NA'
@@ -201,14 +244,15 @@ def orthoFromSampleRecs(nfrec, outortdir, nsample=[], methods=['mixed'], \
 				         dnexustrans=dnexustrans, drevnexustrans=drevnexustrans, ltaxnexus=ltaxnexus, update=False)
 		
 		ddogs[g] = {'strict':strict_ogs, 'unicopy':unicopy_ogs, 'mixed':mixed_ogs}
+		if colourTreePerSampledRecGT: lrecgt.append(recgenetree)
+		if colourCombinedTree and i==0: recgt0 = recgenetree
 		if verbose: print "\n# # # # # # # #"
 		if i==0:
 			# collect the leaf labels; just do once
 			llabs = dlabs.values() 
 			llabs.sort()
 	
-	R = len(lrecgt)
-	gs = nsample if nsample else range(R)
+	R = len(gs)
 	for method in methods:
 		ltrees = []
 		nfoutrad = os.path.join(outortdir, method, "%s_%s"%(fam, method))
@@ -223,30 +267,16 @@ def orthoFromSampleRecs(nfrec, outortdir, nsample=[], methods=['mixed'], \
 					foutort.write('\n'.join([' '.join(x) for x in ogs])+'\n#\n')
 		
 		if graphCombine or majRuleCombine:
-			## for later output
-			recgt0 = lrecgt[0] if colourCombinedTree else None 
+			## for later output, recgt0 is the first sampled tree (if colourCombinedTree)
 			# could also use the ALE consensus tree, which has branch supports but has no lengths
-			## first make a dict of edge frequencies
-			dedgefreq = {}
-			for g in gs:
-				ogs = ddogs[g][method]
-				for og in ogs:
-					if len(og)==1:
-						orfan = og[0] ; combo = (orfan, orfan)
-						dedgefreq[combo] = dedgefreq.get(combo, 0) + 1
-					else:
-						# get all pairs of genes in the OG
-						combogs = combinations(sorted(og), 2)
-						# add the counts
-						for combo in combogs:
-							dedgefreq[combo] = dedgefreq.get(combo, 0) + 1
+			## first count edge frequencies
+			edges, freqs = orthologousEdgeFrequencies([ddogs[g][method] for g in gs], llabs)
 			## build a graph of connectivity of the genes in OGs, integrating over the sample
 			gOG = igraph.Graph()
 			gOG.add_vertices(len(llabs))
 			gOG.vs['name'] = llabs
 			# first make a full weighted graph
-			# add the edges to the graph
-			edges, freqs = zip(*dedgefreq.iteritems())
+			# add the edges to the graph (as vertex indexes, following the order of llabs)
 			gOG.add_edges(edges)
 			gOG.es['weight'] = freqs
 			if majRuleCombine:
@@ -294,6 +324,81 @@ def orthoUnicopyFromUnreconciledGT(nfgt, nfgtmt, outortdir, method='unreconciled
 	nfoutrad = os.path.join(outortdir, method, "%s_%s"%(fam, method))
 	writeOrthologs(nfoutrad, 'unicopy', unicopy_ogs, dlabs, colourTree, gt, ltreenames=["tree_0"], figtree=True)
 
+def recFileCost(nfrec, nsample=[]):
+	"""estimated cost of orthology inference from a reconciliation file: number of gene tree leaves x number of sampled reconciled gene trees"""
+	nrecgt, nleaves = scanALERecHeader(nfrec)
+	if nsample: nrecgt = len([k for k in nsample if k < nrecgt])
+	return nleaves*nrecgt
+
+def treeFileCost(nfgt):
+	"""estimated cost of orthology inference from a single gene tree file: approximate number of leaves"""
+	with open(nfgt, 'r') as fgt:
+		return fgt.read().count(',')+1
+
+def orthoTask(args):
+	"""run an orthology inference task, given as a (task type, input file, cost) tuple; returns a (task type, input file, cost, status, time) tuple"""
+	task, nf, cost = args
+	t0 = time.time()
+	try:
+		if task=='reconciled':
+			orthoFromSampleRecs(nf, **dtaskargs[task])
+		elif task=='unreconciled':
+			orthoUnicopyFromUnreconciledGT(nf, **dtaskargs[task])
+		else:
+			raise ValueError, "unknown task type: '%s'"%task
+		status = 'done'
+	except Exception, e:
+		traceback.print_exc()
+		status = 'failed: %s'%repr(e)
+	return (task, nf, cost, status, time.time()-t0)
+
+def readManifest(nfmanifest):
+	"""set of (task type, input file) tuples recorded as done in a task manifest"""
+	sdone = set([])
+	with open(nfmanifest, 'r') as fmanifest:
+		for line in fmanifest:
+			lsp = line.rstrip('\n').split('\t')
+			if len(lsp)==len(manifestfields) and lsp[3]=='done':
+				sdone.add((lsp[0], lsp[1]))
+	return sdone
+
+def runOrthoTasks(ltasks, nbthreads=1, nfmanifest=None, resume=False):
+	"""run orthology inference tasks, given as (task type, input file, cost) tuples, in a pool of processes
+	
+	tasks are started by decreasing estimated cost and handed one at a time to the next idle worker,
+	so that the slowest families start first and cheaper ones fill in the gaps.
+	the outcome of each task is appended to the manifest file as soon as it completes;
+	if resume is True, tasks already recorded as done in the manifest are skipped.
+	returns the list of failed tasks.
+	"""
+	if resume and nfmanifest and os.path.exists(nfmanifest):
+		sdone = readManifest(nfmanifest)
+		ltasks = [t for t in ltasks if (t[0], t[1]) not in sdone]
+		fmanifest = open(nfmanifest, 'a')
+	elif nfmanifest:
+		fmanifest = open(nfmanifest, 'w')
+		fmanifest.write('\t'.join(manifestfields)+'\n')
+	else:
+		fmanifest = None
+	ltasks = sorted(ltasks, key=lambda t: t[2], reverse=True)
+	if nbthreads > 1:
+		pool = mp.Pool(processes=nbthreads)
+		iterres = pool.imap_unordered(orthoTask, ltasks, chunksize=1)
+	else:
+		iterres = (orthoTask(t) for t in ltasks)
+	lfailed = []
+	for res in iterres:
+		print "%s\t%s"%(res[1], res[3])
+		if fmanifest:
+			fmanifest.write('%s\t%s\t%d\t%s\t%.2f\n'%res)
+			fmanifest.flush()
+		if res[3]!='done': lfailed.append(res)
+	if nbthreads > 1:
+		pool.close()
+		pool.join()
+	if fmanifest: fmanifest.close()
+	return lfailed
+
 def usage(mini=False):
 	basics = "Usage:\n python %s -i /path/to/input.reconciliation.dir -o /path/to/output.dir [OPTIONS]\n"%sys.argv[0]
 	if mini: return basics
@@ -309,7 +414,11 @@ def usage(mini=False):
 	s += "  --unreconciled.format\texpected input file format for the consensus/ML gene trees (default: Nexus);\n"
 	s += "  --unreconciled.ext\texpected file extension for the consensus/ML gene trees (default: '.con.tre');\n"
 	s += "\t\t\t\t\t\tsimple unicity-based classification will be applied.\n"
-	s += "  --threads\t\t\tnumber of parralel processes to run.\n"
+	s += "  --threads\t\t\tnumber of parralel processes to run; families are processed by decreasing estimated cost\n"
+	s += "\t\t\t\t\t(number of gene tree leaves x number of sampled reconciled gene trees).\n"
+	s += "  --manifest\t\tpath of the task completion manifest, where the status of each family is recorded as it completes\n"
+	s += "\t\t\t\t\t(default: 'orthologs_task_manifest.tab' in the output directory).\n"
+	s += "  --resume\t\tskip the families recorded as done in the manifest.\n"
 	s += "  --verbose {0,1,2}\tverbose mode, from none to plenty.\n"
 	s += "  -v\t\t\tequivalent to --verbose=1.\n"
 	return s
@@ -321,7 +430,7 @@ if __name__=='__main__':
 														'colour.sampled.trees', 'report.ogs.per.sampled.tree', 'summary.per.sampled.tree', \
 														'majrule.combine=', 'graph.combine=', 'colour.combined.tree', \
 														'use.unreconciled.gene.trees=', 'unreconciled.format=', 'unreconciled.ext=', \
-														'skip.reconciled', 'threads=', 'verbose=', 'help'])
+														'skip.reconciled', 'threads=', 'manifest=', 'resume', 'verbose=', 'help'])
 	dopt = dict(opts)
 	if ('-h' in dopt) or ('--help' in dopt):
 		print usage()
@@ -359,9 +468,12 @@ if __name__=='__main__':
 		raise ValueError, "values for --graph.combine must be a real within the interval ]0; 1]"
 	nbthreads = int(dopt.get('--threads', dopt.get('-T', -1)))
 	if nbthreads < 1: nbthreads = mp.cpu_count()
+	nfmanifest = dopt.get('--manifest', os.path.join(outortdir, 'orthologs_task_manifest.tab'))
+	resume = ('--resume' in dopt)
 	
 	## main execution
-	lnfrec = glob.glob('%s/*ale.ml_rec'%(alerecdir))
+	# reconciliations under the dated (*.ale.ml_rec) or undated (*.ale.uml_rec) model, as set by --ale.model
+	lnfrec = glob.glob('%s/*ale.%s_rec'%(alerecdir, ('uml' if ALEmodel=='undated' else 'ml')))
 
 	for d in methods:
 		pd = os.path.join(outortdir, d)
@@ -382,25 +494,14 @@ if __name__=='__main__':
 		print "Warning: verbose mode is DISABLED when running in parallel"
 		verbose = 0
 			
-	def orthoFromSampleRecsSetArgs(nfrec):
-		orthoFromSampleRecs(nfrec, outortdir, nsample=nsample, ALEmodel=ALEmodel, \
+	ltasks = []
+	if not skipReconciled:
+		dtaskargs['reconciled'] = dict(outortdir=outortdir, nsample=nsample, ALEmodel=ALEmodel, \
 							methods=methods, userefspetree=userefspetree, trheshExtraSpe=trheshExtraSpe, reRootMaxBalance=reRootMaxBalance, \
 							graphCombine=graphCombine, majRuleCombine=majRuleCombine, colourCombinedTree=colourCombinedTree, \
 							foutdiffog=foutdiffog, outputOGperSampledRecGT=outputOGperSampledRecGT, colourTreePerSampledRecGT=colourTreePerSampledRecGT, \
 							verbose=verbose)
-	
-	if not skipReconciled:
-		if nbthreads==1:
-			# run sequentially
-			for nfrec in lnfrec:
-				print nfrec
-				orthoFromSampleRecsSetArgs(nfrec)
-				if verbose: print " # # # # # # # \n"
-			if foutdiffog: foutdiffog.close()
-		else:
-			# or run in parallel
-			pool = mp.Pool(processes=nbthreads)
-			res = pool.map(orthoFromSampleRecsSetArgs, lnfrec)
+		ltasks += [('reconciled', nfrec, recFileCost(nfrec, nsample)) for nfrec in lnfrec]
 
 	if unreconciledGTdir:
 		# list the consensus/ML gene trees available
@@ -414,16 +515,14 @@ if __name__=='__main__':
 		pd = os.path.join(outortdir, 'unreconciled')
 		if not os.path.isdir(pd):
 			os.mkdir(pd)
-			
-		def orthoUnicopyFromUnrecSetArgs(nfgtconmis):
-			return orthoUnicopyFromUnreconciledGT(nfgtconmis, unreconciledGTfmt, outortdir, colourTree=colourCombinedTree, verbose=verbose)
 		
-		if nbthreads==1:
-			# run sequentially
-			for nfgtconmis in lnfgtconmis:
-				orthoUnicopyFromUnrecSetArgs(nfgtconmis)
-		else:
-			# or run in parallel
-			pool = mp.Pool(processes=nbthreads)
-			res = pool.map(orthoUnicopyFromUnrecSetArgs, lnfgtconmis)
-
+		dtaskargs['unreconciled'] = dict(nfgtmt=unreconciledGTfmt, outortdir=outortdir, colourTree=colourCombinedTree, verbose=verbose)
+		ltasks += [('unreconciled', nfgtconmis, treeFileCost(nfgtconmis)) for nfgtconmis in lnfgtconmis]
+	
+	# run all families, reconciled or not, in the same pool of processes
+	lfailed = runOrthoTasks(ltasks, nbthreads=nbthreads, nfmanifest=nfmanifest, resume=resume)
+	if foutdiffog: foutdiffog.close()
+	if lfailed:
+		print "Error: orthology inference failed for %d families (see '%s'):"%(len(lfailed), nfmanifest)
+		for res in lfailed: print "%s\t%s"%(res[1], res[3])
+		sys.exit(1)
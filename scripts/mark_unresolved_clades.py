@@ -9,7 +9,9 @@ import multiprocessing
 from Bio import AlignIO, Align, Alphabet
 #~ from random import shuffle
 from random import randint
+from StringIO import StringIO
 from ptg_utils import *
+import famseqstore
 
 sys.setrecursionlimit(20000)
 
@@ -377,14 +379,21 @@ def main(nfgenetree, diraln, dirout, outtag, mkdircons=True, **kw):
 	bnspl = os.path.basename(nfgenetree).split('.')
 	if bnspl[0].startswith('RAxML_'): bngt = bnspl[1]
 	else: bngt = bnspl[0]
-	globaln = "%s/%s*%s*"%(diraln, bngt, aliformatin[:3])
-	try:
-		nfaln = glob.glob(globaln)[0]
-	except IndexError:
-		globaln = "%s/%s*aln*"%(diraln, bngt)
-		nfaln = glob.glob(globaln)[0]
-	print nfaln
-	bnfaln = os.path.basename(nfaln).split('.')[0]
+	if famseqstore.isStore(diraln):
+		# alignments are read from a family sequence store, indexed by gene family id
+		with famseqstore.FamilySeqStore(diraln, loadindex=False) as alnstore:
+			nfaln = StringIO(alnstore.fetch(bngt))
+		print "%s:%s"%(diraln, bngt)
+		bnfaln = bngt
+	else:
+		globaln = "%s/%s*%s*"%(diraln, bngt, aliformatin[:3])
+		try:
+			nfaln = glob.glob(globaln)[0]
+		except IndexError:
+			globaln = "%s/%s*aln*"%(diraln, bngt)
+			nfaln = glob.glob(globaln)[0]
+		print nfaln
+		bnfaln = os.path.basename(nfaln).split('.')[0]
 	if bnspl[0].startswith('RAxML_rootedTree'):
 		# tree is already rooted, but the branch supports are storred in the comments
 		genetree = tree2.AnnotatedNode(file=nfgenetree, keep_comments=True)
@@ -405,14 +414,19 @@ def main(nfgenetree, diraln, dirout, outtag, mkdircons=True, **kw):
 	didseq = {}
 	if diridentseq:
 		# parse pairs of (reference, redundant) sequences that are identical
-		globidseq = "%s/*%s*"%(diridentseq, bngt)
-		gnfidseq = glob.glob(globidseq)
-		if not gnfidseq: raise OSError, "cannot find file matching pattern: '%s'"%globidseq
-		nfidseq = gnfidseq[0]
-		with open(nfidseq, 'r') as fidseq:
-			for line in fidseq:
-				refidseq, redidseq = line.rstrip('\n').split('\t')
-				didseq.setdefault(refidseq, []).append(redidseq)
+		if famseqstore.isStore(diridentseq):
+			with famseqstore.FamilySeqStore(diridentseq, loadindex=False) as idseqstore:
+				if not bngt in idseqstore: raise OSError, "cannot find family '%s' in store '%s'"%(bngt, diridentseq)
+				lidseqlines = idseqstore.fetch(bngt).splitlines(True)
+		else:
+			globidseq = "%s/*%s*"%(diridentseq, bngt)
+			gnfidseq = glob.glob(globidseq)
+			if not gnfidseq: raise OSError, "cannot find file matching pattern: '%s'"%globidseq
+			with open(gnfidseq[0], 'r') as fidseq:
+				lidseqlines = fidseq.readlines()
+		for line in lidseqlines:
+			refidseq, redidseq = line.rstrip('\n').split('\t')
+			didseq.setdefault(refidseq, []).append(redidseq)
 		if didseq:
 			# remove any redundant sequence from the gene tree before processing
 			cleangenetree = copy.deepcopy(genetree)
@@ -480,7 +494,9 @@ def usage():
 	s += '  --in_gene_tree_list\tpath\tpath to file containing the list of paths for source gene trees (MANDATORY).\n'
 	s += '\t\t\t\t (which must be point estimates [ML, consensus] in Newick format).\n'
 	s += '  --diraln\t\tpath\tpath to source alignment folder; defaults to the same older as each listed gene tree.\n'
+	s += '\t\t\t\t can also be the path to a family sequence store (see famseqstore.py) of alignments indexed by gene family id.\n'
 	s += '  --dir_identseq\npath to folder containing lists of identical sequences in the gene family;\n'
+	s += '\t\t\t\t(or path to a family sequence store of such lists, indexed by gene family id)\n'
 	s += '\t\t\t\teach file must be formated as a tab delimited table with two columns, indicating reference and redundant sequences, respectively.\n'
 	s += '\t\t\t\tIf the redundant sequences are present in the input gene tree, they will be removed before processsing.\n'
 	s += '\t\t\t\tIn any case, the reference:(redundant1, redundant2, ...) sequence name map is later integrated with the map of clades to collapse.\n'
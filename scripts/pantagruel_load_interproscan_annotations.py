@@ -1,6 +1,8 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-import glob, os, sys, getopt
+import glob, os, sys, getopt, time, itertools
+import multiprocessing as mp
+from StringIO import StringIO
 from ptg_utils import get_dbconnection
 
 # input is expected from a TSV table file generated by interproscan program
@@ -24,18 +26,164 @@ from ptg_utils import get_dbconnection
 # these fileds will however be despatched between several tables in the SQL database, to avoid redundancy:
 # 'protein_infos', 'functional_annotations', 'interpro_terms', 'interpro2GO', 'interpro2pathways'.
 
+indexscript = """CREATE INDEX IF NOT EXISTS funcannot_nrproteinid_idx ON functional_annotations (nr_protein_id);
+				 CREATE INDEX IF NOT EXISTS funcannot_analmeth_idx ON functional_annotations (analysis_method);
+				 CREATE INDEX IF NOT EXISTS funcannot_sigacc_idx ON functional_annotations (signature_accession);
+				 CREATE INDEX IF NOT EXISTS funcannot_method_signacc_idx ON functional_annotations (analysis_method, signature_accession);
+				 CREATE UNIQUE INDEX IF NOT EXISTS funcannot_nrproteinid_method_signacc_location_ipversion_uniq ON functional_annotations
+				  (nr_protein_id, analysis_method, signature_accession, start_location, stop_location, interproscan_version);
+				 CREATE INDEX IF NOT EXISTS funcannot_score_idx ON functional_annotations (score_or_evalue);
+				 CREATE INDEX IF NOT EXISTS funcannot_interproid_idx ON functional_annotations (interpro_id);
+				 CREATE UNIQUE INDEX IF NOT EXISTS ipterms_interproid_uniq ON interpro_terms (interpro_id);
+				 CREATE UNIQUE INDEX IF NOT EXISTS ip2go_interproid_goid_uniq ON interpro2GO (interpro_id, go_id);
+				 CREATE INDEX IF NOT EXISTS ip2go_interproid_idx ON interpro2GO (interpro_id);
+				 CREATE INDEX IF NOT EXISTS ip2go_goid_idx ON interpro2GO (go_id);
+				 CREATE UNIQUE INDEX IF NOT EXISTS ip2pw_interproid_pwdb_pwid_uniq ON interpro2pathways (interpro_id, pathway_db, pathway_id);
+				 CREATE INDEX IF NOT EXISTS ip2pw_pwdb_pwid_idx ON interpro2pathways (pathway_db, pathway_id);
+				 CREATE INDEX IF NOT EXISTS ip2pw_interproid_idx ON interpro2pathways (interpro_id);
+				 CREATE INDEX IF NOT EXISTS ip2pw_pwdb_idx ON interpro2pathways (pathway_db);
+				 CREATE INDEX IF NOT EXISTS ip2pw_pwid_idx ON interpro2pathways (pathway_id);"""
 
+pgonelinerscript = """
+				 DROP TABLE IF EXISTS prot2goterms_oneliner;
 
-def main(dbname, dbengine, interproscanresglobpat, interproscanversion, verbose=False):
-	dbcon, dbcur, dbtype, valtoken = get_dbconnection(dbname, dbengine)
+				 CREATE TABLE prot2goterms_oneliner AS
+				 SELECT nr_protein_id, string_agg(go_id, '|') AS go_terms
+				 FROM (SELECT DISTINCT nr_protein_id, go_id
+				  FROM functional_annotations
+				  INNER JOIN interpro2GO USING (interpro_id)
+				 ) AS dog
+				 GROUP BY nr_protein_id;
 
-	lnfinterproscan = glob.glob(interproscanresglobpat)
-	tipv = (interproscanversion,)
+				 DROP TABLE IF EXISTS prot2pathways_oneliner;
+
+				 CREATE TABLE prot2pathways_oneliner AS
+				 SELECT nr_protein_id, string_agg(pathway_db_id, '|') AS pathways
+				 FROM (SELECT DISTINCT nr_protein_id, concat_ws(':', pathway_db, pathway_id) AS pathway_db_id
+				  FROM functional_annotations
+				  INNER JOIN interpro2pathways USING (interpro_id)
+				 ) AS dpw
+				 GROUP BY nr_protein_id;"""
+
+# columns of the staging tables, in the order of the rows generated by parseInterProScanFile();
+# protein and annotation rows are tagged with the index of their source file, so that a protein annotated in several proteomes is loaded only once;
+# InterPro cross-references to GO terms and pathways are not staged but derived from the new InterPro terms, as they would be repeated in every proteome
+stagedcolumns = [('protein_infos', ('nr_protein_id', 'sequence_md5_digest', 'sequence_length'), True), \
+                 ('functional_annotations', ('nr_protein_id', 'analysis_method', 'signature_accession', 'signature_description', \
+                                             'start_location', 'stop_location', 'score_or_evalue', 'analysis_status', 'analysis_date', \
+                                             'interpro_id'), True), \
+                 ('interpro_terms', ('interpro_id', 'interpro_description', 'go_terms', 'pathways'), False)]
+
+def createIndexes(dbcur, dbengine):
 	if dbengine=='sqlite':
-		dbcon.text_factory = str
-		dbcur = dbcon.cursor()
-	#~ elif dbengine=='postgres':
-		#~ from psycopg2.extras import execute_batch
+		dbcur.executescript(indexscript)
+		print "created indexes as follows: %s"%(indexscript.replace('\t\t\t\t ', ''))
+	elif dbengine=='postgres':
+		dbcur.execute(indexscript+pgonelinerscript)
+		print "created indexes as follows: %s"%((indexscript+pgonelinerscript).replace('\t\t\t\t ', ''))
+
+def parseInterProScanFile(tfileidnf):
+	"""parse the InterProScan TSV output of one proteome into row lists for each of the staging tables
+
+	takes a tuple (file index, file path) as input, so to be used with Pool.imap_unordered();
+	rows are not filtered against what is already loaded in the database, this is left to loadStagedAnnotations().
+	"""
+	fileid, nfinterproscan = tfileidnf
+	dparsed = dict((table, []) for table, cols, tagged in stagedcolumns)
+	dparsed['file'] = nfinterproscan
+	sipacc = set([])
+	currprotid = None
+	nlines = 0
+	with open(nfinterproscan, 'r') as finterproscan:
+		for line in finterproscan:
+			nlines += 1
+			tsp = tuple(line.rstrip('\n').split('\t'))
+			protid = tsp[0]
+			if protid != currprotid:
+				# assume that all entries for a protein are grouped in one proteome annotation file
+				currprotid = protid
+				dparsed['protein_infos'].append(tsp[:3]+(fileid,))
+			if len(tsp)<12:
+				dparsed['functional_annotations'].append(tsp[:1]+tsp[3:11]+(None, fileid))
+				continue
+			ipid = tsp[11]
+			dparsed['functional_annotations'].append(tsp[:1]+tsp[3:11]+(ipid, fileid))
+			if ipid in sipacc: continue
+			sipacc.add(ipid)
+			ip2go = tsp[13] if len(tsp)>13 else ''
+			ip2pw = tsp[14] if len(tsp)>14 else ''
+			dparsed['interpro_terms'].append(tsp[11:13]+((ip2go or None), (ip2pw or None)))
+	dparsed['lines'] = nlines
+	return dparsed
+
+def _pgCopyText(rows):
+	"""serialise rows in the text format of PostgreSQL COPY"""
+	buf = StringIO()
+	for row in rows:
+		buf.write('\t'.join([('\\N' if v is None else str(v).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')) for v in row])+'\n')
+	buf.seek(0)
+	return buf
+
+def stageRows(dbcur, dbengine, table, ncols, rows):
+	"""bulk-insert rows into a staging table: with executemany() into SQLite, with COPY into PostgreSQL"""
+	if dbengine=='postgres':
+		dbcur.copy_expert("COPY ipscan_stage_%s FROM STDIN;"%table, _pgCopyText(rows))
+	else:
+		dbcur.executemany("INSERT INTO ipscan_stage_%s VALUES (%s);"%(table, ','.join(['?']*ncols)), rows)
+
+def createStagingTables(dbcur):
+	"""create index-less temporary tables mirroring the target tables, with an extra source file index column where relevant"""
+	for table, cols, tagged in stagedcolumns:
+		dbcur.execute("DROP TABLE IF EXISTS ipscan_stage_%s;"%table)
+		dbcur.execute("CREATE TEMP TABLE ipscan_stage_%s AS SELECT %s%s FROM %s LIMIT 0;"%(table, ', '.join(cols), (', 0 AS file_id' if tagged else ''), table))
+
+def loadStagedAnnotations(dbcur, valtoken, interproscanversion):
+	"""transfer the content of the staging tables into the target tables with set-based, deduplicating INSERT ... SELECT statements
+
+	proteins already annotated with this version of InterProScan and InterPro terms already recorded are skipped;
+	a protein found in several files is loaded from the first file (by index) where it was found.
+	"""
+	facols = ', '.join(stagedcolumns[1][1])
+	lsqlstmt = [("""CREATE TEMP TABLE ipscan_stage_protein_sources AS
+	                SELECT nr_protein_id, MIN(file_id) AS file_id FROM ipscan_stage_protein_infos GROUP BY nr_protein_id;""", ()), \
+	            ("CREATE INDEX ipscan_stage_protsrc_idx ON ipscan_stage_protein_sources (nr_protein_id, file_id);", ()), \
+	            ("""INSERT INTO protein_infos (nr_protein_id, sequence_md5_digest, sequence_length)
+	                SELECT DISTINCT nr_protein_id, sequence_md5_digest, sequence_length
+	                FROM ipscan_stage_protein_infos INNER JOIN ipscan_stage_protein_sources USING (nr_protein_id, file_id)
+	                WHERE nr_protein_id NOT IN (SELECT nr_protein_id FROM protein_infos);""", ()), \
+	            # annotation rows are unique within a file, so that selecting them from a single source file per protein is enough to avoid duplicates
+	            ("""INSERT INTO functional_annotations (%s, interproscan_version)
+	                SELECT %s, %s
+	                FROM ipscan_stage_functional_annotations INNER JOIN ipscan_stage_protein_sources USING (nr_protein_id, file_id)
+	                WHERE nr_protein_id NOT IN (SELECT nr_protein_id FROM functional_annotations WHERE interproscan_version=%s);"""%(facols, facols, valtoken, valtoken), \
+	             (interproscanversion, interproscanversion)), \
+	            ("CREATE INDEX ipscan_stage_ipterms_idx ON ipscan_stage_interpro_terms (interpro_id);", ())]
+	for sqlstmt, tval in lsqlstmt:
+		dbcur.execute(sqlstmt, tval)
+		if sqlstmt.startswith('INSERT'):
+			print "inserted %d rows into table %s"%(dbcur.rowcount, sqlstmt.split()[2])
+	# new InterPro terms are few (bounded by the size of the InterPro database), so their cross-references are split from here
+	dbcur.execute("""SELECT interpro_id, MIN(interpro_description), MIN(go_terms), MIN(pathways) FROM ipscan_stage_interpro_terms
+	                 WHERE interpro_id NOT IN (SELECT interpro_id FROM interpro_terms)
+	                 GROUP BY interpro_id;""")
+	ltipacc = dbcur.fetchall()
+	ltip2go = []
+	ltip2pw = []
+	for ipid, ipdesc, ip2go, ip2pw in ltipacc:
+		if ip2go:
+			ltip2go += [(ipid, goid) for goid in ip2go.split('|')]
+		if ip2pw:
+			ltip2pw += [(ipid,)+tuple(pwdbid.split(': ')) for pwdbid in ip2pw.split('|')]
+	dbcur.executemany("INSERT INTO interpro_terms (interpro_id, interpro_description, go_terms, pathways) VALUES (%s);"%','.join([valtoken]*4), ltipacc)
+	dbcur.executemany("INSERT INTO interpro2GO (interpro_id, go_id) VALUES (%s);"%','.join([valtoken]*2), ltip2go)
+	dbcur.executemany("INSERT INTO interpro2pathways (interpro_id, pathway_db, pathway_id) VALUES (%s);"%','.join([valtoken]*3), ltip2pw)
+	print "inserted values into tables: interpro_terms, % 5d; interpro2GO, % 5d; interpro2pathway, % 5d."%(len(ltipacc), len(ltip2go), len(ltip2pw))
+	for table, cols, tagged in stagedcolumns+[('protein_sources', (), False)]:
+		dbcur.execute("DROP TABLE ipscan_stage_%s;"%table)
+
+def loadInterProScanAnnotationsSerial(dbcur, valtoken, lnfinterproscan, interproscanversion):
+	"""parse InterProScan output files one after the other, inserting new rows into the target tables after each file"""
+	tipv = (interproscanversion,)
 	# keep track of recorded proteins that may be redundant across the several annotation files (each of which corresponds ot a single proteome)
 	srecprot = set([])
 	srecip = set([])
@@ -117,55 +265,53 @@ def main(dbname, dbengine, interproscanresglobpat, interproscanversion, verbose=
 			
 			print "inserted values into tables: protein_infos, % 5d; functional_annotations, % 5d; interpro_terms, % 5d; interpro2GO, % 5d; interpro2pathway, % 5d."%(len(ltproti), len(ltannot), len(ltipacc), len(ltip2go), len(ltip2pw))
 
+def loadInterProScanAnnotationsStaged(dbcur, dbengine, valtoken, lnfinterproscan, interproscanversion, nbprocesses=1, verbose=False):
+	"""parse InterProScan output files in a pool of processes and bulk-insert the rows into staging tables from this (single writer) process,
+
+	before transfering them to the target tables with loadStagedAnnotations().
+	"""
+	createStagingTables(dbcur)
+	if nbprocesses > 1:
+		pool = mp.Pool(processes=nbprocesses)
+		iterparsed = pool.imap_unordered(parseInterProScanFile, enumerate(lnfinterproscan))
+	else:
+		pool = None
+		iterparsed = itertools.imap(parseInterProScanFile, enumerate(lnfinterproscan))
+	nfiles = len(lnfinterproscan)
+	reportevery = 1 if verbose else max(1, nfiles/20)
+	nlines = nrows = 0
+	t0 = time.time()
+	for k, dparsed in enumerate(iterparsed):
+		for table, cols, tagged in stagedcolumns:
+			stageRows(dbcur, dbengine, table, len(cols)+int(tagged), dparsed[table])
+			nrows += len(dparsed[table])
+		nlines += dparsed['lines']
+		if ((k+1) % reportevery == 0) or (k+1 == nfiles):
+			dt = time.time() - t0
+			print "staged %d/%d files (last: %s); %d lines parsed into %d rows in %.1f s (%.0f lines/s)"%(k+1, nfiles, dparsed['file'], nlines, nrows, dt, nlines/max(dt, 1e-6))
+	if pool:
+		pool.close()
+		pool.join()
+	t1 = time.time()
+	loadStagedAnnotations(dbcur, valtoken, interproscanversion)
+	print "transfered staged rows to target tables in %.1f s"%(time.time() - t1)
+
+def main(dbname, dbengine, interproscanresglobpat, interproscanversion, staged=False, nbprocesses=1, verbose=False):
+	dbcon, dbcur, dbtype, valtoken = get_dbconnection(dbname, dbengine)
+
+	lnfinterproscan = glob.glob(interproscanresglobpat)
 	if dbengine=='sqlite':
-		print "%s database total changes:"%dbname, dbcon.total_changes
+		dbcon.text_factory = str
+		dbcur = dbcon.cursor()
+	if staged or nbprocesses > 1:
+		loadInterProScanAnnotationsStaged(dbcur, dbengine, valtoken, lnfinterproscan, interproscanversion, nbprocesses, verbose)
+	else:
+		loadInterProScanAnnotationsSerial(dbcur, valtoken, lnfinterproscan, interproscanversion)
 
-	indexscript = """CREATE INDEX IF NOT EXISTS funcannot_nrproteinid_idx ON functional_annotations (nr_protein_id);
-					 CREATE INDEX IF NOT EXISTS funcannot_analmeth_idx ON functional_annotations (analysis_method);
-					 CREATE INDEX IF NOT EXISTS funcannot_sigacc_idx ON functional_annotations (signature_accession);
-					 CREATE INDEX IF NOT EXISTS funcannot_method_signacc_idx ON functional_annotations (analysis_method, signature_accession);
-					 CREATE UNIQUE INDEX IF NOT EXISTS funcannot_nrproteinid_method_signacc_location_ipversion_uniq ON functional_annotations
-					  (nr_protein_id, analysis_method, signature_accession, start_location, stop_location, interproscan_version);
-					 CREATE INDEX IF NOT EXISTS funcannot_score_idx ON functional_annotations (score_or_evalue);
-					 CREATE INDEX IF NOT EXISTS funcannot_interproid_idx ON functional_annotations (interpro_id);
-					 CREATE UNIQUE INDEX IF NOT EXISTS ipterms_interproid_uniq ON interpro_terms (interpro_id);
-					 CREATE UNIQUE INDEX IF NOT EXISTS ip2go_interproid_goid_uniq ON interpro2GO (interpro_id, go_id);
-					 CREATE INDEX IF NOT EXISTS ip2go_interproid_idx ON interpro2GO (interpro_id);
-					 CREATE INDEX IF NOT EXISTS ip2go_goid_idx ON interpro2GO (go_id);
-					 CREATE UNIQUE INDEX IF NOT EXISTS ip2pw_interproid_pwdb_pwid_uniq ON interpro2pathways (interpro_id, pathway_db, pathway_id);
-					 CREATE INDEX IF NOT EXISTS ip2pw_pwdb_pwid_idx ON interpro2pathways (pathway_db, pathway_id);
-					 CREATE INDEX IF NOT EXISTS ip2pw_interproid_idx ON interpro2pathways (interpro_id);
-					 CREATE INDEX IF NOT EXISTS ip2pw_pwdb_idx ON interpro2pathways (pathway_db);
-					 CREATE INDEX IF NOT EXISTS ip2pw_pwid_idx ON interpro2pathways (pathway_id);"""
-					 
-					 
 	if dbengine=='sqlite':
-		dbcur.executescript(indexscript)
-	elif dbengine=='postgres':
-		indexscript += """
-	                 DROP TABLE IF EXISTS prot2goterms_oneliner;
-	                 
-					 CREATE TABLE prot2goterms_oneliner AS
-					 SELECT nr_protein_id, string_agg(go_id, '|') AS go_terms
-					 FROM (SELECT DISTINCT nr_protein_id, go_id
-					  FROM functional_annotations
-					  INNER JOIN interpro2GO USING (interpro_id)
-					 ) AS dog
-					 GROUP BY nr_protein_id;
-					 
-	                 DROP TABLE IF EXISTS prot2pathways_oneliner;
-	                 
-					 CREATE TABLE prot2pathways_oneliner AS
-					 SELECT nr_protein_id, string_agg(pathway_db_id, '|') AS pathways
-					 FROM (SELECT DISTINCT nr_protein_id, concat_ws(':', pathway_db, pathway_id) AS pathway_db_id
-					  FROM functional_annotations
-					  INNER JOIN interpro2pathways USING (interpro_id)
-					 ) AS dpw
-					 GROUP BY nr_protein_id;"""
-		for sqlline in indexscript.split('\n'):
-			dbcur.execute(sqlline)
-
-	print "created indexes as follows: %s"%(indexscript.replace('                 ', ''))
+		print "%s database total changes:"%dbname, dbcon.total_changes
+
+	createIndexes(dbcur, dbengine)
 
 	dbcon.commit()
 	dbcon.close()
@@ -174,12 +320,17 @@ def main(dbname, dbengine, interproscanresglobpat, interproscanversion, verbose=
 def usage():
 	s = "Usage:\n"
 	s += "python %s {--postgresql_db dbname | --sqlite_db dbfile} --ipscan_annot_files inputfile_pathorglobpattern --ipscan_version X.XX-XX.X [OTHER OPTIONS]\n"%sys.argv[0]
+	s += "Options:\n"
+	s += "\t\t--staged\tparse all files before loading their content into the database through (index-less) staging tables,\n"
+	s += "\t\t\t\tfrom where new rows are transfered to the target tables with set-based INSERT ... SELECT DISTINCT statements.\n"
+	s += "\t\t--processes\tnumber of processes parsing the InterProScan output files in parallel (default: 1); implies --staged.\n"
+	s += "\t\t-v|--verbose\treport progress after every parsed file.\n"
 	return s
 
 if __name__=='__main__':
 
 	opts, args = getopt.getopt(sys.argv[1:], 'hv', ['postgresql_db=', 'sqlite_db=', 'ipscan_annot_files=', \
-	                                                'ipscan_version=', 'help', 'verbose'])
+	                                                'ipscan_version=', 'staged', 'processes=', 'help', 'verbose'])
 	dopt = dict(opts)
 	
 	if ('-h' in dopt) or ('--help' in dopt):
@@ -197,6 +348,8 @@ if __name__=='__main__':
 
 	interproscanversion = dopt['--ipscan_version']
 	
+	staged = ('--staged' in dopt)
+	nbprocesses = int(dopt.get('--processes', 1))
 	verbose = (('-v' in dopt) or ('--verbose' in dopt))
 
-	main(dbname, dbengine, interproscanresglobpat, interproscanversion, verbose)
+	main(dbname, dbengine, interproscanresglobpat, interproscanversion, staged=staged, nbprocesses=nbprocesses, verbose=verbose)
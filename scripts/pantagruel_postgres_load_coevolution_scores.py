@@ -3,6 +3,7 @@ import glob, os, sys
 import psycopg2
 
 fileprefix = 'matching_events.tab'
+binfilename = 'matching_events.bin'
 
 sqldbname = sys.argv[1]
 dirscores = sys.argv[2]
@@ -11,12 +12,21 @@ reccolid = int(sys.argv[3])
 dbcon = psycopg2.connect("dbname=%s"%sqldbname)
 dbcur = dbcon.cursor()
 dbcur.execute("DELETE FROM phylogeny.coevolution_scores WHERE reconciliation_id=%s;", (reccolid,))
-nfscorepat = os.path.join(dirscores, fileprefix+'*')
-lnfscore = glob.glob(nfscorepat)
-for nfscore in lnfscore:
-  print nfscore
-  with open(nfscore, 'r') as fscore:
-	dbcur.copy_from(file=fscore, table='phylogeny.coevolution_scores', sep='\t', size=65536, columns=('rlocds_id_1', 'rlocds_id_2', 'coev_score'))
+nfscorebin = os.path.join(dirscores, binfilename)
+if os.path.exists(nfscorebin):
+  # compact columnar binary score file: stream its blocks in PostgreSQL binary COPY format
+  import coevolution_scores_io
+  print nfscorebin
+  pgstream = coevolution_scores_io.PGCopyBinaryStream(coevolution_scores_io.iter_coevol_score_blocks(nfscorebin))
+  dbcur.copy_expert("COPY phylogeny.coevolution_scores (rlocds_id_1, rlocds_id_2, coev_score) FROM STDIN WITH BINARY", pgstream, size=65536)
+  nfscorepat = nfscorebin
+else:
+  nfscorepat = os.path.join(dirscores, fileprefix+'*')
+  lnfscore = glob.glob(nfscorepat)
+  for nfscore in lnfscore:
+    print nfscore
+    with open(nfscore, 'r') as fscore:
+      dbcur.copy_from(file=fscore, table='phylogeny.coevolution_scores', sep='\t', size=65536, columns=('rlocds_id_1', 'rlocds_id_2', 'coev_score'))
 
 dbcon.commit()
 print "COMMITED COPY phylogeny.coevolution_scores FROM %s"%nfscorepat
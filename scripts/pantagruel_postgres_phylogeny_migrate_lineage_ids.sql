@@ -0,0 +1,75 @@
+-- convert an existing PostgreSQL database where phylogeny.gene_lineage_events is keyed by gene lineage labels (replacement_label_or_cds_code)
+-- to integer lineage ids (rlocds_id), as done for SQLite databases by 'pantagruel_sqlitedb_load_gene_lineage_events.py --migrate'
+-- usage: psql -d dbname -f pantagruel_postgres_phylogeny_migrate_lineage_ids.sql
+--
+-- existing lineage ids in phylogeny.replacement_label_or_cds_code2gene_families are preserved (co-evolution scores refer to them);
+-- if it is a view or a table without ids (former schema), it is replaced by a table where lineages found in gene_lineage_events
+-- are given ids in label order. the script does nothing if gene_lineage_events already has a rlocds_id column.
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+DO $$
+DECLARE
+  lineagetabletype TEXT;
+BEGIN
+  IF EXISTS (SELECT 1 FROM information_schema.columns
+              WHERE table_schema='phylogeny' AND table_name='gene_lineage_events' AND column_name='rlocds_id') THEN
+    RAISE NOTICE 'phylogeny.gene_lineage_events is already keyed by rlocds_id';
+    RETURN;
+  END IF;
+
+  -- gene family of lineages recorded in a former lineage table or view without ids
+  CREATE TEMP TABLE former_lineage2fam (replacement_label_or_cds_code VARCHAR(60), gene_family_id VARCHAR(20)) ON COMMIT DROP;
+  SELECT table_type INTO lineagetabletype FROM information_schema.tables
+   WHERE table_schema='phylogeny' AND table_name='replacement_label_or_cds_code2gene_families';
+  IF lineagetabletype IS NOT NULL AND NOT EXISTS (SELECT 1 FROM information_schema.columns
+              WHERE table_schema='phylogeny' AND table_name='replacement_label_or_cds_code2gene_families' AND column_name='rlocds_id') THEN
+    INSERT INTO former_lineage2fam
+     SELECT replacement_label_or_cds_code, MIN(gene_family_id) FROM phylogeny.replacement_label_or_cds_code2gene_families
+     GROUP BY replacement_label_or_cds_code;
+    IF lineagetabletype='VIEW' THEN
+      DROP VIEW phylogeny.replacement_label_or_cds_code2gene_families;
+    ELSE
+      DROP TABLE phylogeny.replacement_label_or_cds_code2gene_families;
+    END IF;
+  END IF;
+
+  CREATE TABLE IF NOT EXISTS phylogeny.replacement_label_or_cds_code2gene_families (
+    replacement_label_or_cds_code VARCHAR(60) NOT NULL, -- refers to genome.coding_sequences (cds_code) and phylogeny.replaced_gene_tree_clades (replacement_label)
+    gene_family_id VARCHAR(20) NOT NULL,
+    rlocds_id INT PRIMARY KEY -- dense integer gene lineage id
+  );
+
+  -- record lineages not yet in the lineage table (all of them if it was replaced), with ids following the highest recorded one
+  INSERT INTO phylogeny.replacement_label_or_cds_code2gene_families (replacement_label_or_cds_code, gene_family_id, rlocds_id)
+   SELECT q.replacement_label_or_cds_code, COALESCE(f.gene_family_id, ''),
+          (SELECT COALESCE(MAX(rlocds_id), 0) FROM phylogeny.replacement_label_or_cds_code2gene_families)
+           + row_number() OVER (ORDER BY q.replacement_label_or_cds_code)
+   FROM (SELECT DISTINCT replacement_label_or_cds_code FROM phylogeny.gene_lineage_events) q
+   LEFT JOIN former_lineage2fam f USING (replacement_label_or_cds_code)
+   WHERE NOT EXISTS (SELECT 1 FROM phylogeny.replacement_label_or_cds_code2gene_families r
+                      WHERE r.replacement_label_or_cds_code=q.replacement_label_or_cds_code);
+
+  -- key the events on lineage ids; indexes and keys involving the label column are dropped with it
+  ALTER TABLE phylogeny.gene_lineage_events ADD COLUMN rlocds_id INT;
+  UPDATE phylogeny.gene_lineage_events e SET rlocds_id=r.rlocds_id
+   FROM phylogeny.replacement_label_or_cds_code2gene_families r
+   WHERE r.replacement_label_or_cds_code=e.replacement_label_or_cds_code;
+  ALTER TABLE phylogeny.gene_lineage_events ALTER COLUMN rlocds_id SET NOT NULL;
+  ALTER TABLE phylogeny.gene_lineage_events DROP COLUMN replacement_label_or_cds_code;
+
+  CREATE INDEX IF NOT EXISTS gene_lineage_events_rlocds_evt_idx ON phylogeny.gene_lineage_events (rlocds_id, event_id);
+  CREATE INDEX IF NOT EXISTS gene_lineage_events_evt_idx ON phylogeny.gene_lineage_events (event_id);
+  CREATE UNIQUE INDEX IF NOT EXISTS rlocds2genefam_rlocds_idx ON phylogeny.replacement_label_or_cds_code2gene_families (replacement_label_or_cds_code);
+  CREATE INDEX IF NOT EXISTS rlocds2genefam_genefam_idx ON phylogeny.replacement_label_or_cds_code2gene_families (gene_family_id);
+  RAISE NOTICE 'migrated phylogeny.gene_lineage_events to integer lineage ids';
+END
+$$;
+
+COMMIT;
+
+-- reclaim the space of the rows rewritten by the update
+VACUUM ANALYZE phylogeny.gene_lineage_events;
+VACUUM ANALYZE phylogeny.replacement_label_or_cds_code2gene_families;
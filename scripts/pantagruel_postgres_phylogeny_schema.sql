@@ -26,11 +26,17 @@ CREATE INDEX ON species_tree_events (rec_branch_id);
 
 CREATE TABLE phylogeny.gene_lineage_events ( --to be a large table
   event_id INT,
-  replacement_label_or_cds_code VARCHAR(50) NOT NULL, -- refers to genome.coding_sequences (cds_code) and phylogeny.replaced_gene_tree_clades (replacement_label)
+  rlocds_id INT NOT NULL, -- refers to phylogeny.replacement_label_or_cds_code2gene_families (rlocds_id)
   freq INT NOT NULL,
   reconciliation_id SMALLINT DEFAULT NULL    -- to distinguish reconciliation sets; can be NULL if not to be redundant
 );
 
+CREATE TABLE phylogeny.replacement_label_or_cds_code2gene_families (
+  replacement_label_or_cds_code VARCHAR(60) NOT NULL, -- refers to genome.coding_sequences (cds_code) and phylogeny.replaced_gene_tree_clades (replacement_label)
+  gene_family_id VARCHAR(20) NOT NULL,
+  rlocds_id INT PRIMARY KEY -- dense integer gene lineage id
+);
+
 CREATE TABLE phylogeny.reconciliation_collections (
   reconciliation_id SMALLINT NOT NULL,
   reconciliation_name VARCHAR NOT NULL,
@@ -74,10 +80,10 @@ CREATE TABLE phylogeny.replaced_gene_tree_clades (
 -- after filling the tables
 
 -- ~ CREATE INDEX ON gene_lineage_events (reconciliation_id);
--- ~ CREATE INDEX ON gene_lineage_events (cds_code);
+-- ~ CREATE INDEX ON gene_lineage_events (rlocds_id, event_id);
 -- ~ CREATE INDEX ON gene_lineage_events (event_id);
 -- ~ CREATE INDEX ON gene_lineage_events (freq);
--- ~ ALTER TABLE gene_lineage_events ADD PRIMARY KEY (event_id, cds_code, reconciliation_id);
+-- ~ ALTER TABLE gene_lineage_events ADD PRIMARY KEY (event_id, rlocds_id, reconciliation_id);
 
 -- ~ CREATE INDEX ON collapsed_gene_tree_clades (gene_family_id);
 -- ~ CREATE INDEX ON collapsed_gene_tree_clades (cds_code);
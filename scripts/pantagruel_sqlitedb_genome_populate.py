@@ -1,6 +1,6 @@
 #!/usr/bin/python
 import re
-import os, sys
+import os, sys, time, gzip
 import sqlite3
 
 CODepat = re.compile("([A-Z0-9]{3,5}) +[ABEVO] +([0-9]{1,7}): ")
@@ -14,16 +14,31 @@ def getTableInfos(table, cursor, ommitserial=False):
 		 colinfos = [colinfo for colinfo in colinfos if colinfo['type'].upper()!='SERIAL']
 	return colinfos 
 
-def replaceValuesAsNull(table, cursor, nullval='', ommitcols=[], tableinfo=None):
-	if not tableinfo: colinfos = getTableInfos(table, cursor)
-	else: colinfos = tableinfo
-	for colinfo in colinfos:
-		colname = colinfo['name']
-		if (colname not in ommitcols):
-			cursor.execute("UPDATE %s SET %s=NULL WHERE %s='%s';"%(table, colname, colname, nullval))
+def replaceValuesAsNull(table, cursor, nullval='', ommitcols=[], tableinfo=None, columns=None):
+	"""replace 'nullval' values with NULL in all (or the specified) columns of the table, with a single multi-column UPDATE"""
+	if columns is None:
+		if not tableinfo: colinfos = getTableInfos(table, cursor)
+		else: colinfos = tableinfo
+		columns = [colinfo['name'] for colinfo in colinfos]
+	updcols = [colname for colname in columns if (colname not in ommitcols)]
+	if not updcols: return
+	setclause = ', '.join(["%s=(CASE WHEN %s=? THEN NULL ELSE %s END)"%(colname, colname, colname) for colname in updcols])
+	whereclause = ' OR '.join(["%s=?"%colname for colname in updcols])
+	cursor.execute("UPDATE %s SET %s WHERE %s;"%(table, setclause, whereclause), (nullval,)*(2*len(updcols)))
 
-def loadAndCurateTable(table, nfin, cursor, header=True, insertcolumns=(), sep='\t', doNotReplaceWithNull=[], **kw):
-	ftabin = open(nfin, 'r')
+def openTableFile(nfin):
+	"""open a (possibly gzip-compressed) table file; if 'nfin' does not exist, its gzipped version 'nfin.gz' is looked for"""
+	if not os.path.exists(nfin) and os.path.exists(nfin+'.gz'):
+		nfin = nfin+'.gz'
+	if nfin.endswith('.gz'):
+		return gzip.open(nfin, 'rb')
+	else:
+		return open(nfin, 'r')
+
+def loadAndCurateTable(table, nfin, cursor, header=True, insertcolumns=(), sep='\t', doNotReplaceWithNull=[], nullval=''):
+	"""load a tabular file into the table, replacing 'nullval' fields with NULL on the fly (except in the 'doNotReplaceWithNull' columns)"""
+	t0 = time.time()
+	ftabin = openTableFile(nfin)
 	colinfos = getTableInfos(table, cursor, ommitserial=True)
 	insertcols=[]
 	if header:
@@ -35,15 +50,31 @@ def loadAndCurateTable(table, nfin, cursor, header=True, insertcolumns=(), sep='
 		insertcols = [colinfo['name'] for colinfo in colinfos]
 	coldef = '('+', '.join(insertcols)+')'
 	print table, coldef
-	cursor.executemany("INSERT INTO %s %s VALUES (%s);"%(table, coldef, ','.join(['?']*len(insertcols))), (tuple(line.rstrip('\n').split(sep)) for line in ftabin))
-	replaceValuesAsNull(table, cursor, tableinfo=colinfos, ommitcols=doNotReplaceWithNull, **kw)
+	# column names are case-insensitive in SQL
+	keepcols = set([colname.lower() for colname in doNotReplaceWithNull])
+	nullidx = [i for i, colname in enumerate(insertcols) if (colname.lower() not in keepcols)]
+	def curatedRows():
+		for line in ftabin:
+			lsp = line.rstrip('\n').split(sep)
+			if nullval in lsp:
+				for i in nullidx:
+					if i < len(lsp) and lsp[i]==nullval: lsp[i] = None
+			yield lsp
+	cursor.executemany("INSERT INTO %s %s VALUES (%s);"%(table, coldef, ','.join(['?']*len(insertcols))), curatedRows())
+	nrows = cursor.rowcount
 	ftabin.close()
+	# table columns that were not loaded (and thus hold default values) are curated in the database
+	loadedcols = set([colname.lower() for colname in insertcols])
+	otherscols = [colinfo['name'] for colinfo in colinfos if (colinfo['name'].lower() not in loadedcols|keepcols)]
+	if otherscols:
+		replaceValuesAsNull(table, cursor, nullval=nullval, columns=otherscols)
+	print "loaded %d rows into table %s in %.2f s"%(nrows, table, time.time() - t0)
 	
 def createAndLoadTable(table, tabledef, nfin, cursor, temp=False, enddrop=False, **kw):
 	tmp = 'TEMP' if temp else ''
 	if tabledef.upper().startswith('LIKE ') and 'header' in kw:
-		with open(nfin, 'r') as ftabin:
-			insertcols = ftabin.readline().rstrip('\n').split(sep)
+		with openTableFile(nfin) as ftabin:
+			insertcols = ftabin.readline().rstrip('\n').split(kw.get('sep', '\t'))
 		reftable = tabledef.split('LIKE ', 1)[1]
 		refcolinfos = getTableInfos(reftable, cursor, ommitserial=True)
 		tdeflines = []
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+import glob, os, sys
+import sqlite3
+
+fileprefix = 'matching_events.tab'
+binfilename = 'matching_events.bin'
+
+nfsqldb = sys.argv[1]
+dirscores = sys.argv[2]
+reccolid = int(sys.argv[3])
+
+def iter_tab_scores(lnfscore):
+  for nfscore in lnfscore:
+    print nfscore
+    with open(nfscore, 'r') as fscore:
+      for line in fscore:
+        id1, id2, score = line.rstrip('\n').split('\t')
+        yield (int(id1), int(id2), float(score), reccolid)
+
+dbcon = sqlite3.connect(nfsqldb)
+dbcur = dbcon.cursor()
+dbcur.execute("DELETE FROM coevolution_scores WHERE reconciliation_id=?;", (reccolid,))
+nfscorebin = os.path.join(dirscores, binfilename)
+if os.path.exists(nfscorebin):
+  # compact columnar binary score file: insert rows straight from the decoded column arrays
+  import coevolution_scores_io
+  print nfscorebin
+  nfscorepat = nfscorebin
+  for id1, id2, score in coevolution_scores_io.iter_coevol_score_blocks(nfscorebin):
+    dbcur.executemany("INSERT INTO coevolution_scores (rlocds_id_1, rlocds_id_2, coev_score, reconciliation_id) VALUES (?,?,?,?);", \
+                      ((i1, i2, s, reccolid) for i1, i2, s in zip(id1.tolist(), id2.tolist(), score.tolist())))
+else:
+  nfscorepat = os.path.join(dirscores, fileprefix+'*')
+  dbcur.executemany("INSERT INTO coevolution_scores (rlocds_id_1, rlocds_id_2, coev_score, reconciliation_id) VALUES (?,?,?,?);", \
+                    iter_tab_scores(glob.glob(nfscorepat)))
+
+dbcon.commit()
+print "COMMITED INSERT INTO coevolution_scores FROM %s"%nfscorepat
+
+dbcur.execute("CREATE UNIQUE INDEX IF NOT EXISTS rlocds_id_pair_idx ON coevolution_scores (rlocds_id_1, rlocds_id_2, reconciliation_id);")
+dbcur.execute("CREATE INDEX IF NOT EXISTS coevscore_idx ON coevolution_scores (coev_score);")
+dbcur.execute("CREATE INDEX IF NOT EXISTS reccolid_idx ON coevolution_scores (reconciliation_id);")
+dbcon.commit()
+print "COMMITED CREATE INDEXES ON coevolution_scores"
+
+dbcon.close()
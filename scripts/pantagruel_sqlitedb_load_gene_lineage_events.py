@@ -0,0 +1,236 @@
+#!/usr/bin/python
+
+"""bulk loader of parsed reconciliation events into the SQLite database
+
+Streams all the gene lineage event tables written by parse_collapsedALE_scenarios.py (gene_tree_lineages/*.eventlineages files,
+with tab-delimited rows (replacement_label_or_cds_code, event_id, freq)) into table gene_lineage_events,
+in large batches within a single transaction and with SQLite pragmas tuned for bulk loading.
+Gene lineage labels are mapped on the fly to dense integer lineage ids (rlocds_id), recorded in the lineage dimension table
+replacement_label_or_cds_code2gene_families together with their gene family (as found in the event table file name);
+gene_lineage_events only stores the integer ids.
+Indexes are dropped before the load and created once at the end.
+
+Databases where gene_lineage_events is keyed by labels (replacement_label_or_cds_code) can be migrated with option --migrate.
+PostgreSQL databases can be migrated likewise with pantagruel_postgres_phylogeny_migrate_lineage_ids.sql.
+"""
+
+import os, sys, glob, getopt, time, gc
+import sqlite3
+
+lineagetable = 'replacement_label_or_cds_code2gene_families'
+
+# indexes (re-)built at the end of the load
+lineageeventindexes = [
+ "CREATE INDEX IF NOT EXISTS gene_lineage_events_rlocds_evt_idx ON gene_lineage_events (rlocds_id, event_id);",
+ "CREATE INDEX IF NOT EXISTS gene_lineage_events_evt_idx ON gene_lineage_events (event_id);",
+ "CREATE INDEX IF NOT EXISTS gene_lineage_events_reccol_idx ON gene_lineage_events (reconciliation_id);",
+]
+lineagetableindexes = [
+ "CREATE UNIQUE INDEX IF NOT EXISTS rlocds2genefam_rlocds_idx ON %s (replacement_label_or_cds_code);"%lineagetable,
+ "CREATE INDEX IF NOT EXISTS rlocds2genefam_genefam_idx ON %s (gene_family_id);"%lineagetable,
+]
+
+def set_bulk_load_pragmas(dbcur, cachesizemb=1024):
+	"""tune SQLite for a bulk load; returns the former pragma values, to be restored with restore_pragmas()"""
+	dpragmas = {}
+	for pragma in ('journal_mode', 'synchronous', 'cache_size'):
+		dbcur.execute("PRAGMA %s;"%pragma)
+		dpragmas[pragma] = dbcur.fetchone()[0]
+	# no rollback journal nor fsync during the load: a failed load must be restarted from scratch anyway
+	dbcur.execute("PRAGMA journal_mode=OFF;")
+	dbcur.execute("PRAGMA synchronous=OFF;")
+	# negative cache size is in KiB
+	dbcur.execute("PRAGMA cache_size=-%d;"%(cachesizemb*1024))
+	dbcur.execute("PRAGMA temp_store=MEMORY;")
+	return dpragmas
+
+def restore_pragmas(dbcur, dpragmas):
+	for pragma, val in dpragmas.iteritems():
+		dbcur.execute("PRAGMA %s=%s;"%(pragma, val))
+
+def ensure_lineage_table(dbcur):
+	"""create the gene lineage id table if missing, replacing the former view of the same name (in databases created with an older schema)"""
+	dbcur.execute("SELECT type FROM sqlite_master WHERE name=?;", (lineagetable,))
+	res = dbcur.fetchone()
+	if res and res[0]=='table': return
+	if res: dbcur.execute("DROP VIEW %s;"%lineagetable)
+	dbcur.execute("CREATE TABLE %s (replacement_label_or_cds_code VARCHAR(60) NOT NULL, gene_family_id VARCHAR(20) NOT NULL, rlocds_id INTEGER PRIMARY KEY);"%lineagetable)
+
+def load_lineage_ids(dbcur):
+	"""returns the dict {replacement_label_or_cds_code:rlocds_id} of already recorded gene lineages"""
+	dbcur.execute("SELECT replacement_label_or_cds_code, rlocds_id FROM %s;"%lineagetable)
+	return dict(dbcur.fetchall())
+
+def iter_lineage_event_batches(lnfevt, dlineageids, newlineages, batchsize=500000):
+	"""generates batches of rows [rlocds_id, event_id, freq] read from gene lineage event files, as lists of lists
+
+	rows of a file are never split across batches. Labels not yet in 'dlineageids' are given the next integer id, and appended to 
+	'newlineages' as (replacement_label_or_cds_code, gene_family_id, rlocds_id) tuples.
+	"""
+	nextid = max(dlineageids.itervalues()) + 1 if dlineageids else 1
+	batch = []
+	for nfevt in lnfevt:
+		fam = os.path.basename(nfevt).split('-')[0]
+		with open(nfevt, 'r') as fevt:
+			rows = [line.rstrip('\n').split('\t') for line in fevt]
+		# labels are checked once per file rather than once per row
+		for lab in sorted(set(row[0] for row in rows)):
+			if lab not in dlineageids:
+				dlineageids[lab] = nextid
+				newlineages.append((lab, fam, nextid))
+				nextid += 1
+		for row in rows:
+			row[0] = dlineageids[row[0]]
+		batch += rows
+		if len(batch) >= batchsize:
+			yield batch
+			batch = []
+	if batch: yield batch
+
+def load_gene_lineage_events(dbcon, dirgtevt, reccolid, batchsize=500000, cachesizemb=1024, createIndexes=True, verbose=True):
+	"""load all gene lineage event files from folder 'dirgtevt' into table gene_lineage_events; returns the number of rows loaded"""
+	t0 = time.time()
+	# databases with label-keyed gene lineage events are converted first
+	migrate_gene_lineage_events(dbcon, verbose=verbose)
+	# transactions are handled explicitly
+	dbcon.isolation_level = None
+	dbcur = dbcon.cursor()
+	dpragmas = set_bulk_load_pragmas(dbcur, cachesizemb)
+	lnfevt = sorted(glob.glob(os.path.join(dirgtevt, '*.eventlineages')))
+	if verbose: print "load gene lineage events from %d files in '%s'"%(len(lnfevt), dirgtevt)
+	# indexes are maintained at every insert: drop them during the load
+	for createidx in lineageeventindexes+lineagetableindexes:
+		dbcur.execute("DROP INDEX IF EXISTS %s;"%createidx.split(' ON ')[0].split()[-1])
+	dbcur.execute("BEGIN;")
+	ensure_lineage_table(dbcur)
+	dbcur.execute("DELETE FROM gene_lineage_events WHERE reconciliation_id=?;", (reccolid,))
+	dlineageids = load_lineage_ids(dbcur)
+	newlineages = []
+	# rows are bound as read from the files (strings), using numbered parameters; integer conversion is left to SQLite column type affinity
+	insertq = "INSERT INTO gene_lineage_events (event_id, rlocds_id, freq, reconciliation_id) VALUES (?2, ?1, ?3, %d);"%reccolid
+	nrows = 0
+	# batches hold many small lists that are never part of reference cycles: avoid repeated garbage collector passes over them
+	gcenabled = gc.isenabled()
+	gc.disable()
+	try:
+		for batch in iter_lineage_event_batches(lnfevt, dlineageids, newlineages, batchsize):
+			dbcur.executemany(insertq, batch)
+			dbcur.executemany("INSERT INTO %s (replacement_label_or_cds_code, gene_family_id, rlocds_id) VALUES (?,?,?);"%lineagetable, newlineages)
+			nrows += len(batch)
+			del newlineages[:]
+			if verbose:
+				print "%d rows loaded (%d rows/s)"%(nrows, nrows/max(time.time()-t0, 1e-3))
+				sys.stdout.flush()
+	finally:
+		if gcenabled: gc.enable()
+	dbcur.execute("COMMIT;")
+	tload = time.time() - t0
+	if verbose: print "COMMITED INSERT INTO gene_lineage_events: %d rows in %.1f s (%d rows/s); %d gene lineages"%(nrows, tload, nrows/max(tload, 1e-3), len(dlineageids))
+	if createIndexes:
+		t1 = time.time()
+		for createidx in lineageeventindexes+lineagetableindexes:
+			dbcur.execute(createidx)
+		dbcur.execute("ANALYZE;")
+		if verbose: print "COMMITED CREATE INDEXES ON gene_lineage_events in %.1f s"%(time.time()-t1)
+	restore_pragmas(dbcur, dpragmas)
+	return nrows
+
+def migrate_gene_lineage_events(dbcon, verbose=True):
+	"""convert a database where gene_lineage_events is keyed by gene lineage labels (replacement_label_or_cds_code) to integer rlocds_id keys
+
+	existing lineage ids in table replacement_label_or_cds_code2gene_families are preserved (co-evolution scores refer to them);
+	if it is a view (former schema), it is replaced by a table where lineages found in gene_lineage_events are given ids in label order.
+	"""
+	dbcon.isolation_level = None
+	dbcur = dbcon.cursor()
+	dbcur.execute("PRAGMA table_info(gene_lineage_events);")
+	levtcols = [col[1] for col in dbcur.fetchall()]
+	if 'rlocds_id' in levtcols: return
+	t0 = time.time()
+	dpragmas = set_bulk_load_pragmas(dbcur)
+	dbcur.execute("BEGIN;")
+	dbcur.execute("SELECT type FROM sqlite_master WHERE name=?;", (lineagetable,))
+	res = dbcur.fetchone()
+	if res and res[0]=='view':
+		dbcur.execute("CREATE TEMP TABLE former_lineage2fam AS SELECT replacement_label_or_cds_code, MIN(gene_family_id) AS gene_family_id FROM %s GROUP BY replacement_label_or_cds_code;"%lineagetable)
+		dbcur.execute("DROP VIEW %s;"%lineagetable)
+	ensure_lineage_table(dbcur)
+	# record lineages not yet in the lineage table (all of them if it was a view)
+	dbcur.execute("""INSERT INTO %s (replacement_label_or_cds_code, gene_family_id)
+	                 SELECT q.replacement_label_or_cds_code, %s FROM (SELECT DISTINCT replacement_label_or_cds_code FROM gene_lineage_events) q
+	                 %s
+	                 WHERE q.replacement_label_or_cds_code NOT IN (SELECT replacement_label_or_cds_code FROM %s)
+	                 ORDER BY q.replacement_label_or_cds_code;"""%(lineagetable, \
+	                 ("COALESCE(f.gene_family_id, '')" if res and res[0]=='view' else "''"), \
+	                 ("LEFT JOIN former_lineage2fam f USING (replacement_label_or_cds_code)" if res and res[0]=='view' else ''), lineagetable))
+	if verbose: print "recorded %d new gene lineages in %s"%(dbcur.rowcount, lineagetable)
+	dbcur.execute("ALTER TABLE gene_lineage_events RENAME TO gene_lineage_events_labelled;")
+	dbcur.execute("""CREATE TABLE gene_lineage_events (event_id INT NOT NULL, rlocds_id INT NOT NULL, freq INT NOT NULL,
+	                 reconciliation_id SMALLINT NOT NULL DEFAULT 0);""")
+	dbcur.execute("""INSERT INTO gene_lineage_events (event_id, rlocds_id, freq, reconciliation_id)
+	                 SELECT event_id, rlocds_id, freq, reconciliation_id FROM gene_lineage_events_labelled
+	                 INNER JOIN %s USING (replacement_label_or_cds_code);"""%lineagetable)
+	nrows = dbcur.rowcount
+	dbcur.execute("DROP TABLE gene_lineage_events_labelled;")
+	dbcur.execute("COMMIT;")
+	for createidx in lineageeventindexes+lineagetableindexes:
+		dbcur.execute(createidx)
+	dbcur.execute("ANALYZE;")
+	restore_pragmas(dbcur, dpragmas)
+	# reclaim the space of the former table
+	dbcur.execute("VACUUM;")
+	if verbose: print "migrated %d rows of gene_lineage_events to integer lineage ids in %.1f s"%(nrows, time.time()-t0)
+
+def load_species_tree_tables(dbcon, dirspet):
+	"""load the reference species tree branch and event tables written by parse_collapsedALE_scenarios.py"""
+	dbcon.isolation_level = None
+	dbcur = dbcon.cursor()
+	dbcur.execute("BEGIN;")
+	with open(os.path.join(dirspet, 'phylogeny_species_tree.tab'), 'r') as fspet:
+		dbcur.executemany("INSERT INTO species_tree (branch_id, parent_branch_id, branch_name, is_tip) VALUES (?,?,?,?);", \
+		                  ([(x if x else None) for x in line.rstrip('\n').split('\t')] for line in fspet))
+	with open(os.path.join(dirspet, 'phylogeny_species_tree_events.tab'), 'r') as fspetevt:
+		dbcur.executemany("INSERT INTO species_tree_events (event_id, event_type, don_branch_id, rec_branch_id) VALUES (?,?,?,?);", \
+		                  ([(x if x else None) for x in line.rstrip('\n').split('\t')] for line in fspetevt))
+	dbcur.execute("COMMIT;")
+	print "COMMITED INSERT INTO species_tree, species_tree_events FROM %s"%dirspet
+
+def usage():
+	s = "Usage: python %s --sqldb /path/to/database.sqlite --parsed_recs /path/to/parsed_recs_folder --reconciliation_id INT [OPTIONS]\n"%sys.argv[0]
+	s += "   or: python %s --sqldb /path/to/database.sqlite --migrate\n"%sys.argv[0]
+	s += "Options:\n"
+	s += "\t\t--migrate\tconvert table gene_lineage_events of an existing database from label keys (replacement_label_or_cds_code) to integer keys (rlocds_id)\n"
+	s += "\t\t--batch_size\tnumber of rows inserted at once (default: 500000)\n"
+	s += "\t\t--cache_size\tSQLite page cache size during the load, in MB (default: 1024)\n"
+	s += "\t\t--skip_species_tree\tdo not load reference species tree tables (from 'ref_species_tree/' subfolder)\n"
+	s += "\t\t--no_index\tdo not create indexes after the load\n"
+	return s
+
+def main():
+	opts, args = getopt.getopt(sys.argv[1:], 'h', ['sqldb=', 'parsed_recs=', 'reconciliation_id=', 'batch_size=', 'cache_size=', \
+	                                               'skip_species_tree', 'no_index', 'migrate', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt):
+		print usage()
+		sys.exit(0)
+	nfsqldb = dopt['--sqldb']
+	if '--migrate' in dopt:
+		dbcon = sqlite3.connect(nfsqldb)
+		migrate_gene_lineage_events(dbcon)
+		dbcon.close()
+		return
+	parsedrecs = dopt['--parsed_recs']
+	reccolid = int(dopt['--reconciliation_id'])
+	batchsize = int(dopt.get('--batch_size', 500000))
+	cachesizemb = int(dopt.get('--cache_size', 1024))
+
+	dbcon = sqlite3.connect(nfsqldb)
+	if not ('--skip_species_tree' in dopt):
+		load_species_tree_tables(dbcon, os.path.join(parsedrecs, 'ref_species_tree'))
+	load_gene_lineage_events(dbcon, os.path.join(parsedrecs, 'gene_tree_lineages'), reccolid, \
+	                         batchsize=batchsize, cachesizemb=cachesizemb, createIndexes=(not '--no_index' in dopt))
+	dbcon.close()
+
+if __name__=='__main__':
+
+	main()
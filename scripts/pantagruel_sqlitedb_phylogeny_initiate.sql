@@ -19,8 +19,8 @@ CREATE INDEX species_tree_events_don_br_idx ON species_tree_events (don_branch_i
 CREATE INDEX species_tree_events_rec_br_idx ON species_tree_events (rec_branch_id);
 
 CREATE TABLE gene_lineage_events ( --to be a large table
-  event_id SERIAL,
-  replacement_label_or_cds_code VARCHAR(60) NOT NULL,    -- refers to genome.coding_sequences (cds_code) and phylogeny.replaced_gene_tree_clades (replacement_label)
+  event_id INT NOT NULL,     -- refers to species_tree_events (event_id)
+  rlocds_id INT NOT NULL,    -- refers to replacement_label_or_cds_code2gene_families (rlocds_id)
   freq INT NOT NULL,
   reconciliation_id SMALLINT NOT NULL DEFAULT 0    -- to distinguish reconciliation sets; can be left to default if not to be redundant
 );
@@ -65,10 +65,11 @@ CREATE TABLE replaced_gene_tree_clades (
   replace_criterion_id SMALLINT DEFAULT NULL
 );
 
-CREATE VIEW replacement_label_or_cds_code2gene_families AS 
-SELECT cds_code as replacement_label_or_cds_code, gene_family_id FROM coding_sequences
-UNION
-SELECT replacement_label as replacement_label_or_cds_code, gene_family_id FROM replaced_gene_tree_clades;
+CREATE TABLE replacement_label_or_cds_code2gene_families ( -- populated by pantagruel_sqlitedb_load_gene_lineage_events.py
+  replacement_label_or_cds_code VARCHAR(60) NOT NULL,    -- refers to genome.coding_sequences (cds_code) and phylogeny.replaced_gene_tree_clades (replacement_label)
+  gene_family_id VARCHAR(20) NOT NULL,
+  rlocds_id INTEGER PRIMARY KEY    -- dense integer gene lineage id
+);
 
 
 CREATE TABLE ortholog_collections (
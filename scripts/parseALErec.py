@@ -3,6 +3,9 @@ import tree2
 import sys, os, getopt
 import re
 import copy
+import bisect
+from array import array
+from collections import Counter
 
 eventTypes = 'DTLSO'
 outtaxlab = '#OUTSIDE#'
@@ -12,13 +15,185 @@ def getOriSpeciesFromEventLab(eventlab, sgsep='_'):
 	elab = eventlab.split('@')[1] if '@' in eventlab else eventlab
 	return elab.split('->')[0].split(sgsep)[0]
 
-def parseALERecFile(nfrec, reftreelen=None, restrictclade=None, skipEventFreq=False, skipLines=False, nsample=[], returnDict=False):
+class RecSampleEventIndex(object):
+	"""index of the event labels found in a sample of reconciled gene trees, built in a single pass over the tree strings
+	
+	Event chains in node labels are split into tokens at periods; occurrences of all tokens are counted, 
+	as well as of those tokens in the syntactic positions of speciation events (preceded by '.', '(' or ',')
+	and of speciation-loss events (preceded by '.' itself not preceded by ')').
+	Counts returned for a label sum the occurrences of tokens starting with that label, reproducing
+	the semantics of exact string matching over the concatenated sample.
+	"""
+	newickdelimpat = re.compile('([(),;])')
+	
+	def __init__(self, recgtlines=[]):
+		self.counts = {'all':Counter(), 'S':Counter(), 'L':Counter()}
+		self._sorted = {}
+		for line in recgtlines:
+			self.add(line)
+	
+	def add(self, line):
+		"""count the event labels of one reconciled gene tree string; allows to build the index while streaming the sample"""
+		# split tree string into alternating node label (followed by branch length) and delimiter items
+		items = self.newickdelimpat.split(line)
+		for k in range(0, len(items), 2):
+			delim = items[k-1] if k>0 else ''
+			nodelab = items[k].split(':', 1)[0].strip()
+			if not nodelab: continue
+			lineage = nodelab.split('.')
+			for i, eventlab in enumerate(lineage):
+				if not eventlab: continue
+				self.counts['all'][eventlab] += 1
+				if i==0:
+					if delim in ('(', ','): self.counts['S'][eventlab] += 1
+				else:
+					self.counts['S'][eventlab] += 1
+					# character preceding the period
+					prevchar = lineage[i-1][-1:] if lineage[i-1] else (delim if i==1 else '.')
+					if prevchar!=')': self.counts['L'][eventlab] += 1
+		# invalidate prefix indexes
+		self._sorted = {}
+	
+	def _prefix_index(self, position):
+		# sorted distinct tokens and cumulative counts, for prefix range queries
+		if position not in self._sorted:
+			tokens = sorted(self.counts[position])
+			cumcounts = [0]
+			for token in tokens:
+				cumcounts.append(cumcounts[-1] + self.counts[position][token])
+			self._sorted[position] = (tokens, cumcounts)
+		return self._sorted[position]
+	
+	def count(self, eventlab, position='all'):
+		"""number of occurrences in the sample of tokens starting with 'eventlab', in the specified syntactic position:
+		'all' (any), 'S' (speciation) or 'L' (speciation-loss)"""
+		tokens, cumcounts = self._prefix_index(position)
+		i = bisect.bisect_left(tokens, eventlab)
+		j = i
+		while j < len(tokens) and tokens[j].startswith(eventlab): j += 1
+		return cumcounts[j] - cumcounts[i]
+
+class FlatRecGeneTree(object):
+	"""light-weight, array-backed representation of a reconciled gene tree, parsed from ALE pseudo-Newick strings
+	
+	Nodes are numbered in pre-order (root is 0), so that the subtree below node i spans nodes i to subtree_end(i)-1
+	and trees can be traversed without recursion. Node indexes are used as node ids.
+	The tree is stored as:
+	- 'parents': array of parent node indexes (-1 for the root);
+	- 'childptr', 'children': the children of node i are children[childptr[i]:childptr[i+1]], in left-to-right order;
+	- 'labels': list of node label strings (full ALE event chains, e.g. 'a_1.3.T@4->5' or '7.D@7');
+	- 'lengths': array of branch lengths (NaN when not specified);
+	- 'sizes': array of the number of nodes in each subtree.
+	"""
+	newickdelimpat = re.compile('([(),;])')
+	
+	def __init__(self, nwk):
+		self.nwk = nwk
+		self.parents = array('i')
+		self.labels = []
+		self.lengths = array('d')
+		self._parse(nwk)
+		self._index()
+	
+	def _add_node(self, parent, text=''):
+		self.parents.append(parent)
+		lab, sep, lg = text.strip().partition(':')
+		self.labels.append(lab)
+		self.lengths.append(float(lg) if lg else float('nan'))
+		return len(self.labels) - 1
+	
+	def _set_node_text(self, i, text):
+		lab, sep, lg = text.strip().partition(':')
+		self.labels[i] = lab
+		if lg: self.lengths[i] = float(lg)
+	
+	def _parse(self, nwk):
+		# tokenize the tree string into alternating text (node label and branch length) and delimiter items
+		items = self.newickdelimpat.split(nwk)
+		if len(items)==1 or items[1]==';':
+			# single-node tree
+			self._add_node(-1, items[0])
+			return
+		stack = []
+		for k in range(1, len(items), 2):
+			delim = items[k]
+			text = items[k+1]
+			nextdelim = items[k+2] if k+2 < len(items) else ''
+			if delim=='(':
+				stack.append(self._add_node(stack[-1] if stack else -1))
+			elif delim==')':
+				if not stack: raise ValueError, "unbalanced parentheses in tree string:\n%s"%nwk
+				self._set_node_text(stack.pop(), text)
+				continue
+			elif delim==',':
+				if not stack: raise ValueError, "unbalanced parentheses in tree string:\n%s"%nwk
+			else:
+				# delim==';'
+				break
+			if nextdelim!='(':
+				# text following an opening parenthesis or a comma is a leaf, unless a new clade opens
+				self._add_node(stack[-1], text)
+		if stack: raise ValueError, "unbalanced parentheses in tree string:\n%s"%nwk
+	
+	def _index(self):
+		n = len(self.parents)
+		nchildren = [0]*(n+1)
+		for p in self.parents:
+			if p >= 0: nchildren[p+1] += 1
+		for i in range(n):
+			nchildren[i+1] += nchildren[i]
+		self.childptr = array('i', nchildren)
+		fill = list(nchildren[:n])
+		self.children = array('i', [0]*(n-1 if n else 0))
+		for i, p in enumerate(self.parents):
+			if p >= 0:
+				self.children[fill[p]] = i
+				fill[p] += 1
+		# pre-order numbering: subtree sizes accumulate in reverse order
+		sizes = [1]*n
+		for i in range(n-1, 0, -1):
+			sizes[self.parents[i]] += sizes[i]
+		self.sizes = array('i', sizes)
+	
+	def __len__(self):
+		return len(self.parents)
+	
+	def __str__(self):
+		return self.nwk
+	
+	def label(self, i=0):
+		return self.labels[i]
+	
+	def father(self, i):
+		return self.parents[i]
+	
+	def get_children(self, i=0):
+		return self.children[self.childptr[i]:self.childptr[i+1]]
+	
+	def is_leaf(self, i=0):
+		return self.childptr[i]==self.childptr[i+1]
+	
+	def subtree_end(self, i=0):
+		return i + self.sizes[i]
+	
+	def get_leaves(self, i=0):
+		"""indexes of the leaves below node i"""
+		return [j for j in range(i, self.subtree_end(i)) if self.childptr[j]==self.childptr[j+1]]
+	
+	def nb_leaves(self, i=0):
+		return len(self.get_leaves(i))
+	
+	def iter_leaf_labels(self, i=0):
+		for j in self.get_leaves(i):
+			yield self.labels[j]
+
+def _parseALERecSpeciesTree(frec, reftreelen=None, restrictclade=None):
+	# read the header of an opened reconciliation file up to the reconciled species tree
 	line = ''
-	lrecgt = []
 	restrictlabs = []
-	frec = open(nfrec, 'r')
 	while not line.startswith('S:\t'):
 		line = frec.readline()
+		if not line: raise ValueError, "could not find the reconciled species tree in file '%s'"%frec.name
 	# extract node labels from reconciled species tree
 	spetree = tree2.AnnotatedNode(nwk=line.strip('\n').split('\t')[1], namesAsNum=True)
 	spetree.complete_node_ids()
@@ -34,11 +209,101 @@ def parseALERecFile(nfrec, reftreelen=None, restrictclade=None, skipEventFreq=Fa
 		subspetree = spetree.restrictToLeaves(restrictlabs, force=True)
 	else:
 		subspetree = spetree
+	return spetree, subspetree, restrictlabs
+
+def _seekALERecGeneTrees(frec):
+	# move the opened reconciliation file to the first line of the reconciled gene tree sample, which is returned
+	line = ''
 	while not line.endswith('reconciled G-s:\n'):
 		line = frec.readline()
+		if not line: raise ValueError, "could not find the reconciled gene tree sample in file '%s'"%frec.name
 	for i in range(2): line = frec.readline() # skips 2 lines
-	# extract reconciled gene tree(s)
+	return line
+
+def scanALERecHeader(nfrec):
+	"""reads a reconciliation file up to its first reconciled gene tree, returning a tuple (number of reconciled gene trees in the sample, number of gene tree leaves)"""
+	with open(nfrec, 'r') as frec:
+		line = ''
+		while not line.endswith('reconciled G-s:\n'):
+			line = frec.readline()
+			if not line: raise ValueError, "could not find the reconciled gene tree sample in file '%s'"%nfrec
+		nrecgt = int(line.split()[0])
+		for i in range(2): line = frec.readline() # skips 2 lines
+	return (nrecgt, line.count(',')+1)
+
+def _parseALERecNodeEventTable(frec):
+	# extract node-wise event frequency / copy number info, found after the reconciled gene tree sample
+	dnodeevt = {}
+	for i in range(3): line = frec.readline() # skips 3 lines
+	for line in frec:
+		if line=='\n': continue
+		lsp = line.strip('\n').split('\t')
+		dnodeevt[lsp[1]] = [float(s) for s in lsp[2:]]
+	return dnodeevt
+
+def prescanALERecFile(nfrec, reftreelen=None, restrictclade=None, skipEventFreq=False, indexSampleEvents=True, nsample=[]):
+	"""pre-pass over a reconciliation file that collects everything but the reconciled gene trees themselves
+	
+	reconciled gene tree strings are read one at a time and never stored; they are only counted and,
+	if indexSampleEvents is True, their event labels are added to a RecSampleEventIndex.
+	returns a dict with the following elements:
+	{
+	 'spetree', 'subspetree', 'restrictlabs': as returned by parseALERecFile(),
+	 'nrecgt': <number of reconciled gene trees in the (selected) sample>,
+	 'recgtsampleindex': <RecSampleEventIndex of the (selected) sample, or None>,
+	 'dnodeevt': <dict of node-wise event frequencies (empty if skipEventFreq is True)>
+	}
+	"""
+	recgtsampleindex = RecSampleEventIndex() if indexSampleEvents else None
+	with open(nfrec, 'r') as frec:
+		spetree, subspetree, restrictlabs = _parseALERecSpeciesTree(frec, reftreelen=reftreelen, restrictclade=restrictclade)
+		line = _seekALERecGeneTrees(frec)
+		k = 0
+		nrecgt = 0
+		while line and not line.startswith('#'):
+			if (not nsample) or (k in nsample):
+				if indexSampleEvents: recgtsampleindex.add(line)
+				nrecgt += 1
+			line = frec.readline()
+			k += 1
+		dnodeevt = {} if skipEventFreq else _parseALERecNodeEventTable(frec)
+	return {'spetree':spetree, 'subspetree':subspetree, 'restrictlabs':restrictlabs, 'nrecgt':nrecgt, 'recgtsampleindex':recgtsampleindex, 'dnodeevt':dnodeevt}
+
+def iterALERecGeneTrees(nfrec, nsample=[], returnLines=False, flatTrees=False):
+	"""generates the reconciled gene trees of a reconciliation file, parsing them one at a time
+	
+	yields tuples (k, rectree) where k is the index of the tree in the sample, 
+	or (k, rectree, line) if returnLines is True.
+	only trees with indexes in 'nsample' are parsed, if specified.
+	if flatTrees is True, trees are FlatRecGeneTree objects instead of tree2.AnnotatedNode objects.
+	"""
+	with open(nfrec, 'r') as frec:
+		line = _seekALERecGeneTrees(frec)
+		k = 0
+		while line and not line.startswith('#'):
+			if (not nsample) or (k in nsample):
+				if flatTrees:
+					rectree = FlatRecGeneTree(line.strip('\n'))
+				else:
+					rectree = tree2.AnnotatedNode(nwk=line.strip('\n'), namesAsNum=True)
+					rectree.complete_node_ids()
+				if returnLines: yield (k, rectree, line)
+				else: yield (k, rectree)
+			if nsample and k >= max(nsample): break
+			line = frec.readline()
+			k += 1
+
+def parseALERecFile(nfrec, reftreelen=None, restrictclade=None, skipEventFreq=False, skipLines=False, nsample=[], returnDict=False):
+	"""parse a whole reconciliation file, storing all the sampled reconciled gene trees (and their strings unless skipLines is True)
+	
+	for large samples, prefer the combination of prescanALERecFile() and iterALERecGeneTrees(), which keeps a single tree in memory.
+	"""
+	lrecgt = []
 	recgtlines = []
+	frec = open(nfrec, 'r')
+	spetree, subspetree, restrictlabs = _parseALERecSpeciesTree(frec, reftreelen=reftreelen, restrictclade=restrictclade)
+	line = _seekALERecGeneTrees(frec)
+	# extract reconciled gene tree(s)
 	k = 0
 	while not line.startswith('#'):
 		if (not nsample) or (k in nsample):
@@ -50,12 +315,7 @@ def parseALERecFile(nfrec, reftreelen=None, restrictclade=None, skipEventFreq=Fa
 		k += 1
 	dnodeevt = {}
 	if not skipEventFreq:
-		for i in range(3): line = frec.readline() # skips 3 lines
-		# extract node-wise event frequency / copy number info
-		for line in frec:
-			if line=='\n': continue
-			lsp = line.strip('\n').split('\t')
-			dnodeevt[lsp[1]] = [float(s) for s in lsp[2:]]
+		dnodeevt = _parseALERecNodeEventTable(frec)
 	frec.close()
 	if returnDict:
 		return {'spetree':spetree, 'subspetree':subspetree, 'lrecgt':lrecgt, 'recgtlines':recgtlines, 'restrictlabs':restrictlabs, 'dnodeevt':dnodeevt}
@@ -63,7 +323,8 @@ def parseALERecFile(nfrec, reftreelen=None, restrictclade=None, skipEventFreq=Fa
 		return [spetree, subspetree, lrecgt, recgtlines, restrictlabs, dnodeevt]
 
 def parseDatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample=1, sgsep='_', restrictlabs=[], \
-                          fillDTLSdict=True, recordEvTypes='ODTL', excludeTaggedLeaves=None, excludeTaggedSubtrees=None, joinTdonrec=True):
+                          fillDTLSdict=True, recordEvTypes='ODTL', excludeTaggedLeaves=None, excludeTaggedSubtrees=None, joinTdonrec=True, \
+                          recgtsampleindex=None):
 	def parseDatedRecGTNode(node, dlevt, dnodeallevt):
 		nodelab = node.label()
 		if not nodelab: raise ValueError, "unannotated node:\n%s"%str(node)
@@ -141,15 +402,14 @@ def parseDatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample=1
 	return dlevt, dnodeallevt
 	
 def parseUndatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample=1, sgsep='_', restrictlabs=[], \
-                            fillDTLSdict=True, recordEvTypes='DTL', excludeTaggedLeaves=None, excludeTaggedSubtrees=None):
-	def parseUndatedRecGTNode(node, dlevt, dnodeallevt):
-		nodelab = node.label()
-		if not nodelab: raise ValueError, "unannotated node:\n%s"%str(node)
-		if node.is_leaf() and (excludeTaggedLeaves in nodelab):
+                            fillDTLSdict=True, recordEvTypes='DTL', excludeTaggedLeaves=None, excludeTaggedSubtrees=None, \
+                            recgtsampleindex=None):
+	def parseUndatedRecGTNodeLabel(nodeid, nodelab, isleaf, dlevt, dnodeallevt):
+		if not nodelab: raise ValueError, "unannotated node %s in tree:\n%s"%(repr(nodeid), str(recgt))
+		if isleaf and excludeTaggedLeaves and (excludeTaggedLeaves in nodelab):
 			# the species assignment of this leaf is not certain (inferred)
 			# and thus events leading directly to this leaf are not to be trusted and should be skipped
 			return
-		nodeid = node.nodeid()
 		# line of events to be read left-to-right backward in time
 		lineage = nodelab.split('.')
 		for i in range(1, len(lineage)):
@@ -161,7 +421,7 @@ def parseUndatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample
 					# duplication event
 					dup = eventlab.split('D@')[1]
 					evtup = ('D', dup)
-					fevt = dexactevt.setdefault(evtup, float(recgtsample.count(eventlab))/nsample)
+					if evtup not in dexactevt: dexactevt[evtup] = float(recgtsampleindex.count(eventlab))/nsample
 					if restrictlabs and not (dup in restrictlabs): continue
 					if fillDTLSdict: dlevt['D'].append(dup)
 					dnodeallevt.setdefault(nodeid, []).append(evtup)
@@ -171,7 +431,7 @@ def parseUndatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample
 					translab = eventlab.split('T@')[1]
 					don, rec = translab.split('->')
 					evtup = ('T', don, rec)
-					fevt = dexactevt.setdefault(evtup, float(recgtsample.count(eventlab))/nsample)
+					if evtup not in dexactevt: dexactevt[evtup] = float(recgtsampleindex.count(eventlab))/nsample
 					if restrictlabs and not ((don in restrictlabs) and (rec in restrictlabs)): continue
 					if fillDTLSdict: dlevt['T'].append((don, rec))
 					dnodeallevt.setdefault(nodeid, []).append(evtup)
@@ -180,10 +440,8 @@ def parseUndatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample
 				if ('S' in recordEvTypes):
 					spe = getOriSpeciesFromEventLab(eventlab, sgsep=sgsep)
 					evtup = ('S', spe)
-					#~ evtpat = "(\)\.|[\(,])%s"%eventlab	# pattern captures the event at an internal node or a leaf 
-					evtpat = "([\.\(,]%s)"%eventlab	# pattern captures the event at an internal node or a leaf 
-					#~ print "count occurence in sample of pattern:", evtpat
-					fevt = dexactevt.setdefault(evtup, float(len(re.search(evtpat, recgtsample).groups()))/nsample)
+					# count occurrences of the event at an internal node or a leaf, i.e. preceded by any of '.(,'
+					if evtup not in dexactevt: dexactevt[evtup] = float(recgtsampleindex.count(eventlab, position='S'))/nsample
 					if fillDTLSdict: dlevt['S'].append(spe)
 					dnodeallevt.setdefault(nodeid, []).append(evtup)
 				if preveventlab!='':
@@ -196,26 +454,42 @@ def parseUndatedRecGeneTree(recgt, spet, dexactevt={}, recgtsample=None, nsample
 						if len(closslabs)>1: raise IndexError, "non binary species tree at node %s (children: %s)"%(lineage[-1], repr(ploss.get_children_labels()))
 						los = closslabs[0]
 						evtup = ('L', los)
-						fevt = dexactevt.setdefault(evtup, float(re.search("([^\)]\.%s)"%eventlab, recgtsample).groups)/nsample)
+						if evtup not in dexactevt: dexactevt[evtup] = float(recgtsampleindex.count(eventlab, position='L'))/nsample
 						if restrictlabs and not (los in restrictlabs): continue
 						if fillDTLSdict: dlevt['L'].append(los)
 						dnodeallevt.setdefault(nodeid, []).append(evtup)
 				#~ else:
 					#~ # a simple speciation event ; already delt with
 					#~ pass
-		if excludeTaggedSubtrees:
-			alllabext = [lab.split('_', 1)[1] for lab in node.iter_leaf_labels()]
-			if (len(set(alllabext)) == 1) and (excludeTaggedSubtrees in alllabext[0]):
-				# the subtree below this node is an artificial addition to the reconciled gene tree and should be skipped
-				return
+		return
+	
+	def isExcludedSubtree(leaflabs):
+		# the subtree below this node is an artificial addition to the reconciled gene tree and should be skipped
+		alllabext = [lab.split('_', 1)[1] for lab in leaflabs]
+		return (len(set(alllabext)) == 1) and (excludeTaggedSubtrees in alllabext[0])
+	
+	def parseUndatedRecGTNode(node, dlevt, dnodeallevt):
+		parseUndatedRecGTNodeLabel(node.nodeid(), node.label(), node.is_leaf(), dlevt, dnodeallevt)
+		if excludeTaggedSubtrees and isExcludedSubtree(node.iter_leaf_labels()): return
 		for child in node.get_children():
 			# use recursion to be able to exclude subtrees
 			parseUndatedRecGTNode(child, dlevt, dnodeallevt)
 		return
 	
+	if recgtsampleindex is None:
+		# tokenize the sample once for all the events of this tree; better build it once for the whole sample and pass it on
+		recgtsampleindex = RecSampleEventIndex([recgtsample] if recgtsample else [])
 	dnodeallevt = {}
 	dlevt = {e:[] for e in eventTypes}
-	parseUndatedRecGTNode(recgt, dlevt, dnodeallevt) # recursive function call
+	if isinstance(recgt, FlatRecGeneTree):
+		# iterate over nodes in pre-order, jumping over excluded subtrees
+		i = 0
+		while i < len(recgt):
+			parseUndatedRecGTNodeLabel(i, recgt.labels[i], recgt.is_leaf(i), dlevt, dnodeallevt)
+			if excludeTaggedSubtrees and isExcludedSubtree(recgt.iter_leaf_labels(i)): i = recgt.subtree_end(i)
+			else: i += 1
+	else:
+		parseUndatedRecGTNode(recgt, dlevt, dnodeallevt) # recursive function call
 	return dlevt, dnodeallevt
 
 def parseRecGeneTree(recgt, spet, ALEmodel='undated', **kw):
@@ -237,6 +511,8 @@ def parseRecGeneTree(recgt, spet, ALEmodel='undated', **kw):
 	
 	Frequency of events is searched in the WHOLE reconciled gene tree sample 
 	provided as the list of pseudo-newick strings, using exact string matching (only for DT).
+	The sample is best provided as a RecSampleEventIndex object ('recgtsampleindex' argument), built once
+	for all the trees of the sample; otherwise it is indexed from the 'recgtsample' string at every call.
 	In case of the same pattern of event occurring repeatedly in the same tree, e.g. same T@DON->REC in two paralogous lineages 
 	(can likely happen with tandem duplicates...), the count will reflect the sum of all such events. 
 	Records of event frequencies in both 'dlevt' and 'dnodeallevt' are thus NOT differentiated by lineage.
@@ -383,58 +659,113 @@ def splitEventChain(nodelab, isleaf=False, ALEmodel='dated', **kw):
 		leaflab = None
 	return (lineage, leaflab)
 
+def _cachedEventChain(nodelab, isleaf, eventchains, **kw):
+	"""splitEventChain() result for a node label, parsed only once and stored in the eventchains dict"""
+	key = (nodelab, isleaf, kw.get('ALEmodel', 'dated'))
+	lineageleaflab = eventchains.get(key)
+	if lineageleaflab is None:
+		lineageleaflab = eventchains[key] = splitEventChain(nodelab, isleaf=isleaf, **kw)
+	return lineageleaflab
+
+def _indexTreeNodes(node):
+	"""index the nodes of a tree in pre-order, without recursion
+	
+	returns a tuple of lists, each indexed by node: (nodes, indexes of children, index of the first leaf, index following the last leaf);
+	leaves are indexed in pre-order too, so that the leaves under a node have consecutive indexes.
+	"""
+	lnodes = [] ; lchildren = [] ; lleafbeg = [] ; lleafend = []
+	nleaves = 0
+	stack = [(node, -1)]
+	while stack:
+		n, f = stack.pop()
+		i = len(lnodes)
+		lnodes.append(n) ; lchildren.append([]) ; lleafbeg.append(nleaves)
+		if f >= 0: lchildren[f].append(i)
+		if n.is_leaf():
+			nleaves += 1
+			lleafend.append(nleaves)
+		else:
+			lleafend.append(None)
+			stack += [(child, i) for child in reversed(n.children)]
+	# descendants come after their ancestors in pre-order
+	for i in range(len(lnodes)-1, -1, -1):
+		if lleafend[i] is None: lleafend[i] = lleafend[lchildren[i][-1]]
+	return (lnodes, lchildren, lleafbeg, lleafend)
+
+def _postOrder(lchildren):
+	"""indexes of nodes in post-order (children from first to last, then their parent)"""
+	lpost = []
+	stack = [(0, False)]
+	while stack:
+		i, expanded = stack.pop()
+		if expanded or not lchildren[i]:
+			lpost.append(i)
+		else:
+			stack.append((i, True))
+			stack += [(c, False) for c in reversed(lchildren[i])]
+	return lpost
+
+def _bitsetLabels(bits, lleaflabs):
+	"""leaf labels of the leaf indexes set in an integer bitset"""
+	return [lleaflabs[k] for k, b in enumerate(bin(bits)[:1:-1]) if b=='1']
+
 def _prune_orthologs_bottom_up(node, ALEmodel='dated', **kw):
-	"""'last-gain' (strict) definition of ortholous groups: only those genes related by a line of speciation events (no transfer, no duplication) are orthologs"""
-	# initiate at root
-	unclassified = set([])
+	"""'last-gain' (strict) definition of ortholous groups: only those genes related by a line of speciation events (no transfer, no duplication) are orthologs
+	
+	the tree is traversed in post-order without recursion; sets of unclassified leaves are integer bitsets over leaf indexes.
+	"""
 	orthologGroups = kw.get('orthologGroups', [])
 	dlabs = kw.get('dlabs', {})
 	verbose = kw.get('verbose')
-	nodelab = node.label()
-	if not nodelab: raise ValueError, "unannotated node:\n%s"%str(node)
-	lineage, leaflab = splitEventChain(nodelab, isleaf=node.is_leaf(), **kw)
-	if node.is_leaf():
-		unclassified.add(leaflab) # where unclasified set is filled up
-		dlabs[nodelab] = leaflab
-	else:
-		# post-order traversal recursion:
-		for child in node.children:
-			# first explore children
-			for arg in ('orthologGroups', 'dlabs'): kw[arg] = eval(arg)
-			orthologGroups, uncl, dlabs = _prune_orthologs_bottom_up(child, **kw)
-			unclassified |= uncl
-	if verbose: print 'lineage:', lineage, ("leaflab: %s"%leaflab if leaflab else "")
-	# then explore node itself
-	if not unclassified:
-		# all leaves below have been already classified in orthologous group; stop here.
-		return orthologGroups, unclassified, dlabs
-	# list of events goes BACKWARD in time when read left-to-right
-	for event in lineage:
-		evtype, evloc, evdate = event
-		if evtype in {'Tr', 'T'}:
-			# gene was last gained here by a species ancestor:
-			# what was not yet classifed in this subtree is an orthologous group
-			ortho = tuple(sorted(unclassified))
-			orthologGroups.append(ortho)
-			unclassified = set([])
-			if verbose: print 'T-OG!', len(ortho)
-			break # for event loop
-		elif evtype=='D':
-			# gene was duplicated here by species ancestor:
-			# what was not yet classifed in the child subtrees
-			# of this subtree are each an orthologous group
-			nonemptychildren = False
-			for child in node.children:
-				subuncl = set([dlabs[leaflabevchain] for leaflabevchain in child.iter_leaf_labels()]) & unclassified
-				if subuncl:
-					ortho = tuple(sorted(subuncl))
-					orthologGroups.append(ortho)
-					if verbose: print 'D-OG!', len(ortho)
-					nonemptychildren = True
-			if nonemptychildren:
-				unclassified = set([])
+	eventchains = kw.get('eventChainCache', {})
+	lnodes, lchildren, lleafbeg, lleafend = _indexTreeNodes(node)
+	for n in lnodes:
+		if not n.label(): raise ValueError, "unannotated node:\n%s"%str(n)
+	lleaflabs = [None]*lleafend[0]
+	# bitset of the leaves below each node that are not yet classified
+	lunclassified = [0]*len(lnodes)
+	for i in _postOrder(lchildren):
+		n = lnodes[i]
+		nodelab = n.label()
+		lineage, leaflab = _cachedEventChain(nodelab, n.is_leaf(), eventchains, **kw)
+		if n.is_leaf():
+			lleaflabs[lleafbeg[i]] = leaflab
+			dlabs[nodelab] = leaflab
+			unclassified = 1 << lleafbeg[i] # where unclasified set is filled up
+		else:
+			unclassified = 0
+			for c in lchildren[i]:
+				unclassified |= lunclassified[c]
+		if verbose: print 'lineage:', lineage, ("leaflab: %s"%leaflab if leaflab else "")
+		# if all leaves below have been already classified in orthologous group, there is nothing to do
+		# list of events goes BACKWARD in time when read left-to-right
+		for event in (lineage if unclassified else []):
+			evtype, evloc, evdate = event
+			if evtype in {'Tr', 'T'}:
+				# gene was last gained here by a species ancestor:
+				# what was not yet classifed in this subtree is an orthologous group
+				ortho = tuple(sorted(_bitsetLabels(unclassified, lleaflabs)))
+				orthologGroups.append(ortho)
+				unclassified = 0
+				if verbose: print 'T-OG!', len(ortho)
 				break # for event loop
-	#~ if verbose: print "unclassified:", unclassified
+			elif evtype=='D':
+				# gene was duplicated here by species ancestor:
+				# what was not yet classifed in the child subtrees
+				# of this subtree are each an orthologous group
+				nonemptychildren = False
+				for c in lchildren[i]:
+					subuncl = unclassified & (((1 << lleafend[c]) - 1) ^ ((1 << lleafbeg[c]) - 1))
+					if subuncl:
+						ortho = tuple(sorted(_bitsetLabels(subuncl, lleaflabs)))
+						orthologGroups.append(ortho)
+						if verbose: print 'D-OG!', len(ortho)
+						nonemptychildren = True
+				if nonemptychildren:
+					unclassified = 0
+					break # for event loop
+		lunclassified[i] = unclassified
+	unclassified = set(_bitsetLabels(lunclassified[0], lleaflabs))
 	if node.is_root() and unclassified:
 		# any remaining unclassified leaf is to be alloacted to a backbone orthologous group
 		# (= paraphyletic gene lineage unaffected by transfers since the origin of the family)
@@ -553,6 +884,7 @@ def _prune_orthologs_top_down(node, **kw):
 	trheshExtraSpe = float(kw.get('trheshExtraSpe', 0.1))
 	noNodeAnnot = kw.get('noNodeAnnot')
 	verbose = kw.get('verbose')
+	eventchains = kw.get('eventChainCache', {})
 	if verbose and candidateOGs: print 'using mixed criterion'
 	if not dlabs:	
 		# first establish the dictionary of actual leaf lables, without the trailing event chain
@@ -578,67 +910,78 @@ def _prune_orthologs_top_down(node, **kw):
 				elif verbose: print trlabs, "excluded"
 			if verbose and len(candidateOGs)!=len(restrcandOGs): print "restrict set of candidate OGs from %d to %d"%(len(candidateOGs), len(restrcandOGs))
 			candidateOGs = restrcandOGs
-		kw['reRootMaxBalance'] = False # do not pass on parameter to avoid repeating action recursively
-	
-	# # # # test at current node
-	nodelab = node.label()
-	if not (nodelab or noNodeAnnot): raise ValueError, "unannotated node:\n%s"%str(node)
-	if verbose > 1: print repr(node), ('(leaf)' if node.is_leaf() else '(internal)')+';',
-	leaflabs = [dlabs[leaflabevchain] for leaflabevchain in node.iter_leaf_labels()]
-	lspe = [getSpe(leaflab, sp0, sp1) for leaflab in leaflabs]
-	nspe = len(set(lspe))
-	extraspe = True # initiate
-	if (not refspetree) or rerootMBgt:
-		if verbose: print 'evaluate orthology under gene tree node', nodelab
-		extraspe = getExtraNumerarySpe(lspe)
-		if not extraspe:
-			ortho = tuple(sorted(leaflabs))
-			orthologGroups.append(ortho)
-			if verbose: print 'U-OG!'
-		elif candidateOGs:
-			lex = float(len(set(extraspe)))
-			if lex/nspe <= trheshExtraSpe:
-				if verbose: print 'extraspe:', extraspe, "(%d nr species, %.0f%% of the represented set)"%(int(lex), 100*lex/nspe)
-				OGs, remainingcOGs = _prune_nested_candidate_orthologs(node, dsbal, leaflabs, lspe, extraspe, **kw)
-				if OGs:
-					orthologGroups += OGs
-					candidateOGs = remainingcOGs
-					extraspe = []
-	else:
-		lineage, tiplab = splitEventChain(nodelab, isleaf=node.is_leaf(), **kw)
-		if verbose: print 'lineage:', lineage, ("leaflab: %s"%leaflab if leaflab else "")
-		# list of events goes BACKWARD in time when read left-to-right
-		for event in lineage:
-			# latest event primes
-			evtype, evloc, evdate = event
-			if evtype in {'Td', 'TdL'}: 
-				# emission of transfer: irrelevant to gene content of the clade below this ancestor
-				continue # the for event loop
-			speanc = refspetree[evloc]
-			assert isinstance(speanc, tree2.Node)
-			if verbose: print 'evaluate orthology under gene tree event', evtype, 'at ancestor', evloc
-			ancclade = speanc.get_leaf_labels()
-			extraspe = getExtraNumerarySpe(lspe, ancclade)
+	# keyword arguments for pruning nested candidate OGs: at the root, the candidate OGs as passed to this function;
+	# below, those retained after re-rooting
+	kwroot = kw
+	kw = dict(kw)
+	kw['reRootMaxBalance'] = False
+	kw['candidateOGs'] = candidateOGs
+	
+	# # # # explore the tree in pre-order, without recursion
+	lnodes, lchildren, lleafbeg, lleafend = _indexTreeNodes(node)
+	lleaflabs = [dlabs[n.label()] for n in lnodes if n.is_leaf()]
+	stack = [0]
+	while stack:
+		i = stack.pop()
+		n = lnodes[i]
+		isroot = (i==0)
+		kwnode = kwroot if isroot else kw
+		# # # # test at current node
+		nodelab = n.label()
+		if not (nodelab or noNodeAnnot): raise ValueError, "unannotated node:\n%s"%str(n)
+		if verbose > 1: print repr(n), ('(leaf)' if n.is_leaf() else '(internal)')+';',
+		leaflabs = lleaflabs[lleafbeg[i]:lleafend[i]]
+		lspe = [getSpe(leaflab, sp0, sp1) for leaflab in leaflabs]
+		nspe = len(set(lspe))
+		extraspe = True # initiate
+		if (not refspetree) or (isroot and rerootMBgt):
+			if verbose: print 'evaluate orthology under gene tree node', nodelab
+			extraspe = getExtraNumerarySpe(lspe)
 			if not extraspe:
 				ortho = tuple(sorted(leaflabs))
 				orthologGroups.append(ortho)
 				if verbose: print 'U-OG!'
-				break # for event loop
 			elif candidateOGs:
 				lex = float(len(set(extraspe)))
 				if lex/nspe <= trheshExtraSpe:
 					if verbose: print 'extraspe:', extraspe, "(%d nr species, %.0f%% of the represented set)"%(int(lex), 100*lex/nspe)
-					OGs, remainingcOGs = _prune_nested_candidate_orthologs(node, dsbal, leaflabs, lspe, extraspe, ancclade=ancclade, **kw)
+					# (remaining candidate OGs are not needed, as a clade where OGs are found is not explored further)
+					OGs, remainingcOGs = _prune_nested_candidate_orthologs(n, dsbal, leaflabs, lspe, extraspe, **kwnode)
 					if OGs:
 						orthologGroups += OGs
-						candidateOGs = remainingcOGs
 						extraspe = []
-						break
-	if extraspe:
-		# if did not find the clade to be an orthologous group, recurse down the tree:
-		for child in node.children:
-			for arg in ('orthologGroups', 'dlabs', 'candidateOGs'): kw[arg] = eval(arg)
-			orthologGroups, dlabs = _prune_orthologs_top_down(child, **kw)
+		else:
+			lineage, tiplab = _cachedEventChain(nodelab, n.is_leaf(), eventchains, **kwnode)
+			if verbose: print 'lineage:', lineage, ("leaflab: %s"%tiplab if tiplab else "")
+			# list of events goes BACKWARD in time when read left-to-right
+			for event in lineage:
+				# latest event primes
+				evtype, evloc, evdate = event
+				if evtype in {'Td', 'TdL'}: 
+					# emission of transfer: irrelevant to gene content of the clade below this ancestor
+					continue # the for event loop
+				speanc = refspetree[evloc]
+				assert isinstance(speanc, tree2.Node)
+				if verbose: print 'evaluate orthology under gene tree event', evtype, 'at ancestor', evloc
+				ancclade = speanc.get_leaf_labels()
+				extraspe = getExtraNumerarySpe(lspe, ancclade)
+				if not extraspe:
+					ortho = tuple(sorted(leaflabs))
+					orthologGroups.append(ortho)
+					if verbose: print 'U-OG!'
+					break # for event loop
+				elif candidateOGs:
+					lex = float(len(set(extraspe)))
+					if lex/nspe <= trheshExtraSpe:
+						if verbose: print 'extraspe:', extraspe, "(%d nr species, %.0f%% of the represented set)"%(int(lex), 100*lex/nspe)
+						OGs, remainingcOGs = _prune_nested_candidate_orthologs(n, dsbal, leaflabs, lspe, extraspe, ancclade=ancclade, **kwnode)
+						if OGs:
+							orthologGroups += OGs
+							extraspe = []
+							break
+		if extraspe:
+			# if did not find the clade to be an orthologous group, explore the children (first child on top of the stack)
+			stack += reversed(lchildren[i])
 	return orthologGroups, dlabs
 
 def getOrthologues(recgt, method='mixed', **kw):
@@ -680,9 +1023,11 @@ def getOrthologues(recgt, method='mixed', **kw):
 	'reRootMaxBalance':
 	    boolean, only for 'unicopy' or 'mixed' methods.
 	'ALEmodel'   : {'dated', 'undated'} specify the algorithm under which was generated the reconciliation (different parser)
+	'eventChainCache' : dict where parsed node event chains are stored, to be shared between calls on the same tree
 	'verbose'    : integer (0-2)
 	"""
 	verbose = kw.get('verbose')
+	if kw.get('eventChainCache') is None: kw['eventChainCache'] = {}
 	if method in ['last-gain', 'strict']:
 		ogs, unclassified, dlabs = _prune_orthologs_bottom_up(recgt, **kw)
 	elif method=='unicopy':
@@ -52,13 +52,35 @@ def eventLineages(recgt, dnodeallevt, ALEmodel='undated', recordEvTypes='DTS', o
 				#~ print 'allevtlineages:', allevtlineages
 			return eventpath
 	
+	def get_flat_eventlineage(i, dnodeallevt, allevtlineages):
+		# same as get_eventlineage() for a FlatRecGeneTree, where nodes are indexes; climb up to the closest recorded ancestor without recursion
+		climb = []
+		j = i
+		while j >= 0 and (j not in allevtlineages):
+			climb.append(j)
+			j = recgt.parents[j]
+		eventpath = allevtlineages[j] if j >= 0 else []
+		for j in reversed(climb):
+			eventpath = [evtup for evtup in dnodeallevt.get(j, []) if (evtup[0] in recordEvTypes)] + eventpath
+			if not recgt.is_leaf(j):
+				allevtlineages[j] = eventpath
+		return eventpath
+	
 	evtlineages = {}	# only lineages from the leaves to be returned
 	allevtlineages = {} # cache dict for events at nodes shared by several leaves
+	if isinstance(recgt, pAr.FlatRecGeneTree):
+		leaves = recgt.get_leaves()
+		getleaflab = recgt.label
+		eventlineagefun = get_flat_eventlineage
+	else:
+		leaves = recgt.get_leaves()
+		getleaflab = lambda leaf: leaf.label()
+		eventlineagefun = get_eventlineage
 	if ALEmodel=='undated':
-		leavesandlabels = [(leaf, leaf.label().split('.')[0]) for leaf in recgt.get_leaves()]
+		leavesandlabels = [(leaf, getleaflab(leaf).split('.')[0]) for leaf in leaves]
 	elif ALEmodel=='dated':
 		#~ leavesandlabels = [(leaf, splitEventChain(leaf.label(), isleaf=True, ALEmodel='dated')[1]) for leaf in recgt.get_leaves()]
-		leavesandlabels = [(leaf, leaf.label().split('.')[0].split('@')[0]) for leaf in recgt.get_leaves()]
+		leavesandlabels = [(leaf, getleaflab(leaf).split('.')[0].split('@')[0]) for leaf in leaves]
 	else:
 		raise ValueError, "wrong ALE model specified: '%s'"%ALEmodel
 	leavesandlabels.sort(key=lambda x: x[1]) # sort so that the representative first label to be captured by deDupMatching regex will be consistent across the recgt sample
@@ -78,7 +100,7 @@ def eventLineages(recgt, dnodeallevt, ALEmodel='undated', recordEvTypes='DTS', o
 				lela.append((leaf, leaflab))
 		leavesandlab = lela
 	for leaf, leaflab in leavesandlab:
-		evtlineages[leaflab] = get_eventlineage(leaf, dnodeallevt, allevtlineages)
+		evtlineages[leaflab] = eventlineagefun(leaf, dnodeallevt, allevtlineages)
 	return evtlineages
 
 def translateRecStree(colspetree, refspetree):	
@@ -164,10 +186,12 @@ def parseRec(nfrec, refspetree=None, ALEmodel='undated', drefspeeventTup2Ids=Non
 	"""
 	if not (returnDict or lineageTableOutDir): raise ValueError, "no output option chosen"
 	print nfrec
-	# parse reconciliation file and extract collapsed species tree, mapping of events (with freq.) on the species tree, and reconciled gene trees
-	colspetree, subspetree, lrecgt, recgtlines, restrictlabs, dnodeevt = pAr.parseALERecFile(nfrec)
-	nsample = len(lrecgt)
-	recgtsample = ''.join(recgtlines)
+	# pre-parse reconciliation file and extract collapsed species tree and sample size;
+	# count all event labels in the sample at once, for the computation of event frequencies
+	dprescan = pAr.prescanALERecFile(nfrec, skipEventFreq=True)
+	colspetree = dprescan['spetree']
+	nsample = dprescan['nrecgt']
+	recgtsampleindex = dprescan['recgtsampleindex']
 	if not noTranslateSpeTree:
 		tcolspetree, dcol2fullspenames = translateRecStree(colspetree, refspetree)
 	else:
@@ -178,18 +202,19 @@ def parseRec(nfrec, refspetree=None, ALEmodel='undated', drefspeeventTup2Ids=Non
 	if ALEmodel=='dated':
 		# add reference for '#OUTSIDE#' taxon
 		dcol2fullspenames[outtaxlab] = outtaxlab
-	# parse reconciled gene trees
+	# parse reconciled gene trees, streamed one at a time from the file
 	# and extract (exact) event-wise event frequency
 	dexactevt = {}
 	devtlineagecount = {}
 	allrectevtlineages = {}
-	for i, recgt in enumerate(lrecgt):
+	# trees of the undated model are parsed as light-weight, array-backed FlatRecGeneTree objects
+	for i, recgt in pAr.iterALERecGeneTrees(nfrec, flatTrees=(ALEmodel=='undated')):
 		# gather scenario-scpecific events (i.e. dependent on reconciled gene tree topology, which varies among the sample)
-		dlevt, dnodeallevt = pAr.parseRecGeneTree(recgt, colspetree, ALEmodel=ALEmodel, dexactevt=dexactevt, recgtsample=recgtsample, \
+		dlevt, dnodeallevt = pAr.parseRecGeneTree(recgt, colspetree, ALEmodel=ALEmodel, dexactevt=dexactevt, recgtsampleindex=recgtsampleindex, \
 		                                          nsample=nsample, fillDTLSdict=False, recordEvTypes=recordEvTypes, \
 		                                          excludeTaggedLeaves=collapsedcladetag, excludeTaggedSubtrees=replacementcladetag)
 		# here events involving a replcement clade (RC) or leaf (CC) are excluded
-		# * 'dexactevt' is used as cache to store frequencies of event s as inferred from regex searches of the event pattern
+		# * 'dexactevt' is used as cache to store frequencies of event s as inferred from counts of the event pattern in the sample index
 		# these frequencies are not specific to gene lineages, but aggregate the counts over the whole gene family
 		# * 'dlevt' is of no use and here returned empty because of fillDTLSdict=False
 		# would it not be empty, it could be translated to the full reference tree with:
@@ -236,7 +261,9 @@ def parseRec(nfrec, refspetree=None, ALEmodel='undated', drefspeeventTup2Ids=Non
 	# optionally write out events gene by gene (those that occured at least once above a gene in [rooted] reconciled gene tree, and at which frequency)
 	if lineageTableOutDir:
 		nfTableEventsOut = os.path.join(lineageTableOutDir, "%s.%s.eventlineages"%(os.path.basename(nfrec), recordEvTypes))
-		with open(nfTableEventsOut, 'w') as fTableOut:
+		# write to a temporary file first and rename it when complete, so that an interrupted run never leaves a truncated table
+		nfTableEventsTmp = nfTableEventsOut+'.tmp'
+		with open(nfTableEventsTmp, 'w') as fTableOut:
 			geneleaflabs = devtlineagecount.keys()
 			geneleaflabs.sort()
 			for geneleaflab in geneleaflabs:
@@ -244,18 +271,20 @@ def parseRec(nfrec, refspetree=None, ALEmodel='undated', drefspeeventTup2Ids=Non
 				for evtup, freq in eventlineage.iteritems():
 					if drefspeeventTup2Ids: fTableOut.write('\t'.join((geneleaflab, str(evtup), str(freq)))+'\n')
 					else: fTableOut.write('\t'.join((geneleaflab,)+evtup+(str(freq),))+'\n')
+		os.rename(nfTableEventsTmp, nfTableEventsOut)
 		print "stored events listed by gene lineage in '%s'"%nfTableEventsOut
 	
 	sys.stdout.flush()
 	retd = {}
 	retd['nfrec'] = nfrec
+	if lineageTableOutDir:
+		retd['lineageTable'] = nfTableEventsOut
 	if returnDict:
 		retd['devtlineagecount'] = devtlineagecount
 		if allEventByLineageByGenetree:
 			retd['allrectevtlineages'] = allrectevtlineages
 			retd['dexactevt'] = dexactevt
-	else:
-		return retd
+	return retd
 
 # 
 def parseRecTupArgs(args):
@@ -294,80 +323,195 @@ def loadRefPopTree(nfrefspetree, nfpop):
 	refspetree.write_newick(nfrefspetreeout, ignoreBS=True)
 	return (refspetree, dspe2pop)
 	
+class SpeciesTreeEventIds(object):
+	"""arithmetic mapping of species tree event tuples (of the form (X, [don, ]rec)) to unique integer event ids
+	
+	Ids are those of the historical enumeration of events over the reference species tree branches, in tree iteration order:
+	for each branch at position p, a block of N+2 ids (N being the number of branches) for events
+	'D', 'T' (from each of the N-1 other branches, in tree iteration order), 'L' and 'S'; 
+	then 'O' events for each branch, 'O' outside the tree and, optionally, 'T' from outside the tree to each branch.
+	Ids are thus computed from the branch positions rather than stored for every possible event.
+	NB: in-tree transfer tuples are keyed as ('T', <branch of the id block>, <other branch>), as in the former dict-based enumeration.
+	
+	Objects behave like the former dict {evtup:eventid} (item access, get(), 'in' and len()); 
+	the reverse mapping {eventid:evtup} is provided by the SpeciesTreeEventTuples view returned by the reverse() method.
+	"""
+	def __init__(self, refspetree, TfromOutside=True):
+		# branch label <-> position index arrays
+		self.branchlabs = []
+		self.branchnids = []
+		self.fathernids = []
+		self.isleaf = []
+		for node in refspetree:
+			self.branchlabs.append(node.label())
+			self.branchnids.append(node.nodeid())
+			self.fathernids.append(node.father_nodeid())
+			self.isleaf.append(node.is_leaf())
+		self.dbranchidx = {lab:p for p, lab in enumerate(self.branchlabs)}
+		self.TfromOutside = TfromOutside
+		N = self.nbranches = len(self.branchlabs)
+		self.blocksize = N + 2
+		self.offsetO = N * self.blocksize
+		self.idOoutside = self.offsetO + N
+		self.offsetToutside = self.idOoutside + 1
+		self.nevents = self.offsetToutside + (N if TfromOutside else 0)
+		self.outnid = max(self.branchnids) + 1
+		# position of event types within a branch block, transfers excepted
+		self.dblockpos = {'D':0, 'L':N, 'S':N+1}
+	
+	def event_id(self, evtup):
+		et = evtup[0]
+		try:
+			if et=='T':
+				if evtup[1]==outtaxlab:
+					if self.TfromOutside and len(evtup)==3: return self.offsetToutside + self.dbranchidx[evtup[2]]
+				elif len(evtup)==3:
+					p = self.dbranchidx[evtup[1]]
+					q = self.dbranchidx[evtup[2]]
+					if p!=q: return p * self.blocksize + 1 + (q if q < p else q - 1)
+			elif len(evtup)==2:
+				if et=='O':
+					if evtup[1]==outtaxlab: return self.idOoutside
+					return self.offsetO + self.dbranchidx[evtup[1]]
+				elif et in self.dblockpos:
+					return self.dbranchidx[evtup[1]] * self.blocksize + self.dblockpos[et]
+		except KeyError:
+			pass
+		raise KeyError, evtup
+	
+	def event_tuple(self, eventid):
+		return self.event_row(eventid)[0]
+	
+	def event_row(self, eventid):
+		"""returns a tuple (evtup, outevtup), where outevtup is the row of the species tree event table: (event_id, event_type, don_branch_id, rec_branch_id)"""
+		if not (0 <= eventid < self.nevents): raise KeyError, eventid
+		if eventid >= self.offsetToutside:
+			p = eventid - self.offsetToutside
+			return (('T', outtaxlab, self.branchlabs[p]), (eventid, 'T', self.outnid, self.branchnids[p]))
+		elif eventid == self.idOoutside:
+			return (('O', outtaxlab), (eventid, 'O', '', self.outnid))
+		elif eventid >= self.offsetO:
+			p = eventid - self.offsetO
+			return (('O', self.branchlabs[p]), (eventid, 'O', '', self.branchnids[p]))
+		p, k = divmod(eventid, self.blocksize)
+		if k==0: et = 'D'
+		elif k==self.nbranches: et = 'L'
+		elif k==self.nbranches+1: et = 'S'
+		else:
+			q = k - 1
+			if q >= p: q += 1
+			return (('T', self.branchlabs[p], self.branchlabs[q]), (eventid, 'T', self.branchnids[q], self.branchnids[p]))
+		return ((et, self.branchlabs[p]), (eventid, et, '', self.branchnids[p]))
+	
+	def iter_event_rows(self):
+		"""generates the rows of the species tree event table, in event id order"""
+		for eventid in xrange(self.nevents):
+			yield self.event_row(eventid)[1]
+	
+	def reverse(self):
+		return SpeciesTreeEventTuples(self)
+	
+	def __getitem__(self, evtup):
+		return self.event_id(evtup)
+	
+	def get(self, evtup, default=None):
+		try:
+			return self.event_id(evtup)
+		except KeyError:
+			return default
+	
+	def __contains__(self, evtup):
+		return self.get(evtup) is not None
+	
+	def __len__(self):
+		return self.nevents
+
+class SpeciesTreeEventTuples(object):
+	"""reverse view of a SpeciesTreeEventIds object, behaving like the former dict {eventid:evtup}"""
+	def __init__(self, eventids):
+		self.eventids = eventids
+	
+	def __getitem__(self, eventid):
+		return self.eventids.event_tuple(eventid)
+	
+	def get(self, eventid, default=None):
+		try:
+			return self.eventids.event_tuple(eventid)
+		except (KeyError, TypeError):
+			return default
+	
+	def __contains__(self, eventid):
+		return self.get(eventid) is not None
+	
+	def __len__(self):
+		return len(self.eventids)
+
 def generateEventRefDB(refspetree, ALEmodel='undated', refTreeTableOutDir=None, TfromOutside=True):
-	"""generates a dict of event tuples (of the form (X, [don, ]rec)). 
+	"""generates a mapping of event tuples (of the form (X, [don, ]rec)) to event ids and its reverse, as SpeciesTreeEventIds and SpeciesTreeEventTuples objects.
 	
 	Optionally writes out the reference species tree branches and event info to table files:
 	- species_tree table dump has fields:       (branch_id, parent_branch_id, branch_name, is_tip)
 	- species_tree_event table dump has fields: (event_id, event_type, don_branch_id, rec_branch_id)
+	the latter is streamed from the arithmetic event id mapping, without storing event tuples.
 	"""
-	def recordGLEvent(eventid, evtup, outevtup, drefspeeventTup2Ids, drefspeeventId2Tups, foutspeevents=None):
-		drefspeeventTup2Ids[evtup] = eventid
-		drefspeeventId2Tups[eventid] = evtup
-		if foutspeevents: foutspeevents.write('\t'.join([str(e) for e in outevtup])+'\n')
-		return eventid+1
-	
-	drefspeeventTup2Ids = {}
-	drefspeeventId2Tups = {}
-	maxnid = 0
-	eventid = 0
-	if refTreeTableOutDir:
-		foutspetree = open(os.path.join(refTreeTableOutDir, "phylogeny_species_tree.tab"), 'w')
-		foutspeevents = open(os.path.join(refTreeTableOutDir, "phylogeny_species_tree_events.tab"), 'w')
-	else:
-		foutspeevents = None
-	for node in refspetree:
-		nid = node.nodeid()
-		if nid>maxnid: maxnid = nid
-		nlab = node.label()
-		fnid = node.father_nodeid()
-		#~ if ALEmodel=='undated':
-		# for all models, do not record dates of events
-		if refTreeTableOutDir: foutspetree.write('\t'.join((str(nid), str(fnid if fnid else ''), nlab, str(int(node.is_leaf()))))+'\n')
-		#~ for et in pAr.eventTypes:
-		for et in 'DTLS':
-			evtup = (et, nlab)
-			if et!='T':
-				eventid = recordGLEvent(eventid, evtup, (eventid, et, '', nid), drefspeeventTup2Ids, drefspeeventId2Tups, foutspeevents)
-			else:
-				for donnode in refspetree:
-					if not node is donnode:
-						evtupt = evtup + (donnode.label(),)
-						eventid = recordGLEvent(eventid, evtupt, (eventid, et, donnode.nodeid(), nid), drefspeeventTup2Ids, drefspeeventId2Tups, foutspeevents)
-	
-	# for backwards compatibility wwhen O event we not considered
-	et = 'O'
-	for node in refspetree:
-		nid = node.nodeid()
-		if nid>maxnid: maxnid = nid
-		nlab = node.label()
-		fnid = node.father_nodeid()
-		evtup = (et, nlab)
-		eventid = recordGLEvent(eventid, evtup, (eventid, et, '', nid), drefspeeventTup2Ids, drefspeeventId2Tups, foutspeevents)
-	# add origination outside the tree
-	outnid = maxnid + 1
-	if refTreeTableOutDir: foutspetree.write('\t'.join((str(outnid), '', outtaxlab, '0'))+'\n')
-	evtup = (et, outtaxlab)
-	eventid = recordGLEvent(eventid, evtup, (eventid, et, '', outnid), drefspeeventTup2Ids, drefspeeventId2Tups, foutspeevents)
-	
-	if TfromOutside:
-		et = 'T'
-		# make this loop occur last so not to change the value of ids whether done or not
-		for node in refspetree:
-			nid = node.nodeid()
-			nlab = node.label()
-			evtupt = (et, outtaxlab, nlab)
-			eventid = recordGLEvent(eventid, evtupt, (eventid, et, outnid, nid), drefspeeventTup2Ids, drefspeeventId2Tups, foutspeevents)
-		
+	drefspeeventTup2Ids = SpeciesTreeEventIds(refspetree, TfromOutside=TfromOutside)
+	drefspeeventId2Tups = drefspeeventTup2Ids.reverse()
 	if refTreeTableOutDir:
-		foutspetree.close()
-		foutspeevents.close()
+		with open(os.path.join(refTreeTableOutDir, "phylogeny_species_tree.tab"), 'w') as foutspetree:
+			for nid, fnid, nlab, isleaf in zip(drefspeeventTup2Ids.branchnids, drefspeeventTup2Ids.fathernids, drefspeeventTup2Ids.branchlabs, drefspeeventTup2Ids.isleaf):
+				foutspetree.write('\t'.join((str(nid), str(fnid if fnid else ''), nlab, str(int(isleaf))))+'\n')
+			# add origination outside the tree
+			foutspetree.write('\t'.join((str(drefspeeventTup2Ids.outnid), '', outtaxlab, '0'))+'\n')
+		with open(os.path.join(refTreeTableOutDir, "phylogeny_species_tree_events.tab"), 'w') as foutspeevents:
+			for outevtup in drefspeeventTup2Ids.iter_event_rows():
+				foutspeevents.write('\t'.join([str(e) for e in outevtup])+'\n')
 	return (drefspeeventTup2Ids, drefspeeventId2Tups)
 
+def recFileFingerprint(nfrec):
+	"""cheap fingerprint of a reconciliation file, based on its size and modification time"""
+	st = os.stat(nfrec)
+	return "%d:%d"%(st.st_size, int(st.st_mtime))
+
+def parseEventsParamString(ALEmodel, recordEvTypes, minFreqReport):
+	return "ALEmodel=%s;recordEvTypes=%s;minFreqReport=%s"%(ALEmodel, recordEvTypes, repr(minFreqReport))
+
+def loadParseEventsManifest(nfmanifest):
+	"""load the manifest of reconciliation files already parsed into gene lineage event tables
+	
+	the manifest is a tab-delimited file with fields: (rec_file, fingerprint, params, lineage_table); 
+	returns a dict {rec_file:(fingerprint, params, lineage_table)}, where the last record of a file prevails.
+	"""
+	dmanifest = {}
+	if os.path.exists(nfmanifest):
+		with open(nfmanifest, 'r') as fmanifest:
+			for line in fmanifest:
+				if line.startswith('#') or not line.endswith('\n'): continue # header or line truncated by an interrupted run
+				lsp = line.rstrip('\n').split('\t')
+				if len(lsp)!=4: continue
+				dmanifest[lsp[0]] = tuple(lsp[1:])
+	return dmanifest
+
+def readEventLineageTable(nfTableEvents):
+	"""read back the event counts by gene lineage from a table written by parseRec(), in the same format as its 'devtlineagecount' output"""
+	devtlineagecount = {}
+	with open(nfTableEvents, 'r') as fTable:
+		for line in fTable:
+			lsp = line.rstrip('\n').split('\t')
+			# events are either encoded as species tree event ids or as tuples (X, [don, ]rec)
+			evtup = int(lsp[1]) if len(lsp)==3 else tuple(lsp[1:-1])
+			devtlineagecount.setdefault(lsp[0], {})[evtup] = int(lsp[-1])
+	return devtlineagecount
+
 def parse_events(lnfrec, genefamlist=None, refspetree=None, ALEmodel='undated', \
                  drefspeeventTup2Ids={}, recordEvTypes='ODTS', minFreqReport=0, \
-                 nfpickleEventsOut=None, nfshelveEventsOut=None, dirTableOut=None, nbthreads=1):
-	"""from list of reconciliation files, families and genes to consider, return dictionary of reported events, by family and gene lineage"""
+                 nfpickleEventsOut=None, nfshelveEventsOut=None, dirTableOut=None, nbthreads=1, resume=True):
+	"""from list of reconciliation files, families and genes to consider, return dictionary of reported events, by family and gene lineage
+	
+	When writing gene lineage event tables (dirTableOut), completed families are recorded in the manifest file
+	'parse_events.manifest' of the output folder, together with the fingerprint (size and mtime) of their reconciliation file
+	and the parsing parameters. Unless resume is False, a subsequent run skips reconciliation files with a matching record
+	whose table exists, so that an interrupted run resumes where it stopped, and only new or changed families are parsed.
+	"""
 	lfams = [os.path.basename(nfrec).split('-')[0] for nfrec in lnfrec]
 	if genefamlist: ingenes = [genefam.get('replaced_cds_code', genefam['cds_code']) for genefam in genefamlist if (genefam['gene_family_id'] in lfams)]
 	else: ingenes=[]
@@ -377,7 +521,31 @@ def parse_events(lnfrec, genefamlist=None, refspetree=None, ALEmodel='undated',
 		#~ return parseRec(nfrec, refspetree, drefspeeventTup2Ids, onlyLineages=ingenes, recordEvTypes=recordEvTypes, minFreqReport=minFreqReport, \
 						#~ lineageTableOutDir=(os.path.join(dirTableOut, 'gene_tree_lineages') if dirTableOut else None))
 	diroutab = (os.path.join(dirTableOut, 'gene_tree_lineages') if dirTableOut else None)
-	returndict = bool(nfpickleEventsOut)
+	returndict = bool(nfpickleEventsOut or nfshelveEventsOut)
+	
+	# check which reconciliation files were already parsed
+	dfingerprints = {}
+	ldonerec = []
+	fmanifest = None
+	if diroutab:
+		params = parseEventsParamString(ALEmodel, recordEvTypes, minFreqReport)
+		nfmanifest = os.path.join(diroutab, 'parse_events.manifest')
+		dmanifest = loadParseEventsManifest(nfmanifest) if resume else {}
+		ltodorec = []
+		for nfrec in lnfrec:
+			dfingerprints[nfrec] = recFileFingerprint(nfrec)
+			manifestrec = dmanifest.get(nfrec)
+			if manifestrec and manifestrec[:2]==(dfingerprints[nfrec], params) and os.path.exists(manifestrec[2]):
+				ldonerec.append((nfrec, manifestrec[2]))
+			else:
+				ltodorec.append(nfrec)
+		if ldonerec:
+			print "resume: skip %d reconciliation files already parsed according to manifest '%s'; %d left to parse"%(len(ldonerec), nfmanifest, len(ltodorec))
+		lnfrec = ltodorec
+		newmanifest = not (resume and os.path.exists(nfmanifest))
+		fmanifest = open(nfmanifest, 'w' if newmanifest else 'a')
+		if newmanifest: fmanifest.write('\t'.join(['#rec_file', 'fingerprint', 'params', 'lineage_table'])+'\n')
+	
 	iterargs = ((nfrec, refspetree, ALEmodel, drefspeeventTup2Ids, ingenes, recordEvTypes, minFreqReport, returndict, diroutab) for nfrec in lnfrec)
 	
 	# prepare output
@@ -395,10 +563,23 @@ def parse_events(lnfrec, genefamlist=None, refspetree=None, ALEmodel='undated',
 		# an iterator is returned by imap(); one needs to actually iterate over it to have the pool of parrallel workers to compute
 		ildevents = pool.imap_unordered(parseRecTupArgs, iterargs)
 	
+	if returndict:
+		# events of families parsed in a previous run are read back from their tables
+		for nfrec, nfTableEvents in ldonerec:
+			fam = os.path.basename(nfrec).split('-')[0]
+			dfamevents[fam] = readEventLineageTable(nfTableEvents)
+	
 	for deventfam in ildevents:
 		fam = os.path.basename(deventfam['nfrec']).split('-')[0]
 		devent = deventfam.get('devtlineagecount')
-		dfamevents[fam] = devent
+		if returndict: dfamevents[fam] = devent
+		if fmanifest:
+			# record completion of this family, so to skip it if the run is resumed
+			nfrec = deventfam['nfrec']
+			fmanifest.write('\t'.join([nfrec, dfingerprints[nfrec], params, deventfam['lineageTable']])+'\n')
+			fmanifest.flush()
+	
+	if fmanifest: fmanifest.close()
 	
 	if nfshelveEventsOut:
 		print "saved 'dfamevents' to file '%s'"%nfpickleEventsOut
@@ -416,7 +597,7 @@ def main():
 	                                                'genefams=', 'dir_constraints=', 'dir_replaced=', \
 	                                                'populations=', 'reftree=', \
 	                                                'evtype=', 'minfreq=', \
-	                                                'dir_table_out=', 'events_to_pickle=', 'events_to_shelve=', \
+	                                                'dir_table_out=', 'events_to_pickle=', 'events_to_shelve=', 'restart', \
 	                                                'threads=', 'help', 'verbose']) #, 'reuse=', 'max.recursion.limit=', 'logfile='
 	dopt = dict(opts)
 	
@@ -450,6 +631,7 @@ def main():
 	minFreqReport = float(dopt.get('--minfreq', 0))
 	
 	# runtime params
+	resume = not ('--restart' in dopt)
 	nbthreads = int(dopt.get('--threads', dopt.get('-T', -1)))
 	if nbthreads < 1: nbthreads = mp.cpu_count()
 	verbose = ('-v' in dopt) or ('--verbose' in dopt)
@@ -471,7 +653,7 @@ def main():
 	drefspeeventTup2Ids, drefspeeventId2Tups = generateEventRefDB(refspetree, ALEmodel, refTreeTableOutDir=(os.path.join(dirTableOut, 'ref_species_tree') if dirTableOut else None))
 	
 	dfamevents = parse_events(lnfrec, genefamlist, refspetree, ALEmodel, drefspeeventTup2Ids, recordEvTypes, minFreqReport, \
-								  nfpickleEventsOut, nfshelveEventsOut, dirTableOut, nbthreads)
+								  nfpickleEventsOut, nfshelveEventsOut, dirTableOut, nbthreads, resume=resume)
 
 
 def usage():
@@ -483,6 +665,8 @@ def usage():
 	s += "\t\t--genefams\ttabulated file with header containing at least those two fields: 'cds_code', 'gene_family_id'\n"
 	s += "\t\t\t\trows indicate the genes to be treated in the search, and to which gene family they belong\n"
 	s += "\t\t\t\t(and hence in which reconciliation file to find them).\n"
+	s += "\t\t--restart\tparse all reconciliation files, ignoring the manifest of families already parsed into tables\n"
+	s += "\t\t\t\tin '--dir_table_out' folder (by default, only new or changed reconciliation files are parsed).\n"
 	return s
 
 ################## Main execution
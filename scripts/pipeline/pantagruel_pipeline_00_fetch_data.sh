@@ -286,4 +286,4 @@ mkdir -p ${genomeinfo}/assembly_metadata
 ## extract assembly/sample metadata from flat files
 python ${ptgscripts}/extract_metadata_from_gbff.py --assembly_folder_list=${genomeinfo}/assemblies_list --add_raw_metadata=${manuin}/manual_metadata_dictionary.tab \
 --add_curated_metadata=${manuin}/manual_curated_metadata_dictionary.tab --add_dbxref=${manuin}/manual_dbxrefs.tab --add_assembly_info_dir=${indata}/assembly_stats \
---default_species_name="unclassified organism" --output=${genomeinfo}/assembly_metadata
+--default_species_name="unclassified organism" --output=${genomeinfo}/assembly_metadata --threads=$(nproc)
@@ -50,7 +50,7 @@ python ${ptgscripts}/remove_identical_seqs.py ${allfaarad}.nrprotids.faa ${allfa
 
 ## collect data from assemblies, including matching of (nr) protein to CDS sequence ids
 python ${ptgscripts}/allgenome_gff2db.py --assemb_list ${genomeinfo}/assemblies_list --dirout ${genomeinfo}/assembly_info \
- --ncbi_taxonomy ${ncbitax} --identical_prots ${allfaarad}.identicals.list
+ --ncbi_taxonomy ${ncbitax} --identical_prots ${allfaarad}.identicals.list --threads 8
 
 ## check consistency of non-redundant protein sets
 mkdir -p $ptgtmp
@@ -90,9 +90,10 @@ mmseqsclout=${families}/$(basename ${allfaarad}.nr).mmseqs_clusterdb_default
 mmseqs cluster ${allfaarad}.nr.mmseqsdb $mmseqsclout $mmseqstmp &> $mmseqslogs/$(basename $mmseqsclout).log
 # generate indexed fasta file listing all protein families
 mmseqs createseqfiledb ${allfaarad}.nr.mmseqsdb $mmseqsclout ${mmseqsclout}_clusters
-# generate separate fasta files with family identifiers distinc from representative sequence name
-python ${ptgscripts}/split_mmseqs_clustdb_fasta.py ${mmseqsclout}_clusters "${famprefix}P" ${mmseqsclout}_clusters_fasta 6 1 0
+# generate family fasta sequences with family identifiers distinc from representative sequence name
+# stored in a single indexed file ${mmseqsclout}_clusters_fasta.fasta (see famseqstore.py) rather than in separate files
+python ${ptgscripts}/split_mmseqs_clustdb_fasta.py ${mmseqsclout}_clusters "${famprefix}P" ${mmseqsclout}_clusters_fasta 6 1 0 1
 promptdate "-- $(wc -l ${mmseqsclout}_clusters_fasta.tab | cut -d' ' -f1) non-redundant proteins"
-promptdate "-- classified into $(ls ${mmseqsclout}_clusters_fasta/ | wc -l) clusters"
-echo "${datepad}-- including artificial cluster ${famprefix}P000000 gathering $(grep -c '>' ${mmseqsclout}_clusters_fasta/${famprefix}P000000.fasta) ORFan nr proteins"
+promptdate "-- classified into $(wc -l ${mmseqsclout}_clusters_fasta.fasta.idx | cut -d' ' -f1) clusters"
+echo "${datepad}-- including artificial cluster ${famprefix}P000000 gathering $(python ${ptgscripts}/famseqstore.py --store=${mmseqsclout}_clusters_fasta.fasta --fetch=${famprefix}P000000 | grep -c '>') ORFan nr proteins"
 echo "${datepad}-- (NB: some are not true ORFans as can be be present as identical sequences in several genomes)"
@@ -25,7 +25,11 @@ export protali=${ptgdb}/02.gene_alignments
 ## prepare protein families for alignment
 mkdir -p ${nrprotali}/ ${ptglogs}/clustalo/
 tasklist=$protali/$(basename ${protfamseqs})_tasklist
-python ${ptgscripts}/schedule_ali_task.py ${protfamseqs}.tab ${protfamseqs} ${tasklist} 1 "${famprefix}P000000"
+# order tasks by decreasing estimated cost; the cost model is fitted on the run times of a previous run if any
+if [ -s ${ptglogs}/run_clustalo_sequential.log ] ; then
+  runtimelog="--runtime_log=${ptglogs}/run_clustalo_sequential.log"
+fi
+python ${ptgscripts}/schedule_ali_task.py ${protfamseqs}.tab ${protfamseqs} ${tasklist} 1 "${famprefix}P000000" ${runtimelog}
 
 ## align non-redundant protein families
 run_clustalo_sequential () {
@@ -34,7 +38,13 @@ run_clustalo_sequential () {
   fout=${bn/fasta/aln}
   echo "task: $task" &> ${ptglogs}/clustalo/${bn}.clustalo.log
   date +"%d/%m/%Y %H:%M:%S" &> ${ptglogs}/clustalo/${bn}.clustalo.log
-  clustalo --threads=1 -i ${task} -o ${nrprotali}/${fout} &> ${ptglogs}/clustalo/${bn}.clustalo.log
+  if [ -e ${protfamseqs}.fasta.idx ] ; then
+    # family sequences are read from the indexed store (looked up by binary search in its sorted index) and piped to clustalo;
+    # errors of both commands go to the clustalo log
+    { python ${ptgscripts}/famseqstore.py --store=${protfamseqs}.fasta --fetch=${bn%.fasta} | clustalo --threads=1 -i - -o ${nrprotali}/${fout} ; } &> ${ptglogs}/clustalo/${bn}.clustalo.log
+  else
+    clustalo --threads=1 -i ${task} -o ${nrprotali}/${fout} &> ${ptglogs}/clustalo/${bn}.clustalo.log
+  fi
   date +"%d/%m/%Y %H:%M:%S" &> ${ptglogs}/clustalo/${bn}.clustalo.log
 }
 export -f run_clustalo_sequential
@@ -61,7 +71,15 @@ for cg in `cat ${genomeinfo}/assemblies_list` ; do ls $cg/*_cds_from_genomic.fna
 
 # generate (full protein alignment, unaligned CDS fasta) file pairs and reverse-translate alignments to get CDS (gene family) alignments
 mkdir -p ${ptglogs}/extract_full_prot_and_cds_family_alignments/
-python ${ptgscripts}/extract_full_prot_and_cds_family_alignments.py --nrprot_fam_alns ${nrprotali} --singletons ${protfamseqs}/${protorfanclust}.fasta \
+if [ -e ${protfamseqs}.fasta.idx ] ; then
+  # export the ORFan family sequences from the indexed store
+  mkdir -p ${ptgtmp}
+  python ${ptgscripts}/famseqstore.py --store=${protfamseqs}.fasta --export=${protorfanclust} --dirout=${ptgtmp}
+  protorfanseqs=${ptgtmp}/${protorfanclust}.fasta
+else
+  protorfanseqs=${protfamseqs}/${protorfanclust}.fasta
+fi
+python ${ptgscripts}/extract_full_prot_and_cds_family_alignments.py --nrprot_fam_alns ${nrprotali} --singletons ${protorfanseqs} \
  --prot_info ${genomeinfo}/assembly_info/allproteins_info.tab --repli_info ${genomeinfo}/assembly_info/allreplicons_info.tab --assemblies ${assemblies} \
  --dirout ${protali} --famprefix ${famprefix} --logs ${ptglogs}/extract_full_prot_and_cds_family_alignments --identical_prots ${allfaarad}.identicals.list
 
@@ -40,8 +40,9 @@ fi
 qsubvars="tasklist=$tasklist,outputdir=$mlgenetrees,reducedaln=true,nbthreads=${ncpus}"
 Njob=`wc -l ${tasklist} | cut -f1 -d' '`
 # accomodate with possible upper limit on number of tasks in an array job; assume chunks of 3000 tasks are fine
+# tasks are reordered so that array jobs have balanced estimated costs, with longest tasks first
 chunksize=3000
-jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob))
+jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob ${tasklist} raxml))
 for jobrange in ${jobranges[@]} ; do
 echo "jobrange=$jobrange"
 qsub -J $jobrange -l walltime=${wt}:00:00 -l select=1:ncpus=${ncpus}:mem=${mem}gb -N raxml_gene_trees_$(basename $cdsfam2phylo) -o ${ptglogs}/raxml/gene_trees -j oe -v "$qsubvars" ${ptgscripts}/raxml_array_PBS.qsub
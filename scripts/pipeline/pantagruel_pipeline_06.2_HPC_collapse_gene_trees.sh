@@ -65,11 +65,13 @@ else
   # accomodate with possible upper limit on number of tasks in an array job; assume chunks of 3000 tasks are fine
   Njob=`wc -l ${mlgenetreelist} | cut -f1 -d' '`
   chunksize=3000
-  jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob))
+  # gene trees are reordered so that jobs have balanced estimated costs
+  jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob ${mlgenetreelist} treechain))
 
   for jobrange in ${jobranges[@]} ; do
   beg=`echo $jobrange | cut -d'-' -f1`
-  tail -n +${beg} ${mlgenetreelist} | head -n ${chunksize} > ${mlgenetreelist}_${jobrange}
+  end=`echo $jobrange | cut -d'-' -f2`
+  sed -n "${beg},${end}p" ${mlgenetreelist} > ${mlgenetreelist}_${jobrange}
   qsub -N mark_unresolved_clades -l select=1:ncpus=${ncpus}:mem=${mem},walltime=${wth}:00:00 -o ${ptglogs}/mark_unresolved_clades.${collapsecond}_${jobrange}.log -j oe -V -S /usr/bin/bash << EOF
   module load python
   python ${ptgscripts}/mark_unresolved_clades.py --in_gene_tree_list=${mlgenetreelist}_${jobrange} --diraln=${cdsalifastacodedir} --fmt_aln_in='fasta' \
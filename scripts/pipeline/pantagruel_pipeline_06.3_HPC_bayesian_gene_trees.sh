@@ -44,7 +44,8 @@ fi
 
 Njob=`wc -l ${tasklist} | cut -f1 -d' '`
 chunksize=1000
-jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob))
+# tasks are reordered so that array jobs have balanced estimated costs, with longest tasks first
+jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob ${tasklist} mrbayes))
 qsubvar="mbversion=3.2.6, tasklist=${tasklist}, outputdir=${mboutputdir}, mbmcmcpopt='Nruns=${nruns} Ngen=2000000 Nchains=${nchains}'"
 for jobrange in ${jobranges[@]} ; do
  echo $jobrange $qsubvar
@@ -91,11 +91,12 @@ else
   # divide run in small chunks o be run in different jobs
   chunksize=100
   Njob=`wc -l ${tasklist} | cut -f1 -d' '`
-  jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob))
+  # tree samples are reordered so that jobs have balanced estimated costs
+  jobranges=($(${ptgscripts}/get_jobranges.py $chunksize $Njob ${tasklist} treechain))
   rm -f ${tasklist}_${dtag}_taskchunks
   for jobrange in ${jobranges[@]} ; do
     replrun="${dtag}_${jobrange}"
-    tail -n +$(echo $jobrange | cut -d'-' -f1) ${tasklist} | head -n ${chunksize} > ${tasklist}_${replrun}
+    sed -n "$(echo $jobrange | cut -d'-' -f1),$(echo $jobrange | cut -d'-' -f2)p" ${tasklist} > ${tasklist}_${replrun}
     echo ${tasklist}_${replrun} >> ${tasklist}_${dtag}_taskchunks
   done
   Nchunk=`wc -l ${tasklist}_${dtag}_taskchunks | cut -f1 -d' '`
@@ -50,6 +50,8 @@ ${ptgscripts}/lsfullpath.py "${outrecdir}/ale_collapsed_${rectype}/*ml_rec" > $r
 ## and look for correlated transfer events across gene families
 
 # PBS-submitted parallel job
+# parsing is resumable: families already parsed (as recorded in ${parsedrecs}/gene_tree_lineages/parse_events.manifest)
+# are skipped, so re-submitting the job after it hit walltime continues where it stopped
 parsecollogd=${ptgdb}/logs/parsecol
 parsecollogs=${parsecollogd}/parse_collapsedALE_scenarios.og
 
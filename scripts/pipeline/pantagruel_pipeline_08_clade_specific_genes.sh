@@ -9,10 +9,16 @@
 
 # Copyright: Florent Lassalle (f.lassalle@imperial.ac.uk), 30 July 2018
 
-if [ -z "$1" ] ; then echo "missing mandatory parameter: pantagruel config file" ; echo "Usage: $0 ptg_env_file" ; exit 1 ; fi
+if [ -z "$1" ] ; then echo "missing mandatory parameter: pantagruel config file" ; echo "Usage: $0 ptg_env_file [ncpus=$(nproc)]" ; exit 1 ; fi
 envsourcescript="$1"
 source ${envsourcescript}
 
+if [ ! -z "$2" ] ; then
+  ncpus="$2"
+else
+  ncpus=$(nproc)
+fi
+
 checkfoldersafe ${orthogenes}
 
 ###############################################
@@ -23,7 +29,8 @@ cd ${ptgrepo} ; export ptgversion=$(git log | grep commit | cut -d' ' -f2) ; cd
 
 # classify genes into orthologous groups for each gene of the reconciled gene tree sample
 # do not report detailed results but, using gptgh analysis, combine the sample-wide classification into one classification for the gene family
-# run in parallel
+# run in parallel on the local node, with the largest families (leaves x sampled trees) processed first;
+# the status of each family is recorded in ${orthogenes}/${orthocol}/orthologs_task_manifest.tab
 
 ## for the moment only coded for dated ALE model (ALEml reconciliations)
 ## and with no colpased gene tree clades (need to discard events below replacement clade subtree roots [as in parse_collapsedALE_scenarios.py]
@@ -44,7 +51,7 @@ fi
 # generate Ortholog Collection
 orthocol=ortholog_collection_${orthoColId}
 mkdir -p ${orthogenes}/${orthocol}
-${ptgscripts}/get_orthologues_from_ALE_recs.py -i ${outrecdir} -o ${orthogenes}/${orthocol} ${getOrpthologuesOptions} &> $ptglogs/get_orthologues_from_ALE_recs_${orthocol}.log
+${ptgscripts}/get_orthologues_from_ALE_recs.py -i ${outrecdir} -o ${orthogenes}/${orthocol} ${getOrpthologuesOptions} --threads=${ncpus} &> $ptglogs/get_orthologues_from_ALE_recs_${orthocol}.log
 
 # import ortholog classification into database
 sqlite3 ${sqldb} """INSERT INTO ortholog_collections (ortholog_col_id, ortholog_col_name, reconciliation_id, software, version, algorithm, ortholog_col_date, notes) VALUES 
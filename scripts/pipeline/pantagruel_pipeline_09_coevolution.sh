@@ -49,12 +49,11 @@ if [ ! -z maxreftreeheight ]
    WHERE branch_name NOT IN ('${exclbr}') )
    AND reconciliation_id=${parsedreccolid}
   ;
-  CREATE INDEX ON gene_lineage_events (replacement_label_or_cds_code);
-  CREATE INDEX ON gene_lineage_events USING HASH (replacement_label_or_cds_code);
+  CREATE INDEX ON gene_lineage_events (rlocds_id, event_id);
   CREATE INDEX ON gene_lineage_events (event_id);
   CREATE INDEX ON gene_lineage_events USING HASH (event_id);
   CREATE INDEX ON gene_lineage_events (freq);
-  ALTER TABLE gene_lineage_events ADD PRIMARY KEY (replacement_label_or_cds_code, event_id);
+  ALTER TABLE gene_lineage_events ADD PRIMARY KEY (rlocds_id, event_id);
   ANALYZE;
   .quit
 EOF
@@ -65,10 +64,11 @@ fi
 # collect data
 # BEWARE: GENERATES AN AWFUL LOT OF DATA, PREPARE DISK SPACE ACCORDINGLY
 # indication: with defaults settings evtypeparse='ST'; minevfreqmatch=0.5; minjoinevfreqmatch=1.0; maxreftreeheight=0.25
-# on a 880 Enterobacteriaceae dataset, results in ~300 GB output (made to be split into ~1GB files)
+# on a 880 Enterobacteriaceae dataset, results in ~300 GB output when written as text tables (made to be split into ~1GB files);
+# scores are thus written in a compact columnar binary file instead ('--table_format bin'), read directly by the DB loaders
 python $ptgscripts/compare_collapsedALE_scenarios.py --events_from_postgresql_db ${sqldbname} \
  --event_type ${evtypeparse} --min_freq ${minevfreqmatch} --min_joint_freq ${minjointevfreqmatch} --threads 8 \
- --dir_table_out ${compoutdir} &> $entlogs/compare_collapsedALE_scenarios.${parsedreccol}.log &
+ --dir_table_out ${compoutdir} --table_format bin &> $entlogs/compare_collapsedALE_scenarios.${parsedreccol}.log &
 
 #### NOT IMPLEMENTED YET IN SQLite
 # load data in database, adding mention of reconciliation_id to ensure events are not matched across collections
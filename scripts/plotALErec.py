@@ -9,14 +9,14 @@ def main(nfrec, reftreelen=None, maxrecgt=1, sgsep='_', restrictclade=None):
 	spetree, subspetree, lrecgt, recgtlines, restrictlabs, dnodeevt = parseALERecFile(nfrec, reftreelen=reftreelen, restrictclade=restrictclade)
 	dnodefreq = dict([(node.label(), float(dnodeevt[node.label()][-1])) for node in spetree])
 	nsample = len(lrecgt)
-	recgtsample = ''.join(recgtlines)
+	recgtsampleindex = RecSampleEventIndex(recgtlines)
 	# parse reconciled gene trees
 	# and extract (exact) event-wise event frequency
 	dexactevt = {}
 	for i in range(min(len(lrecgt), maxrecgt)):
 		recgt = lrecgt[i]
 		# gather scenario-scpecific events
-		dlevt, dnodeallevt = parseRecGeneTree(recgt, spetree, dexactevt, recgtsample, nsample, sgsep=sgsep, restrictlabs=restrictlabs)
+		dlevt, dnodeallevt = parseRecGeneTree(recgt, spetree, dexactevt=dexactevt, recgtsampleindex=recgtsampleindex, nsample=nsample, sgsep=sgsep, restrictlabs=restrictlabs)
 		# gather copy number
 		dcopynum = {}
 		for leaflab in recgt.get_leaf_labels():
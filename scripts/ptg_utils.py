@@ -7,8 +7,9 @@ from BCBio import GFF
 from Bio.Alphabet import generic_dna
 from Bio.Phylo import BaseTree, NewickIO, NexusIO, _io as PhyloIO
 from StringIO import StringIO
-from random import randint
-import gzip
+from random import randint, Random
+import gzip, math
+from bisect import bisect_left
 
 supported_formats = {'newick': NewickIO, 'nexus': NexusIO}
 
@@ -63,12 +64,16 @@ def quantile(seq, P, ignoreNull=True):
 	
 	assumes a continuity of the distribution as following a function linear by segment to approximate quantiles
 	"""
+	l = [k for k in seq if ((k is not None) or (not ignoreNull))]
+	if not l: return None
+	l.sort()
+	return quantileFromSorted(l, P)
+
+def quantileFromSorted(l, P):
+	"""same as quantile(), for a non-empty list of values already sorted"""
 	Q = []
+	L = float(len(l))
 	for p in P:
-		l = [k for k in seq if ((k is not None) or (not ignoreNull))]
-		l.sort()
-		L = float(len(l))
-		if not l: return None
 		rankq = (L - 1)*p
 		irankq = int(rankq)
 		drankq = rankq - irankq
@@ -79,6 +84,114 @@ def quantile(seq, P, ignoreNull=True):
 		Q.append(q)
 	return tuple(Q)
 
+class QuantileSketch(object):
+	"""mergeable streaming summary of a distribution of values: count, mean, extremes and quantiles
+	
+	values are kept while their number does not exceed exactsize, so that quantiles are exactly those given by quantile();
+	beyond, they are summarized by a KLL sketch (Karnin, Lang & Liberty 2016) whose compactors hold ~3k values in total,
+	giving quantiles with a rank error of ~1/k whatever the number of values. extremes (quantiles 0 and 1) are always exact.
+	sketches of subsets of values (e.g. computed in separate processes) can be merged.
+	"""
+	def __init__(self, k=200, exactsize=10000, seed=0):
+		self.k = k
+		self.exactsize = exactsize
+		self.n = 0
+		self.total = 0.0
+		self.min = None
+		self.max = None
+		# list of values while exact, then list of KLL compactors (values at level h weigh 2**h)
+		self.exact = []
+		self.compactors = None
+		self.seed = seed
+		# only needed once values are compacted
+		self.rng = None
+	
+	def __len__(self):
+		return self.n
+	
+	def update(self, values, ignoreNull=True):
+		l = [float(k) for k in values if ((k is not None) or (not ignoreNull))]
+		if not l: return
+		self.n += len(l)
+		self.total += sum(l)
+		lmin = min(l) ; lmax = max(l)
+		if self.min is None or lmin < self.min: self.min = lmin
+		if self.max is None or lmax > self.max: self.max = lmax
+		if self.compactors is None:
+			self.exact += l
+			if len(self.exact) > self.exactsize:
+				self._toSketch()
+		else:
+			self.compactors[0] += l
+			self._compress()
+	
+	def add(self, value):
+		self.update([value])
+	
+	def merge(self, other):
+		"""add the values summarized by another sketch to this one"""
+		if not other.n: return
+		self.n += other.n
+		self.total += other.total
+		if self.min is None or other.min < self.min: self.min = other.min
+		if self.max is None or other.max > self.max: self.max = other.max
+		if other.compactors is None and self.compactors is None:
+			self.exact += other.exact
+			if len(self.exact) > self.exactsize:
+				self._toSketch()
+			return
+		if self.compactors is None:
+			self._toSketch()
+		for h, compactor in enumerate(other.compactors if other.compactors is not None else [other.exact]):
+			if h==len(self.compactors): self.compactors.append([])
+			self.compactors[h] += compactor
+		self._compress()
+	
+	def _toSketch(self):
+		if self.rng is None: self.rng = Random(self.seed)
+		self.compactors = [self.exact]
+		self.exact = None
+		self._compress()
+	
+	def _capacity(self, h):
+		return max(2, int(math.ceil(self.k*((2.0/3)**(len(self.compactors)-1-h)))))
+	
+	def _compress(self):
+		while sum([len(c) for c in self.compactors]) > sum([self._capacity(h) for h in range(len(self.compactors))]):
+			for h, compactor in enumerate(self.compactors):
+				if len(compactor) >= self._capacity(h):
+					if h+1==len(self.compactors): self.compactors.append([])
+					compactor.sort()
+					# an odd value out stays at this level; one of each pair of consecutive values is promoted with double weight
+					keep = [compactor.pop()] if len(compactor)%2 else []
+					self.compactors[h+1] += compactor[self.rng.randint(0, 1)::2]
+					self.compactors[h] = keep
+					break
+	
+	def mean(self):
+		if not self.n: return None
+		return self.total/self.n
+	
+	def quantile(self, P):
+		"""values of quantiles at break probabilities P (as by quantile() while exact)"""
+		if not self.n: return None
+		if self.compactors is None:
+			return quantileFromSorted(sorted(self.exact), P)
+		lvw = sorted([(v, 2**h) for h, compactor in enumerate(self.compactors) for v in compactor])
+		cumw = []
+		W = 0
+		for v, w in lvw:
+			W += w
+			cumw.append(W)
+		Q = []
+		for p in P:
+			if p <= 0: Q.append(self.min)
+			elif p >= 1: Q.append(self.max)
+			else:
+				i = bisect_left(cumw, p*W)
+				Q.append(lvw[min(i, len(lvw)-1)][0])
+		return tuple(Q)
+
 def var(seq, correct=1):
 	m = mean(seq)
 	if m is None: return None
@@ -1,12 +1,15 @@
 #!/usr/bin/python
 
 import sys, os
+import famseqstore, task_scheduler
 
 nffamtab = sys.argv[1]
 dirfamfasta = sys.argv[2]
 nfoutalitasklit = sys.argv[3]
 nparalleltasks = int(sys.argv[4])
-excludefams = sys.argv[5:]	# ORFan families
+# ORFan families; an optional '--runtime_log=path' argument points to the run times of past alignment tasks (GNU parallel job log)
+excludefams = [arg for arg in sys.argv[5:] if not arg.startswith('--runtime_log=')]
+nfruntimes = ([None]+[arg.split('=', 1)[1] for arg in sys.argv[5:] if arg.startswith('--runtime_log=')])[-1]
 fastaext = '.fasta'
 
 # 2 nr sequences can translte into many sequqnces in whole genome db, so must have sequqnces aligned
@@ -20,32 +23,34 @@ with open(nffamtab, 'r') as ffamtab:
 		dfamsize[lsp[0]] = dfamsize.get(lsp[0], 0) + 1
 
 famsizesummary = open("%s.sizes"%nffamtab, 'w')
-# order families by size
-dsizefam = {}
 for fam in dfamsize:
-	s = dfamsize[fam]
-	famsizesummary.write("%s\t%d\n"%(fam, s))
+	famsizesummary.write("%s\t%d\n"%(fam, dfamsize[fam]))
+famsizesummary.close()
+
+# estimate the alignment cost of families from their number of sequences and mean sequence length
+# (approximated from the size of the family fasta record, stored in a family sequence store or in separate files)
+if famseqstore.isStore(dirfamfasta+fastaext):
+	famstore = famseqstore.FamilySeqStore(dirfamfasta+fastaext)
+	famrecordlen = lambda fam: famstore.lookup(fam)[1] if fam in famstore else 0
+elif os.path.isdir(dirfamfasta):
+	famrecordlen = lambda fam: os.path.getsize("%s/%s%s"%(dirfamfasta, fam, fastaext)) if os.path.exists("%s/%s%s"%(dirfamfasta, fam, fastaext)) else 0
+else:
+	famrecordlen = lambda fam: 0
+dsizes = {}
+for fam, s in dfamsize.iteritems():
 	if fam in excludefams or s<minseq2ali: continue
-	dsizefam.setdefault(s, []).append(fam)
+	dsizes["%s/%s%s"%(dirfamfasta, fam, fastaext)] = (s, max(1, famrecordlen(fam)/s))
 
-famsizesummary.close()
-	
-famsizes = dsizefam.keys()
-famsizes.sort(reverse=True)
+druntimes = task_scheduler.readRunTimes(nfruntimes) if (nfruntimes and os.path.exists(nfruntimes)) else None
+dcosts = task_scheduler.estimateCosts(dsizes, model='clustalo', druntimes=druntimes, verbose=True)
 
-dtaskout = {}
+# distribute task among task lists for similar-load parallel execution
+# (longest-processing-time-first: within each list, tasks are ordered by decreasing cost)
+bins, loads = task_scheduler.lptSchedule(dcosts, nparalleltasks)
 if nparalleltasks > 1:
 	for t in range(nparalleltasks):
-		dtaskout[t] = open("%s.%d"%(nfoutalitasklit, t), 'w')
+		with open("%s.%d"%(nfoutalitasklit, t), 'w') as ftaskout:
+			ftaskout.writelines(["%s\n"%task for task in bins[t]])
 else:
-	dtaskout[0] = open(nfoutalitasklit, 'w')
-
-# distribute task among task lists for similar-load parallel execution
-n = 0
-for famsize in famsizes:
-	for fam in dsizefam[famsize]:
-		dtaskout[n].write("%s/%s%s\n"%(dirfamfasta, fam, fastaext))
-		n = (n + 1)%nparalleltasks
-
-for t in dtaskout:
-	dtaskout[t].close()
+	with open(nfoutalitasklit, 'w') as ftaskout:
+		ftaskout.writelines(["%s\n"%task for task in bins[0]])
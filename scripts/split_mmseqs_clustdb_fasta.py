@@ -1,70 +1,132 @@
 #!/usr/bin/python
-import sys, os
-nfin = sys.argv[1]
-famprefix = sys.argv[2]
-dirout = sys.argv[3]
-padlen = int(sys.argv[4])
-if len(sys.argv)>5: 
-	writeseq = bool(int(sys.argv[5]))
-else:
-	writeseq = True
-if len(sys.argv)>6: 
-	discardsingle = bool(int(sys.argv[6]))
-else:
-	discardsingle = False
-	
-lvar = []
-for var in ['nfin', 'famprefix', 'dirout', 'padlen', 'writeseq', 'discardsingle']:
-	lvar.append("%s = %s"%(var, repr(eval(var))))
-print ' ; '.join(lvar)
-
-if writeseq:
-	if not os.path.exists(dirout):
-		os.mkdir(dirout)
-	else:
-		raise IOError, "ouput directory '%s' already exists"%dirout
-	
-
-def idfam(nfam=-1, famprefix=famprefix, padlen=padlen):
-	nfam += 1
-	return (famprefix+str(nfam).zfill(padlen), nfam)
-	
-idfam0, nfam0 = idfam()
-if writeseq: fout0 = open("%s/%s.fasta"%(dirout, idfam0), 'w')	# family with id # PREFIX000000 is reserved for ORFan sequences
-ftabout = open("%s.tab"%dirout, 'w')
-
-def incrementfam(nfam, lseqinfam, seqbuffer):
-	if len(lseqinfam)>1:
-		# generate new id
-		idfamn, nfam = idfam(nfam)
-		if writeseq:
-			# open, fill and close family file
-			with open("%s/%s.fasta"%(dirout, idfamn), 'w') as fout: fout.write(seqbuffer)
-	else:
-		idfamn = idfam0
-		if writeseq:
-			fout0.write(seqbuffer)
-	if not (idfamn==idfam0 and discardsingle):
-		ftabout.writelines(["%s\t%s\n"%(idfamn, seqname) for seqname in lseqinfam])
-	# update/reset
+import sys, os, shutil
+import famseqstore
+
+def idfam(nfam, famprefix, padlen):
+	return famprefix+str(nfam).zfill(padlen)
+
+def iterClustDBFamilies(nfin):
+	"""iterate over the families of a mmseqs clustered sequence db file (output of 'mmseqs createseqfiledb'), which are separated by null characters
+
+	yields tuples (list of sequence names, list of fasta lines)
+	"""
 	lseqinfam = []
-	seqbuffer = ''
-	return (nfam, lseqinfam, seqbuffer)
-
-nfam = 0
-lseqinfam = []
-seqbuffer = ''
-
-with open(nfin, 'r') as fin:
-	for line in fin:
-		if line.startswith('\0'):
-			# write buffer for previous family and reset it
-			nfam, lseqinfam, seqbuffer = incrementfam(nfam, lseqinfam, seqbuffer)
-			l = line.lstrip('\0')
+	lfamlines = []
+	with open(nfin, 'r') as fin:
+		for line in fin:
+			if line.startswith('\0'):
+				if lseqinfam: yield (lseqinfam, lfamlines)
+				lseqinfam = []
+				lfamlines = []
+				line = line.lstrip('\0')
+			if line.startswith('>'):
+				lseqinfam.append(line.split(' ', 1)[0].lstrip('>').rstrip('\n'))
+			if line: lfamlines.append(line)
+	if lseqinfam: yield (lseqinfam, lfamlines)
+
+class FamilyFastaWriter(object):
+	"""write family fasta sequences by batches, either to one file per family in a folder, or to a single indexed container file
+
+	the container is a family sequence store (see famseqstore.FamilySeqStore) made of the concatenated family fasta sequences
+	('dirout.fasta') and of an index file ('dirout.fasta.idx') giving for each family its identifier, and the offset and length
+	(in bytes) of its sequences in the container
+	"""
+	def __init__(self, dirout, container=False, batchsize=100000):
+		self.dirout = dirout
+		self.container = container
+		self.batchsize = batchsize
+		self.batch = []
+		self.batchlen = 0
+		if container:
+			self.store = famseqstore.FamilySeqStore(dirout+'.fasta', mode='w')
+		else:
+			if os.path.exists(dirout): raise IOError, "ouput directory '%s' already exists"%dirout
+			os.mkdir(dirout)
+
+	def add(self, famid, lfamlines):
+		self.batch.append((famid, lfamlines))
+		self.batchlen += len(lfamlines)
+		if self.batchlen >= self.batchsize: self.flush()
+
+	def flush(self):
+		if self.container:
+			self.store.appendmany([(famid, ''.join(lfamlines)) for famid, lfamlines in self.batch])
+		else:
+			for famid, lfamlines in self.batch:
+				with open("%s/%s.fasta"%(self.dirout, famid), 'w') as fout: fout.writelines(lfamlines)
+		self.batch = []
+		self.batchlen = 0
+
+	def addfile(self, famid, nffam):
+		"""add the sequences of a family from a fasta file, without loading it into memory"""
+		self.flush()
+		if self.container:
+			self.store.appendfile(famid, nffam)
 		else:
-			l = line
-		if l.startswith('>'):
-			seqname = l.split(' ', 1)[0].lstrip('>')
-			lseqinfam.append(seqname)
-		seqbuffer += l
-		
+			shutil.copy(nffam, "%s/%s.fasta"%(self.dirout, famid))
+
+	def close(self):
+		self.flush()
+		if self.container:
+			self.store.close()
+
+def split_mmseqs_clustdb_fasta(nfin, famprefix, dirout, padlen, writeseq=True, discardsingle=False, container=False, batchsize=100000):
+	"""split a mmseqs clustered sequence db into families with identifiers made of famprefix followed by a number padded to padlen digits
+
+	the table of sequence membership to families is written to 'dirout.tab'; family sequences are written to
+	separate files in folder dirout or to an indexed container (see FamilyFastaWriter) if writeseq is True.
+	singletons are gathered into the family #0 (e.g. PREFIX000000), which is reserved for ORFan sequences,
+	and are not reported in the table if discardsingle is True.
+	returns the number of families (excluding the ORFan family).
+	"""
+	idfam0 = idfam(0, famprefix, padlen)
+	if writeseq:
+		famwriter = FamilyFastaWriter(dirout, container=container, batchsize=batchsize)
+		# ORFan sequences are streamed to their own file, to be appended to the container at the end
+		nforfan = dirout+'.fasta.orfans' if container else "%s/%s.fasta"%(dirout, idfam0)
+		forfan = open(nforfan, 'w')
+	nfam = 0
+	with open("%s.tab"%dirout, 'w') as ftabout:
+		for lseqinfam, lfamlines in iterClustDBFamilies(nfin):
+			if len(lseqinfam)>1:
+				nfam += 1
+				idfamn = idfam(nfam, famprefix, padlen)
+				if writeseq: famwriter.add(idfamn, lfamlines)
+			else:
+				idfamn = idfam0
+				if writeseq: forfan.writelines(lfamlines)
+				if discardsingle: continue
+			ftabout.writelines(["%s\t%s\n"%(idfamn, seqname) for seqname in lseqinfam])
+	if writeseq:
+		forfan.close()
+		if container:
+			famwriter.addfile(idfam0, nforfan)
+			os.remove(nforfan)
+		famwriter.close()
+	return nfam
+
+def usage():
+	s = "Usage: python %s clustdb_fasta family_prefix output_path padding_length [write_sequences (0|1, default 1)] [discard_singletons (0|1, default 0)] [single_container (0|1, default 0)]\n"%sys.argv[0]
+	s += "  if write_sequences is set, family sequences are written to separate files in folder output_path,\n"
+	s += "  or if single_container is set, to the indexed container output_path.fasta (index: output_path.fasta.idx).\n"
+	return s
+
+if __name__=='__main__':
+
+	if len(sys.argv)<5:
+		print usage()
+		sys.exit(1)
+	nfin = sys.argv[1]
+	famprefix = sys.argv[2]
+	dirout = sys.argv[3]
+	padlen = int(sys.argv[4])
+	writeseq = bool(int(sys.argv[5])) if len(sys.argv)>5 else True
+	discardsingle = bool(int(sys.argv[6])) if len(sys.argv)>6 else False
+	container = bool(int(sys.argv[7])) if len(sys.argv)>7 else False
+
+	lvar = []
+	for var in ['nfin', 'famprefix', 'dirout', 'padlen', 'writeseq', 'discardsingle', 'container']:
+		lvar.append("%s = %s"%(var, repr(locals()[var])))
+	print ' ; '.join(lvar)
+
+	split_mmseqs_clustdb_fasta(nfin, famprefix, dirout, padlen, writeseq=writeseq, discardsingle=discardsingle, container=container)
@@ -0,0 +1,187 @@
+#!/usr/bin/python
+
+"""balanced scheduling of gene family tasks (alignment, tree inference, reconciliation) into parallel task lists or array job ranges
+
+the cost of a task is estimated with a power-law model of the size of its input, cost = c * n^a * L^b,
+with n the number of sequences (or tree leaves) and L the alignment length (or number of sampled trees).
+tasks are then distributed among lists with the longest-processing-time-first (LPT) heuristic:
+tasks are sorted by decreasing cost and each is assigned to the list with the lowest total cost so far.
+"""
+
+import os, sys, getopt, heapq, math, re
+import famseqstore
+
+# default parameters (a, b, c) of cost models, giving the rough scaling of run times with input size;
+# they are better fitted on run times of previous runs (see fitCostModel())
+dcostmodels = {'clustalo':(1.2, 2.0, 1.0), 'raxml':(1.5, 1.0, 1.0), 'mrbayes':(1.0, 1.0, 1.0), \
+               'ale':(2.0, 1.0, 1.0), 'treechain':(1.0, 1.0, 1.0), 'size':(1.0, 0.0, 1.0)}
+# format of task input files for each model
+dmodelfmt = {'clustalo':'fasta', 'raxml':'fasta', 'mrbayes':'nexus', 'ale':'treechain', 'treechain':'treechain', 'size':'fasta'}
+
+renexusdim = re.compile('(ntax|nchar)\s*=\s*([0-9]+)', flags=re.IGNORECASE)
+
+def fastaSize(lines):
+	"""number of sequences and maximum sequence length in fasta lines"""
+	n = 0
+	L = 0
+	l = 0
+	for line in lines:
+		if line.startswith('>'):
+			n += 1
+			L = max(L, l)
+			l = 0
+		else:
+			l += len(line.strip())
+	return (n, max(L, l))
+
+def taskSize(nftask, fmt='fasta'):
+	"""return the size (n, L) of the input file of a task:
+	- fasta (sequences or alignment): number of sequences, maximum sequence length;
+	- nexus (alignment): number of taxa and characters, as declared in the matrix dimensions;
+	- treechain (Newick or Nexus tree sample): number of leaves of the first tree, approximate number of trees.
+	"""
+	with open(nftask, 'r') as ftask:
+		if fmt=='fasta':
+			return fastaSize(ftask)
+		elif fmt=='nexus':
+			ddim = {}
+			for line in ftask:
+				for key, val in renexusdim.findall(line): ddim[key.lower()] = int(val)
+				if line.strip().lower().startswith('matrix') or len(ddim)==2: break
+			if len(ddim)==2: return (ddim['ntax'], ddim['nchar'])
+			else:
+				ftask.seek(0)
+				return fastaSize(ftask)
+		elif fmt=='treechain':
+			for line in ftask:
+				if '(' in line:
+					return (line.count(',')+1, max(1, os.path.getsize(nftask)/len(line)))
+			return (1, 1)
+		else:
+			raise ValueError, "unknown task input format '%s'"%fmt
+
+def costModel(n, L, params):
+	a, b, c = params
+	return c * (float(n)**a) * (float(L)**b)
+
+def readRunTimes(nflog):
+	"""parse run times (in seconds) of past tasks, keyed by family id, from a GNU parallel job log (--joblog option)
+	or from a two-column tab-delimited table (task input file path, run time)
+	"""
+	druntimes = {}
+	with open(nflog, 'r') as flog:
+		header = flog.readline().rstrip('\n').split('\t')
+		if 'JobRuntime' in header:
+			itime = header.index('JobRuntime')
+			icmd = header.index('Command')
+		else:
+			itime, icmd = 1, 0
+			flog.seek(0)
+		for line in flog:
+			lsp = line.rstrip('\n').split('\t')
+			if len(lsp) <= max(itime, icmd) or not lsp[icmd].strip(): continue
+			if len(lsp) > 6 and 'Exitval' in header and lsp[header.index('Exitval')]!='0': continue
+			task = lsp[icmd].split()[-1]
+			druntimes[famseqstore.famidFromFileName(task)] = float(lsp[itime])
+	return druntimes
+
+def fitCostModel(lobs, model='size'):
+	"""fit the parameters (a, b, c) of the cost model to observations [(n, L, run time), ...] by least squares on log scale
+
+	if L does not vary among observations, b is kept to its default value for the model.
+	"""
+	import numpy as np
+	obs = np.array([o for o in lobs if min(o) > 0], dtype=float)
+	if obs.shape[0] < 3: raise ValueError, "not enough observations (%d) to fit a cost model"%obs.shape[0]
+	logn, logL, logt = np.log(obs[:,0]), np.log(obs[:,1]), np.log(obs[:,2])
+	if np.ptp(logL) > 0:
+		X = np.column_stack([logn, logL, np.ones(len(logn))])
+		a, b, logc = np.linalg.lstsq(X, logt, rcond=None)[0]
+	else:
+		b = dcostmodels[model][1]
+		X = np.column_stack([logn, np.ones(len(logn))])
+		a, logc = np.linalg.lstsq(X, logt - b*logL, rcond=None)[0]
+	return (float(a), float(b), float(math.exp(logc)))
+
+def estimateCosts(dsizes, model='size', druntimes=None, verbose=False):
+	"""estimate the costs of tasks from their sizes {task:(n, L)}, using the cost model fitted on the run times {famid:time} of past tasks if provided"""
+	params = dcostmodels[model]
+	if druntimes:
+		lobs = [dsizes[task]+(druntimes[famseqstore.famidFromFileName(task)],) for task in dsizes if famseqstore.famidFromFileName(task) in druntimes]
+		try:
+			params = fitCostModel(lobs, model=model)
+			if verbose: print >> sys.stderr, "fitted cost model on %d past tasks: cost = %.3g * n^%.3g * L^%.3g"%(len(lobs), params[2], params[0], params[1])
+		except ValueError, e:
+			if verbose: print >> sys.stderr, "%s; use default cost model for '%s'"%(str(e), model)
+	return dict((task, costModel(n, L, params)) for task, (n, L) in dsizes.iteritems())
+
+def lptSchedule(dcosts, nbins, maxbinsize=None):
+	"""distribute tasks with costs {task:cost} among nbins bins with the longest-processing-time-first heuristic, with at most maxbinsize tasks per bin
+
+	returns the list of bins (lists of tasks by decreasing cost) and the list of their total costs.
+	"""
+	if maxbinsize and nbins*maxbinsize < len(dcosts):
+		raise ValueError, "cannot distribute %d tasks among %d bins of at most %d tasks"%(len(dcosts), nbins, maxbinsize)
+	bins = [[] for i in range(nbins)]
+	loads = [0.0]*nbins
+	heap = [(0.0, i) for i in range(nbins)]
+	for task in sorted(dcosts, key=lambda t: (-dcosts[t], t)):
+		load, i = heapq.heappop(heap)
+		bins[i].append(task)
+		loads[i] += dcosts[task]
+		if (not maxbinsize) or len(bins[i]) < maxbinsize:
+			heapq.heappush(heap, (loads[i], i))
+	return (bins, loads)
+
+def jobRanges(bins):
+	"""ranges of (1-based) task indices, in the format of PBS array job specification, of consecutive bins in a concatenated task list"""
+	lranges = []
+	k = 0
+	for b in bins:
+		if not b: continue
+		lranges.append('%d-%d'%(k+1, k+len(b)))
+		k += len(b)
+	return lranges
+
+def scheduleTaskList(nftasklist, model, chunksize=None, nbins=None, nfruntimes=None, nfout=None, verbose=False):
+	"""reorder a list of task input files so that consecutive chunks of at most chunksize tasks (or nbins chunks) have balanced costs
+
+	within each chunk, tasks are sorted by decreasing cost, so that the longest tasks are started first.
+	the reordered list is written to nfout (by default, the task list file is replaced); returns the job ranges of chunks.
+	"""
+	with open(nftasklist, 'r') as ftasklist:
+		ltasks = [line.strip() for line in ftasklist if line.strip()]
+	if not ltasks: return []
+	if not nbins: nbins = int(math.ceil(float(len(ltasks))/chunksize)) if chunksize else 1
+	dsizes = dict((task, taskSize(task, dmodelfmt[model])) for task in ltasks)
+	druntimes = readRunTimes(nfruntimes) if nfruntimes else None
+	dcosts = estimateCosts(dsizes, model=model, druntimes=druntimes, verbose=verbose)
+	bins, loads = lptSchedule(dcosts, nbins, maxbinsize=chunksize)
+	if verbose: print >> sys.stderr, "estimated costs of %d task chunks: min %.3g, max %.3g"%(nbins, min(loads), max(loads))
+	if not nfout: nfout = nftasklist
+	with open(nfout+'.tmp', 'w') as fout:
+		for b in bins: fout.writelines(["%s\n"%task for task in b])
+	os.rename(nfout+'.tmp', nfout)
+	return jobRanges(bins)
+
+def usage():
+	s = "Usage: python %s --tasklist=path/to/task_list --model=[%s] [--chunksize=N|--bins=N] [--runtime_log=path] [--output=path] [--verbose]\n"%(sys.argv[0], '|'.join(sorted(dcostmodels.keys())))
+	s += "  reorder the list of task input files so that consecutive chunks of tasks have balanced estimated costs, and print the job ranges of chunks.\n"
+	s += "  --chunksize\tmaximum number of tasks per chunk (e.g. maximum size of array jobs); the number of chunks is the minimum needed.\n"
+	s += "  --bins\t\tnumber of chunks (default: 1, i.e. only sort tasks by decreasing cost)\n"
+	s += "  --runtime_log\tGNU parallel job log or table (task input file, run time) from previous runs, used to fit the cost model\n"
+	s += "  --output\tpath of reordered task list (default: replace the input task list)\n"
+	return s
+
+if __name__=='__main__':
+
+	opts, args = getopt.getopt(sys.argv[1:], 'hv', ['tasklist=', 'model=', 'chunksize=', 'bins=', 'runtime_log=', 'output=', 'verbose', 'help'])
+	dopt = dict(opts)
+	if ('-h' in dopt) or ('--help' in dopt) or not ('--tasklist' in dopt and '--model' in dopt):
+		print usage()
+		sys.exit(0 if ('-h' in dopt) or ('--help' in dopt) else 1)
+	chunksize = int(dopt['--chunksize']) if '--chunksize' in dopt else None
+	nbins = int(dopt['--bins']) if '--bins' in dopt else None
+	verbose = ('-v' in dopt) or ('--verbose' in dopt)
+	print ' '.join(scheduleTaskList(dopt['--tasklist'], dopt['--model'], chunksize=chunksize, nbins=nbins, \
+	                                nfruntimes=dopt.get('--runtime_log'), nfout=dopt.get('--output'), verbose=verbose))